@@ -3,18 +3,40 @@
 Только синхронная обработка без дополнительных зависимостей
 """
 
+from __future__ import annotations
+
+import json
 import logging
 import os
 import time
-from typing import Dict, List
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Annotated, Any, Dict, List, Optional
 
-import numpy as np
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi import FastAPI, File, Form, HTTPException, Query, Request, Response, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from starlette.requests import ClientDisconnect
 import uvicorn
 
-from tone.pipeline import StreamingCTCPipeline
+from tone.inference_config import InferenceConfig
+from tone.onnx_wrapper import StreamingCTCModel
+from tone.pipeline import StreamingCTCPipeline, TextPhrase
+from tone.serving.admission import AdmissionConfig, LoadMonitor
+from tone.serving.audio_encoding import AudioEncoding, decode_audio
+from tone.serving.cache import TranscriptionCache, transcription_key
+from tone.serving.chunker import AudioChunker
+from tone.serving.scheduler import DeadlineScheduler, Priority
+from tone.triton_backend import TritonAcousticModel
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator
+
+    import numpy as np
+    import numpy.typing as npt
+    from starlette.types import Receive, Scope, Send
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -22,7 +44,22 @@ logger = logging.getLogger(__name__)
 
 # Конфигурация
 MODEL_PATH = os.getenv("MODEL_PATH", "/models")
+# Адрес Triton (KServe v2 HTTP): акустическая модель выполняется на удалённом сервере,
+# из MODEL_PATH загружается только языковая модель
+TRITON_URL = os.getenv("TRITON_URL") or None
+TRITON_MODEL_NAME = os.getenv("TRITON_MODEL_NAME", "streaming_acoustic")
+TRITON_IMPLICIT_STATE = os.getenv("TRITON_IMPLICIT_STATE", "0") == "1"  # Состояние потоков хранится на сервере
 MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", "50")) * 1024 * 1024  # 50MB
+# Кэш результатов /transcribe по хэшу аудио: число результатов в памяти (0 - без кэша в памяти),
+# каталог для дискового кэша, общего для всех процессов (не задан - без дискового кэша), и максимальный размер
+# дискового кэша
+TRANSCRIPTION_CACHE_ITEMS = int(os.getenv("TRANSCRIPTION_CACHE_ITEMS", "1024"))
+TRANSCRIPTION_CACHE_DIR = os.getenv("TRANSCRIPTION_CACHE_DIR") or None
+TRANSCRIPTION_CACHE_MAX_SIZE = int(os.getenv("TRANSCRIPTION_CACHE_MAX_MB", "1024")) * 1024 * 1024
+# Планировщик по дедлайнам: потоковые запросы и офлайн /transcribe обрабатываются одной моделью
+# общими батчами, офлайн-чанки занимают только свободные места в батче (0 - без планировщика)
+SCHEDULER_MAX_BATCH_SIZE = int(os.getenv("SCHEDULER_MAX_BATCH_SIZE", "0"))
+SCHEDULER_LIVE_BUDGET = float(os.getenv("SCHEDULER_LIVE_BUDGET_MS", "100")) / 1000
 
 # FastAPI приложение
 app = FastAPI(
@@ -40,77 +77,379 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Глобальная переменная для pipeline
-pipeline: StreamingCTCPipeline = None
+
+@dataclass
+class ServiceState:
+    """Pipeline и компоненты сервиса, создаваемые при запуске приложения.
+
+    Attributes:
+        pipeline: загруженный pipeline (None до загрузки)
+        transcription_cache: кэш результатов /transcribe (None - без кэша)
+        pipeline_fingerprint: отпечаток модели, LM и настроек декодера для ключей кэша
+        scheduler: планировщик по дедлайнам (None - без планировщика)
+        live_pipeline: pipeline потоковых запросов, работающий через планировщик
+        bulk_pipeline: pipeline офлайн-запросов, работающий через планировщик
+
+    """
+
+    pipeline: StreamingCTCPipeline | None = None
+    transcription_cache: TranscriptionCache | None = None
+    pipeline_fingerprint: str = ""
+    scheduler: DeadlineScheduler | None = None
+    live_pipeline: StreamingCTCPipeline | None = None
+    bulk_pipeline: StreamingCTCPipeline | None = None
+
+
+service = ServiceState()
+# Измеренная загрузка модели (RTF) для контроля допуска: офлайн-запросы отклоняются кодом 503
+# при меньшей загрузке, чем потоковые, пороги задаются TONE_ADMISSION_* переменными окружения
+load_monitor = LoadMonitor(AdmissionConfig.from_env())
 
 # Модели данных
 class HealthResponse(BaseModel):
     status: str
     pipeline_loaded: bool
     uptime: float
+    ready: bool
+    headroom: float
+    utilization: float
+    rtf: Optional[float]  # noqa: UP045 - Pydantic evaluates the annotation at runtime, also on Python 3.9
+    active_streams: int
+    # Провайдер ONNX Runtime, выбранный при запуске
+    execution_provider: Optional[str] = None  # noqa: UP045 - Pydantic evaluates the annotation at runtime
+
+def set_pipeline(new_pipeline: StreamingCTCPipeline) -> None:
+    """Использовать уже загруженный pipeline вместо загрузки при запуске.
+
+    Вызывается pre-fork запуском (tone/scripts/serve.py): модель загружается один раз
+    в родительском процессе, и обработчики всех процессов используют одни и те же веса.
+    """
+    service.pipeline = new_pipeline
 
 # Инициализация pipeline при запуске
 @app.on_event("startup")
-async def startup_event():
-    """Инициализация pipeline при запуске приложения"""
-    global pipeline
+async def startup_event() -> None:
+    """Инициализация pipeline при запуске приложения."""
     try:
-        logger.info(f"Загружаем модель из {MODEL_PATH}")
-        pipeline = StreamingCTCPipeline.from_local(MODEL_PATH)
-        logger.info("Pipeline успешно загружен")
+        if service.pipeline is None:
+            logger.info("Загружаем модель из %s", MODEL_PATH)
+            # Настройки ONNX Runtime, кэш оптимизированного графа и прогрев задаются через TONE_* переменные
+            # окружения; прогрев выполняется до того, как сервис начинает принимать запросы
+            acoustic_model = None
+            if TRITON_URL:
+                # Размеры модели на сервере берутся из манифеста model.json в каталоге локальных артефактов,
+                # отпечаток для ключей кэша - из локальной копии модели
+                acoustic_model = TritonAcousticModel.for_local_model(
+                    TRITON_URL,
+                    Path(MODEL_PATH) / "model.onnx",
+                    model_name=TRITON_MODEL_NAME,
+                    implicit_state=TRITON_IMPLICIT_STATE,
+                )
+                # Модель в режиме неявного состояния не прогревается конфигурацией Triton: прогрев выполняется
+                # короткими потоками до начала приёма запросов
+                acoustic_model.warmup()
+            service.pipeline = StreamingCTCPipeline.from_local(
+                MODEL_PATH,
+                inference_config=InferenceConfig.from_env(),
+                acoustic_model=acoustic_model,
+            )
+            logger.info("Pipeline успешно загружен")
+        pipeline = service.pipeline
+        if TRANSCRIPTION_CACHE_ITEMS > 0 or TRANSCRIPTION_CACHE_DIR:
+            # Отпечаток модели, LM и настроек декодера входит в ключ кэша,
+            # поэтому после смены модели старые результаты не используются
+            service.pipeline_fingerprint = pipeline.fingerprint
+            service.transcription_cache = TranscriptionCache(
+                max_memory_items=TRANSCRIPTION_CACHE_ITEMS,
+                disk_dir=TRANSCRIPTION_CACHE_DIR,
+                max_disk_bytes=TRANSCRIPTION_CACHE_MAX_SIZE,
+            )
+        if SCHEDULER_MAX_BATCH_SIZE > 0:
+            # Время вычислений батчей учитывает планировщик, не обработчики запросов
+            service.scheduler = DeadlineScheduler(
+                pipeline.model,
+                max_batch_size=SCHEDULER_MAX_BATCH_SIZE,
+                live_budget=SCHEDULER_LIVE_BUDGET,
+                monitor=load_monitor,
+                offline_model=pipeline.offline_model,
+            )
+            service.scheduler.start()
+            service.live_pipeline = service.scheduler.wrap(pipeline, Priority.LIVE)
+            service.bulk_pipeline = service.scheduler.wrap(pipeline, Priority.BULK)
+            logger.info("Планировщик по дедлайнам запущен, размер батча %d", SCHEDULER_MAX_BATCH_SIZE)
     except Exception as e:
         logger.error(f"Ошибка загрузки pipeline: {e}")
         raise
 
+@app.on_event("shutdown")
+async def shutdown_event() -> None:
+    """Остановка планировщика."""
+    if service.scheduler is not None:
+        service.scheduler.stop()
+
 # Эндпоинты
 @app.get("/health", response_model=HealthResponse)
-async def health_check():
-    """Проверка состояния сервиса"""
+async def health_check(response: Response) -> HealthResponse:
+    """Проверка состояния сервиса: готов, если pipeline загружен и есть запас по загрузке модели.
+
+    Неготовый сервис отвечает 503, чтобы балансировщик направлял запросы на другие экземпляры.
+    """
+    stats = load_monitor.stats()
+    loaded = service.pipeline is not None
+    ready = loaded and stats["ready"]
+    response.status_code = 200 if ready else 503
     return HealthResponse(
-        status="healthy",
-        pipeline_loaded=pipeline is not None,
-        uptime=time.time() - start_time
+        status="healthy" if ready else "overloaded" if loaded else "loading",
+        pipeline_loaded=loaded,
+        uptime=time.time() - start_time,
+        ready=ready,
+        headroom=stats["headroom"],
+        utilization=stats["utilization"],
+        rtf=stats["rtf"],
+        active_streams=stats["active_streams"],
+        execution_provider=execution_provider_name(),
     )
 
+def execution_provider_name() -> str | None:
+    """Имя провайдера ONNX Runtime локальной модели (None для Triton или до загрузки)."""
+    provider = getattr(service.pipeline.model, "execution_provider", None) if service.pipeline is not None else None
+    return provider.name if provider is not None else None
+
+def require_pipeline() -> StreamingCTCPipeline:
+    """Загруженный pipeline, до загрузки запрос отклоняется кодом 503."""
+    if service.pipeline is None:
+        raise HTTPException(status_code=503, detail="Pipeline не загружен")
+    return service.pipeline
+
+def parse_encoding(encoding: str) -> AudioEncoding:
+    """Кодировка аудио из параметра запроса, неподдерживаемая кодировка отклоняется кодом 400."""
+    try:
+        return AudioEncoding(encoding)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Неподдерживаемая кодировка: {encoding}") from None
+
+def check_admission(audio_seconds: float = 0.0) -> None:
+    """Отклонить офлайн-запрос кодом 503 и заголовком Retry-After, если модель загружена сверх порога.
+
+    Длительность принятого аудио учитывается в загрузке до вызова load_monitor.release_offline.
+    """
+    reason = load_monitor.admit_offline(audio_seconds)
+    if reason is not None:
+        logger.warning("Запрос отклонён: %s", reason)
+        raise HTTPException(
+            status_code=503,
+            detail=reason,
+            headers={"Retry-After": str(load_monitor.retry_after())},
+        )
+
+def phrase_to_dict(phrase: TextPhrase) -> dict[str, Any]:
+    """Фраза в формате ответа API."""
+    return {"text": phrase.text, "start_time": phrase.start_time, "end_time": phrase.end_time}
+
+@app.get("/metrics/cache")
+async def cache_metrics() -> dict[str, Any]:
+    """Статистика кэша результатов: попадания в память и на диск, промахи, размеры."""
+    if service.transcription_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **service.transcription_cache.stats()}
+
+@app.get("/metrics/scheduler")
+async def scheduler_metrics() -> dict[str, Any]:
+    """Статистика планировщика: батчи, потоковые и офлайн-чанки, пропущенные дедлайны, очереди."""
+    if service.scheduler is None:
+        return {"enabled": False}
+    return {"enabled": True, **service.scheduler.stats()}
+
+async def transcribe_offline(pipeline: StreamingCTCPipeline, audio: npt.NDArray[np.int32]) -> list[dict[str, Any]]:
+    """Офлайн-распознавание принятого аудио, длительность которого учитывается в загрузке до конца обработки."""
+    audio_seconds = len(audio) / StreamingCTCModel.SAMPLE_RATE
+    check_admission(audio_seconds)
+    start = time.time()
+    try:
+        if service.bulk_pipeline is not None:
+            # Офлайн-чанки ждут свободных мест в батчах, поэтому обработка идёт вне цикла событий
+            result = await run_in_threadpool(service.bulk_pipeline.forward_offline, audio)
+        else:
+            result = pipeline.forward_offline(audio)
+    finally:
+        load_monitor.release_offline(audio_seconds)
+    processing_time = time.time() - start
+    if service.scheduler is None:
+        load_monitor.record(audio_seconds, processing_time)
+    logger.info("Транскрипция завершена за %.2fс", processing_time)
+    return [phrase_to_dict(phrase) for phrase in result]
+
 @app.post("/transcribe", response_model=List[Dict])
 async def transcribe_audio(
-    file: UploadFile = File(...),
-    language: str = Form("ru")
-):
-    """Синхронная транскрипция аудио файла"""
-    if not pipeline:
-        raise HTTPException(status_code=503, detail="Pipeline не загружен")
-    
+    file: Annotated[UploadFile, File()],
+    language: Annotated[str, Form()] = "ru",
+    encoding: Annotated[str, Form()] = AudioEncoding.PCM_S16LE.value,
+) -> list[dict[str, Any]]:
+    """Синхронная транскрипция аудио файла (8 кГц моно: pcm_s16le, mulaw или alaw)."""
+    pipeline = require_pipeline()
+
     if file.size > MAX_FILE_SIZE:
         raise HTTPException(status_code=413, detail="Файл слишком большой")
-    
+    audio_encoding = parse_encoding(encoding)
+
     try:
-        # Читаем аудио файл
+        # Читаем аудио файл (G.711 декодируется таблицами сразу в int32)
         audio_data = await file.read()
-        audio_array = np.frombuffer(audio_data, dtype=np.int16).astype(np.int32)
-        
-        # Обрабатываем
-        start_time = time.time()
-        result = pipeline.forward_offline(audio_array)
-        processing_time = time.time() - start_time
-        
-        # Конвертируем результат
-        result_data = [
-            {
-                "text": phrase.text,
-                "start_time": phrase.start_time,
-                "end_time": phrase.end_time
-            }
-            for phrase in result
-        ]
-        logger.info(f"Транскрипция завершена за {processing_time:.2f}с")
-        
+
+        # Повторно присланное аудио отдаём из кэша без распознавания
+        cache = service.transcription_cache
+        cache_key = None
+        if cache is not None:
+            cache_key = transcription_key(
+                audio_data,
+                fingerprint=service.pipeline_fingerprint,
+                encoding=audio_encoding.value,
+            )
+            if (cached := cache.get(cache_key)) is not None:
+                logger.info("Результат транскрипции взят из кэша")
+                return cached
+
+        result_data = await transcribe_offline(pipeline, decode_audio(audio_data, audio_encoding))
+        if cache is not None and cache_key is not None:
+            cache.put(cache_key, result_data)
+
         return result_data
-        
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Ошибка транскрипции: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Форматы потоковой выдачи фраз: JSON по строке на фразу или Server-Sent Events
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+
+class UploadStreamingResponse(StreamingResponse):
+    """StreamingResponse, который не читает receive в фоне.
+
+    Стандартный StreamingResponse (ASGI spec < 2.4) в фоне читает receive в ожидании
+    отключения клиента и перехватывает куски тела запроса. Здесь тело читает сам
+    генератор ответа, отключение клиента он получает как ClientDisconnect.
+    """
+
+    async def __call__(self, _scope: Scope, _receive: Receive, send: Send) -> None:
+        """Отправить ответ, не читая receive."""
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+def format_stream_event(event: str, data: dict, output_format: str) -> str:
+    """Форматирование события потоковой выдачи."""
+    payload = json.dumps(data, ensure_ascii=False)
+    if output_format == "sse":
+        return f"event: {event}\ndata: {payload}\n\n"
+    return json.dumps({"event": event, **data}, ensure_ascii=False) + "\n"
+
+
+def forward_stream_chunk(
+    chunk: npt.NDArray[np.int32],
+    state: StreamingCTCPipeline.StateType | None,
+    *,
+    is_last: bool = False,
+) -> tuple[StreamingCTCPipeline.OutputType, StreamingCTCPipeline.StateType]:
+    """Распознавание чанка потоковой транскрипции, время вычислений учитывается в загрузке модели."""
+    if service.live_pipeline is not None:
+        # Чанки потоковой транскрипции обрабатываются по дедлайну раньше офлайн-чанков
+        return service.live_pipeline.forward(chunk, state, is_last=is_last)
+    with load_monitor.measure(len(chunk) / StreamingCTCModel.SAMPLE_RATE):
+        return require_pipeline().forward(chunk, state, is_last=is_last)
+
+
+async def read_stream_chunks(
+    request: Request,
+    chunker: AudioChunker,
+) -> AsyncIterator[tuple[npt.NDArray[np.int32], bool]]:
+    """Чанки аудио из тела запроса по мере загрузки и флаг последнего чанка.
+
+    Чанки - представления кольцевого буфера, они валидны до получения следующего чанка.
+    Если тело запроса больше MAX_FILE_SIZE, выбрасывается HTTPException.
+    """
+    async for data in request.stream():
+        if chunker.num_bytes + len(data) > MAX_FILE_SIZE:
+            raise HTTPException(status_code=413, detail="Файл слишком большой")
+        for chunk in chunker.feed(data):
+            yield chunk, False
+    for chunk, is_last in chunker.finish():
+        yield chunk, is_last
+
+
+async def transcribe_chunks(
+    request: Request,
+    chunker: AudioChunker,
+    output_format: str,
+    audio_seconds: float,
+) -> AsyncIterator[str]:
+    """События потоковой транскрипции: фразы по мере распознавания, затем ошибка или конец потока.
+
+    Зарезервированная длительность аудио освобождается в загрузке модели по окончании потока.
+    """
+    start = time.time()
+    state = None
+    finished = False
+    try:
+        async for chunk, is_last in read_stream_chunks(request, chunker):
+            phrases, state = await run_in_threadpool(forward_stream_chunk, chunk, state, is_last=is_last)
+            finished = is_last
+            for phrase in phrases:
+                yield format_stream_event("phrase", phrase_to_dict(phrase), output_format)
+    except ClientDisconnect:
+        logger.info("Клиент отключился во время потоковой транскрипции")
+        return
+    except HTTPException as error:
+        yield format_stream_event("error", {"detail": error.detail}, output_format)
+        return
+    except Exception as error:
+        logger.exception("Ошибка потоковой транскрипции")
+        yield format_stream_event("error", {"detail": str(error)}, output_format)
+        return
+    finally:
+        load_monitor.release_offline(audio_seconds)
+        if not finished:
+            # Состояние прерванного потока освобождается на сервере модели (Triton в режиме неявного состояния)
+            await run_in_threadpool(require_pipeline().release, state)
+    logger.info("Потоковая транскрипция завершена за %.2fс", time.time() - start)
+    yield format_stream_event("end", {}, output_format)
+
+
+@app.post("/transcribe/stream")
+async def transcribe_stream(
+    request: Request,
+    encoding: Annotated[str, Query()] = AudioEncoding.PCM_S16LE.value,
+    sample_rate: Annotated[int, Query()] = StreamingCTCModel.SAMPLE_RATE,
+    output_format: Annotated[str, Query(alias="format")] = "ndjson",
+) -> UploadStreamingResponse:
+    """Потоковая транскрипция: фразы возвращаются по мере загрузки и распознавания аудио (NDJSON или SSE).
+
+    Тело запроса - сырое аудио без заголовка (pcm_s16le, mulaw или alaw), допускается
+    Transfer-Encoding: chunked. Память и время до первой фразы не зависят от длины файла.
+    """
+    pipeline = require_pipeline()
+    if output_format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Неподдерживаемый формат: {output_format}")
+    content_length = int(request.headers.get("content-length", 0))
+    if content_length > MAX_FILE_SIZE:
+        raise HTTPException(status_code=413, detail="Файл слишком большой")
+    audio_encoding = parse_encoding(encoding)
+    try:
+        chunker = AudioChunker(audio_encoding, sample_rate=sample_rate, chunk_size=pipeline.CHUNK_SIZE)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Неподдерживаемая частота дискретизации: {sample_rate}") from None
+    # Загрузка файла - офлайн-работа, но принятый запрос уже не прерывается.
+    # Длительность аудио известна только по Content-Length, без него проверяется только текущая загрузка
+    audio_seconds = content_length / (audio_encoding.sample_width * sample_rate)
+    check_admission(audio_seconds)
+    return UploadStreamingResponse(
+        transcribe_chunks(request, chunker, output_format, audio_seconds),
+        media_type=STREAM_MEDIA_TYPES[output_format],
+    )
+
 # Глобальная переменная для отслеживания времени запуска
 start_time = time.time()
 
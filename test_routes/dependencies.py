@@ -1,15 +1,28 @@
+import atexit
+import threading
 import time
 import logging
 from typing import Optional
 import os
 
+from tone.inference_config import InferenceConfig
 from tone.pipeline import StreamingCTCPipeline
+from tone.serving.jobs import JobQueue, JobWorkerPool
 MODEL_PATH = os.getenv("MODEL_PATH", "/models")
+# Очередь асинхронных задач: файл SQLite, число процессов-обработчиков, время хранения результатов
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "/tmp/tone-jobs/jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "3600"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
 
 logger = logging.getLogger(__name__)
 
 # Глобальная переменная для pipeline
 pipeline: Optional[StreamingCTCPipeline] = None
+job_queue: Optional[JobQueue] = None
+job_workers: Optional[JobWorkerPool] = None
+# Зависимость вызывается в потоках, поэтому очередь создаётся под блокировкой
+_job_queue_lock = threading.Lock()
 start_time = time.time()
 
 async def get_pipeline() -> StreamingCTCPipeline:
@@ -18,11 +31,30 @@ async def get_pipeline() -> StreamingCTCPipeline:
     
     if pipeline is None:
         logger.info(f"Загружаем модель из {MODEL_PATH}")
-        pipeline = StreamingCTCPipeline.from_local(MODEL_PATH)
+        pipeline = StreamingCTCPipeline.from_local(MODEL_PATH, inference_config=InferenceConfig.from_env())
         logger.info("Pipeline успешно загружен")
     
     return pipeline
 
+def get_job_queue() -> JobQueue:
+    """Получить очередь задач (при первом вызове запускаются процессы-обработчики)"""
+    global job_queue, job_workers
+
+    with _job_queue_lock:
+        if job_queue is None:
+            queue = JobQueue(JOBS_DB_PATH, result_ttl=JOB_RESULT_TTL, max_attempts=JOB_MAX_ATTEMPTS)
+            # Каждый процесс держит свой pipeline, задачи из очереди разбираются параллельно;
+            # упавшие процессы перезапускает фоновый поток пула
+            job_workers = JobWorkerPool(
+                queue, MODEL_PATH, num_workers=JOB_WORKERS, inference_config=InferenceConfig.from_env()
+            )
+            job_workers.start()
+            atexit.register(job_workers.stop)
+            job_queue = queue
+            logger.info(f"Запущено {JOB_WORKERS} обработчиков очереди задач {JOBS_DB_PATH}")
+
+    return job_queue
+
 def get_start_time() -> float:
     """Получить время запуска приложения"""
     return start_time
\ No newline at end of file
@@ -6,10 +6,11 @@ import numpy as np
 from fastapi import APIRouter, File, Form, HTTPException, UploadFile, Depends, BackgroundTasks
 from fastapi.responses import JSONResponse
 from tone.pipeline import StreamingCTCPipeline
+from tone.serving.audio_encoding import AudioEncoding
+from tone.serving.jobs import FAILURE, PENDING, SUCCESS, JobQueue
 
 # Импортируем get_pipeline из main.py
-from .dependencies import get_pipeline
-from celery_tasks import transcribe_audio_task, get_task_status
+from .dependencies import get_job_queue, get_pipeline
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -61,23 +62,34 @@ async def transcribe_audio_sync(
 @router.post("/async", response_model=Dict)
 async def transcribe_audio_async(
     file: UploadFile = File(...),
-    language: str = Form("ru")
+    language: str = Form("ru"),
+    encoding: str = Form(AudioEncoding.PCM_S16LE.value),
+    priority: int = Form(0),
+    queue: JobQueue = Depends(get_job_queue)
 ):
-    """Асинхронная транскрипция аудио файла через Celery"""
+    """Асинхронная транскрипция аудио файла через локальную очередь задач"""
     if file.size > MAX_FILE_SIZE:
         raise HTTPException(status_code=413, detail="Файл слишком большой")
+
+    try:
+        audio_encoding = AudioEncoding(encoding)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Неподдерживаемая кодировка: {encoding}")
     
+    # Читаем аудио файл
+    audio_data = await file.read()
+    if audio_encoding == AudioEncoding.PCM_S16LE and len(audio_data) % 2 != 0:
+        # Такую задачу обработчик всё равно не сможет декодировать
+        raise HTTPException(status_code=400, detail="Длина PCM данных должна быть кратна 2 байтам")
+
     try:
-        # Читаем аудио файл
-        audio_data = await file.read()
+        # Ставим задачу в очередь (SQLite), её заберёт свободный обработчик; задачи с большим priority первыми
+        task_id = queue.submit(audio_data, encoding=audio_encoding, priority=priority)
         
-        # Запускаем задачу в Celery
-        task = transcribe_audio_task.delay(audio_data, language)
-        
-        logger.info(f"Запущена асинхронная транскрипция, task_id: {task.id}")
+        logger.info(f"Запущена асинхронная транскрипция, task_id: {task_id}")
         
         return {
-            "task_id": task.id,
+            "task_id": task_id,
             "status": "PENDING",
             "message": "Задача поставлена в очередь на обработку"
         }
@@ -88,45 +100,46 @@ async def transcribe_audio_async(
 
 
 @router.get("/status/{task_id}", response_model=Dict)
-async def get_transcription_status(task_id: str):
+async def get_transcription_status(task_id: str, queue: JobQueue = Depends(get_job_queue)):
     """Получить статус задачи транскрипции"""
     try:
-        result = get_task_status.delay(task_id)
-        status_info = result.get()
-        
-        return status_info
-        
+        status_info = queue.get(task_id)
     except Exception as e:
         logger.error(f"Ошибка получения статуса задачи {task_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+    if status_info is None:
+        # Как в Celery: неизвестная или устаревшая задача считается ожидающей
+        return {"task_id": task_id, "status": PENDING}
+    status_info.pop("result")
+    return status_info
+
 
 @router.get("/result/{task_id}", response_model=Dict)
-async def get_transcription_result(task_id: str):
+async def get_transcription_result(task_id: str, queue: JobQueue = Depends(get_job_queue)):
     """Получить результат транскрипции по task_id"""
     try:
-        from celery_config import celery_app
-        result = celery_app.AsyncResult(task_id)
-        
-        if result.state == "SUCCESS":
-            return {
-                "task_id": task_id,
-                "status": "SUCCESS",
-                "result": result.result
-            }
-        elif result.state == "FAILURE":
-            return {
-                "task_id": task_id,
-                "status": "FAILURE",
-                "error": str(result.info)
-            }
-        else:
-            return {
-                "task_id": task_id,
-                "status": result.state,
-                "message": "Задача еще не завершена"
-            }
-            
+        job = queue.get(task_id)
     except Exception as e:
         logger.error(f"Ошибка получения результата задачи {task_id}: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if job is not None and job["status"] == SUCCESS:
+        return {
+            "task_id": task_id,
+            "status": SUCCESS,
+            "result": job["result"]
+        }
+    elif job is not None and job["status"] == FAILURE:
+        return {
+            "task_id": task_id,
+            "status": FAILURE,
+            "error": job["error"]
+        }
+    else:
+        # Как в Celery: неизвестная или устаревшая задача считается ожидающей
+        return {
+            "task_id": task_id,
+            "status": job["status"] if job is not None else PENDING,
+            "message": "Задача еще не завершена"
+        }
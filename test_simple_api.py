@@ -6,23 +6,37 @@
 import requests
 import json
 import os
+import wave
 from pathlib import Path
 
 # Настройки
 API_URL = "http://localhost:8000"
 AUDIO_FILE = "tone/ml_audi.wav"
+UPLOAD_PIECE_SIZE = 32 * 1024  # Размер кусков тела запроса потоковой транскрипции (chunked)
 
 def test_health():
-    """Проверка состояния API"""
+    """Проверка состояния API
+
+    Неготовый сервис (модель загружается или перегружена) отвечает кодом 503 и тем же телом ответа,
+    API при этом доступен.
+    """
     print("🔍 Проверяем health endpoint...")
     try:
         response = requests.get(f"{API_URL}/health")
-        if response.status_code == 200:
+        if response.status_code in (200, 503):
             data = response.json()
-            print(f"✅ API работает!")
+            if response.status_code == 200:
+                print(f"✅ API работает!")
+            else:
+                print("⚠️  API доступен, но не готов принимать запросы (503)")
             print(f"   Статус: {data['status']}")
             print(f"   Pipeline загружен: {data['pipeline_loaded']}")
             print(f"   Время работы: {data['uptime']:.2f}с")
+            print(f"   Запас по загрузке: {data['headroom']:.2f}, загрузка модели: {data['utilization']:.2f}")
+            print(f"   Активных потоков: {data['active_streams']}, провайдер: {data['execution_provider']}")
+            if response.status_code == 503 and data['ready']:
+                print("❌ Ответ 503, но сервис считает себя готовым")
+                return False
             return True
         else:
             print(f"❌ Health check failed: {response.status_code}")
@@ -34,6 +48,28 @@ def test_health():
         print(f"❌ Ошибка: {e}")
         return False
 
+def test_metrics():
+    """Проверка метрик кэша результатов и планировщика"""
+    print("\n📊 Проверяем метрики...")
+    ok = True
+    for name in ("cache", "scheduler"):
+        try:
+            response = requests.get(f"{API_URL}/metrics/{name}", timeout=10)
+            if response.status_code != 200:
+                print(f"❌ /metrics/{name}: {response.status_code}")
+                ok = False
+                continue
+            data = response.json()
+            if not data.get("enabled"):
+                print(f"✅ /metrics/{name}: выключен")
+            else:
+                stats = ", ".join(f"{key}={value}" for key, value in data.items() if key != "enabled")
+                print(f"✅ /metrics/{name}: {stats}")
+        except Exception as e:
+            print(f"❌ Ошибка /metrics/{name}: {e}")
+            ok = False
+    return ok
+
 def test_transcribe(audio_file):
     """Тестирование транскрипции"""
     print(f"\n🎤 Тестируем транскрипцию файла: {audio_file}")
@@ -86,6 +122,84 @@ def test_transcribe(audio_file):
         print(f"❌ Ошибка: {e}")
         return False
 
+def read_pcm(audio_file):
+    """Сырое аудио pcm_s16le и частота дискретизации WAV-файла (моно, 16 бит)"""
+    with wave.open(audio_file, 'rb') as f:
+        if f.getnchannels() != 1 or f.getsampwidth() != 2:
+            raise ValueError(f"Нужен моно WAV 16 бит, а в файле {f.getnchannels()} каналов по {f.getsampwidth()} байт")
+        return f.readframes(f.getnframes()), f.getframerate()
+
+def parse_stream_events(response, output_format):
+    """События потоковой выдачи по мере получения: (событие, данные)"""
+    event = None
+    for line in response.iter_lines(decode_unicode=True):
+        if output_format == "ndjson":
+            if line:
+                data = json.loads(line)
+                yield data.pop("event"), data
+        elif line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: "):
+            yield event, json.loads(line[len("data: "):])
+
+def test_transcribe_stream(audio_file, output_format):
+    """Тестирование потоковой транскрипции (NDJSON или SSE)"""
+    print(f"\n🌊 Тестируем потоковую транскрипцию ({output_format}) файла: {audio_file}")
+
+    if not os.path.exists(audio_file):
+        print(f"❌ Файл {audio_file} не найден!")
+        return False
+
+    try:
+        audio, sample_rate = read_pcm(audio_file)
+
+        # Тело отправляется кусками (Transfer-Encoding: chunked), фразы приходят до конца загрузки
+        def pieces():
+            for start in range(0, len(audio), UPLOAD_PIECE_SIZE):
+                yield audio[start:start + UPLOAD_PIECE_SIZE]
+
+        print("📤 Отправляем запрос...")
+        with requests.post(
+            f"{API_URL}/transcribe/stream",
+            params={'encoding': 'pcm_s16le', 'sample_rate': sample_rate, 'format': output_format},
+            data=pieces(),
+            stream=True,
+            timeout=60
+        ) as response:
+            if response.status_code != 200:
+                print(f"❌ Ошибка потоковой транскрипции: {response.status_code}")
+                print(f"   Ответ: {response.text}")
+                return False
+            expected_type = "application/x-ndjson" if output_format == "ndjson" else "text/event-stream"
+            if not response.headers.get("content-type", "").startswith(expected_type):
+                print(f"❌ Неожиданный Content-Type: {response.headers.get('content-type')}")
+                return False
+
+            print("\n📝 Фразы по мере распознавания:")
+            phrases = 0
+            for event, data in parse_stream_events(response, output_format):
+                if event == "phrase":
+                    phrases += 1
+                    print(f"   {phrases}. {data['text']}")
+                    print(f"      Время: {data['start_time']:.2f}с - {data['end_time']:.2f}с")
+                elif event == "error":
+                    print(f"❌ Ошибка в потоке: {data['detail']}")
+                    return False
+                elif event == "end":
+                    if not phrases:
+                        print("   (Текст не распознан)")
+                    print("✅ Потоковая транскрипция успешна!")
+                    return True
+            print("❌ Поток оборвался без события end")
+            return False
+
+    except requests.exceptions.Timeout:
+        print("❌ Таймаут запроса. Файл слишком большой или сервер перегружен")
+        return False
+    except Exception as e:
+        print(f"❌ Ошибка: {e}")
+        return False
+
 def main():
     """Основная функция"""
     print("🚀 Тестирование Simple API")
@@ -97,11 +211,17 @@ def main():
         print("   docker run -p 8000:8000 -v ./models:/models t-one")
         return
     
-    # Тестируем транскрипцию
-    if test_transcribe(AUDIO_FILE):
+    # Тестируем транскрипцию, потоковую транскрипцию и метрики
+    results = [
+        test_transcribe(AUDIO_FILE),
+        test_transcribe_stream(AUDIO_FILE, "ndjson"),
+        test_transcribe_stream(AUDIO_FILE, "sse"),
+        test_metrics(),
+    ]
+    if all(results):
         print("\n🎉 Все тесты прошли успешно!")
     else:
-        print("\n❌ Тест транскрипции не прошел")
+        print(f"\n❌ Не прошло тестов: {results.count(False)} из {len(results)}")
 
 if __name__ == "__main__":
     main()
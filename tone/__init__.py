@@ -1,12 +1,42 @@
 """Package for the demonstration of T-one — a streaming CTC-based ASR pipeline for Russian."""
 
-from .decoder import BeamSearchCTCDecoder, DecoderType, GreedyCTCDecoder
-from .demo import read_audio, read_example_audio, read_stream_example_audio
-from .logprob_splitter import LogprobPhrase, StreamingLogprobSplitter
-from .onnx_wrapper import StreamingCTCModel
-from .pipeline import StreamingCTCPipeline, TextPhrase
+from __future__ import annotations
+
+import importlib
+from typing import TYPE_CHECKING, Any
+
 from .project import VERSION
 
+if TYPE_CHECKING:
+    from .decoder import BeamSearchCTCDecoder, DecoderType, GreedyCTCDecoder
+    from .demo import (
+        read_audio,
+        read_example_audio,
+        read_g711_audio,
+        read_multichannel_audio,
+        read_stream_example_audio,
+    )
+    from .logprob_splitter import LogprobPhrase, StreamingLogprobSplitter
+    from .onnx_wrapper import StreamingCTCModel
+    from .pipeline import StreamingCTCPipeline, TextPhrase
+
+# Public objects are resolved lazily on first access (PEP 562), so importing the package is cheap
+_LAZY_IMPORTS = {
+    "BeamSearchCTCDecoder": "tone.decoder",
+    "DecoderType": "tone.decoder",
+    "GreedyCTCDecoder": "tone.decoder",
+    "LogprobPhrase": "tone.logprob_splitter",
+    "StreamingCTCModel": "tone.onnx_wrapper",
+    "StreamingCTCPipeline": "tone.pipeline",
+    "StreamingLogprobSplitter": "tone.logprob_splitter",
+    "TextPhrase": "tone.pipeline",
+    "read_audio": "tone.demo.read_audio",
+    "read_example_audio": "tone.demo.read_audio",
+    "read_g711_audio": "tone.demo.read_audio",
+    "read_multichannel_audio": "tone.demo.read_audio",
+    "read_stream_example_audio": "tone.demo.read_audio",
+}
+
 __all__ = [
     "BeamSearchCTCDecoder",
     "DecoderType",
@@ -18,6 +48,22 @@ __all__ = [
     "TextPhrase",
     "read_audio",
     "read_example_audio",
+    "read_g711_audio",
+    "read_multichannel_audio",
     "read_stream_example_audio",
 ]
 __version__ = VERSION
+
+
+def __getattr__(name: str) -> Any:
+    """Import public object from its submodule on first access."""
+    if name not in _LAZY_IMPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY_IMPORTS[name]), name)
+    globals()[name] = value  # Cache the object, so the next access does not call __getattr__
+    return value
+
+
+def __dir__() -> list[str]:
+    """List module attributes including lazily imported ones."""
+    return sorted({*globals(), *__all__})
@@ -5,8 +5,6 @@ from __future__ import annotations
 import argparse
 from pathlib import Path
 
-from tone import StreamingCTCPipeline
-
 
 def parse_args() -> argparse.Namespace:
     """Parse command line arguments."""
@@ -33,6 +31,8 @@ def main() -> None:
     """Run main function for CLI."""
     args = parse_args()
     if args.command == "download":
+        from tone.pipeline import StreamingCTCPipeline  # Imported here to keep CLI startup fast
+
         download_dir: Path = args.download_dir.absolute()
         only_acoustic: bool = args.only_acoustic
         print(f"Downloading all artifacts from HuggingFace to {download_dir}")
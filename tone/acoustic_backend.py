@@ -0,0 +1,61 @@
+"""Module with the interface of acoustic model backends used by the pipeline."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Protocol, TypeVar, runtime_checkable
+
+from typing_extensions import TypeAlias
+
+if TYPE_CHECKING:
+    import numpy as np
+    import numpy.typing as npt
+
+    from tone.model_manifest import ModelManifest
+    from tone.onnx_wrapper import StreamingCTCModel
+
+# Handle of streams whose states are kept by the model server (implicit state): ids of the sequences, shape (B, 1)
+SequenceIds: TypeAlias = "npt.NDArray[np.int64]"
+# State a backend returns: the state itself, or a handle of it if the state is kept by the server
+BackendState: TypeAlias = "StreamingCTCModel.StateType | SequenceIds"
+
+_State = TypeVar("_State")
+
+
+@runtime_checkable
+class AcousticBackend(Protocol[_State]):
+    """Acoustic model the pipeline runs audio chunks through.
+
+    Implementations follow the `signal`/`state` contract of the exported model (and of
+    `configs/streaming_acoustic` in Triton): int32 signal of shape (B, 2400, 1) and fp16 state of
+    shape (B, 219729) in, fp32 log-probabilities of shape (B, 10, 35) and the next state out.
+    See `StreamingCTCModel` (local ONNX Runtime session) and `TritonAcousticModel` (remote server).
+
+    Sizes of the model (model variants may be exported with another chunk duration, see `ModelManifest`)
+    are available as attributes, the pipeline uses them to split audio and to compute time of phrases.
+    Size and type of the state (`manifest.numpy_state_dtype`) are used by callers batching states of
+    several streams, e.g. `DeadlineScheduler`.
+
+    The backend is generic in the state it returns: `StreamingCTCModel` returns the state itself
+    (`StreamingCTCModel.StateType`), a server keeping the states of the streams returns their handles
+    instead (`SequenceIds`), so `TritonAcousticModel` returns either of them (`BackendState`).
+    """
+
+    SAMPLE_RATE: int
+    MEAN_TIME_BIAS: float  # in seconds
+    AUDIO_CHUNK_SAMPLES: int  # in audio samples
+    FRAME_SIZE: float  # in seconds
+    STATE_SIZE: int
+    manifest: ModelManifest
+
+    @property
+    def fingerprint(self) -> str:
+        """Identity of the model: outputs of backends with the same fingerprint are the same."""
+        ...
+
+    def forward(
+        self,
+        audio_chunk: StreamingCTCModel.InputType,
+        state: _State | None = None,
+    ) -> tuple[StreamingCTCModel.OutputType, _State]:
+        """Run the acoustic model on a batch of audio chunks, see `StreamingCTCModel.forward`."""
+        ...
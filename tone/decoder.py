@@ -5,18 +5,18 @@ from __future__ import annotations
 import logging
 from enum import Enum
 from itertools import groupby
+from pathlib import Path
 from typing import TYPE_CHECKING
 
-if TYPE_CHECKING:
-    from pathlib import Path
-
 import numpy as np
 import numpy.typing as npt
-from huggingface_hub import hf_hub_download
-from pyctcdecode.decoder import BeamSearchDecoderCTC as _BeamSearchDecoderCTC
-from pyctcdecode.decoder import build_ctcdecoder
 from typing_extensions import Self
 
+from tone.onnx_wrapper import file_sha256
+
+if TYPE_CHECKING:
+    from pyctcdecode.decoder import BeamSearchDecoderCTC as _BeamSearchDecoderCTC
+
 logging.getLogger("pyctcdecode").setLevel(logging.ERROR)
 
 
@@ -37,6 +37,11 @@ class GreedyCTCDecoder:
     collapses repeats, and removes blank tokens. It does not support batching.
     """
 
+    @property
+    def fingerprint(self) -> str:
+        """Identity of the decoder and its settings."""
+        return "greedy"
+
     def forward(self, logprobs: npt.NDArray[np.float32]) -> str:
         """Decode log-probabilities using a greedy algorithm.
 
@@ -66,6 +71,10 @@ class BeamSearchCTCDecoder:
     Stateless. Batching is not supported; accepts any input length.
     """
 
+    ALPHA = 0.4  # Weight of the language model
+    BETA = 0.9  # Word insertion bonus
+    BEAM_WIDTH = 200
+
     _decoder: _BeamSearchDecoderCTC
 
     @classmethod
@@ -89,6 +98,8 @@ class BeamSearchCTCDecoder:
             str: Path to the downloaded decoder model file.
 
         """
+        from huggingface_hub import hf_hub_download
+
         return hf_hub_download(
             "t-tech/T-one",
             "kenlm.bin",
@@ -105,12 +116,29 @@ class BeamSearchCTCDecoder:
             Self: An instance of BeamSearchCTCDecoder ready for inference.
 
         """
-        decoder = build_ctcdecoder(labels=list(LABELS), kenlm_model_path=str(model_path), alpha=0.4, beta=0.9)
-        return cls(decoder)
+        from pyctcdecode.decoder import build_ctcdecoder
 
-    def __init__(self, decoder: _BeamSearchDecoderCTC) -> None:
-        """Create instance of BeamSearchCTCDecoder using internal decoder."""
+        decoder = build_ctcdecoder(
+            labels=list(LABELS),
+            kenlm_model_path=str(model_path),
+            alpha=cls.ALPHA,
+            beta=cls.BETA,
+        )
+        return cls(decoder, lm_path=Path(model_path))
+
+    def __init__(self, decoder: _BeamSearchDecoderCTC, *, lm_path: Path | None = None) -> None:
+        """Create instance of BeamSearchCTCDecoder using internal decoder (and path to its language model)."""
         self._decoder = decoder
+        self.lm_path = lm_path
+        self._fingerprint: str | None = None
+
+    @property
+    def fingerprint(self) -> str:
+        """Identity of the decoder, its settings and language model (hash of the file), computed on the first access."""
+        if self._fingerprint is None:
+            lm_id = file_sha256(self.lm_path)[:32] if self.lm_path is not None else f"decoder-{id(self._decoder):x}"
+            self._fingerprint = f"beam_search-a{self.ALPHA}-b{self.BETA}-w{self.BEAM_WIDTH}-{lm_id}"
+        return self._fingerprint
 
     def forward(self, logprobs: npt.NDArray[np.float32]) -> str:
         """Decode log-probabilities using beam search decoding.
@@ -130,4 +158,4 @@ class BeamSearchCTCDecoder:
             raise ValueError(f"Shape of 'logprobs' must be (L, 35), but got {logprobs.shape}")
         if logprobs.dtype != np.float32:
             raise ValueError(f"Incorrect dtype of 'logprobs': expected np.float32, but got {logprobs.dtype}")
-        return self._decoder.decode(logprobs, beam_width=200)  # type: ignore[arg-type]
+        return self._decoder.decode(logprobs, beam_width=self.BEAM_WIDTH)  # type: ignore[arg-type]
@@ -1,5 +1,17 @@
 """Modules containing demo website."""
 
-from .read_audio import read_audio, read_example_audio, read_stream_example_audio
+from .read_audio import (
+    read_audio,
+    read_example_audio,
+    read_g711_audio,
+    read_multichannel_audio,
+    read_stream_example_audio,
+)
 
-__all__ = ["read_audio", "read_example_audio", "read_stream_example_audio"]
+__all__ = [
+    "read_audio",
+    "read_example_audio",
+    "read_g711_audio",
+    "read_multichannel_audio",
+    "read_stream_example_audio",
+]
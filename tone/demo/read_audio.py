@@ -9,6 +9,7 @@ import numpy as np
 import numpy.typing as npt
 
 from tone.pipeline import StreamingCTCPipeline
+from tone.serving.audio_encoding import AudioEncoding, decode_audio
 
 if TYPE_CHECKING:
     from collections.abc import Iterator
@@ -53,6 +54,60 @@ def read_audio(path_to_file: Path | str) -> npt.NDArray[np.int32]:
     return np.asarray(audio.samples, dtype=np.int16).astype(np.int32)
 
 
+def read_multichannel_audio(path_to_file: Path | str) -> npt.NDArray[np.int32]:
+    """Load an audio file keeping its channels separate (e.g. agent and customer of a call recording).
+
+    Uses the `miniaudio` package for decoding. Resamples every channel to 16-bit @ 8 kHz.
+
+    Args:
+        path_to_file (Path | str): Path to the audio file to load.
+
+    Returns:
+        npt.NDArray[np.int32]: Audio samples as a 2D numpy array of shape (channels, samples) (dtype=int32).
+
+    Raises:
+        ModuleNotFoundError: If `miniaudio` is not installed.
+
+    """
+    try:
+        import miniaudio
+    except ImportError as e:
+        raise ModuleNotFoundError(
+            "Package 'miniaudio' not found.\n"
+            "Install it with the following command:\n"
+            "  poetry install -E demo   # using package extras\n",
+        ) from e
+
+    nchannels = miniaudio.get_file_info(str(path_to_file)).nchannels
+    audio = miniaudio.decode_file(str(path_to_file), nchannels=nchannels, sample_rate=8000)
+    assert audio.sample_rate == 8000
+    # Samples of the channels are interleaved
+    samples = np.asarray(audio.samples, dtype=np.int16).reshape(-1, audio.nchannels)
+    return np.ascontiguousarray(samples.T).astype(np.int32)
+
+
+def read_g711_audio(
+    path_to_file: Path | str,
+    encoding: AudioEncoding | str = AudioEncoding.MULAW,
+) -> npt.NDArray[np.int32]:
+    """Load a headerless 8kHz mono G.711 file (e.g. `.ul` or `.al`) and return it as an int32 numpy array.
+
+    Unlike `read_audio`, it does not require `miniaudio` and decodes samples with lookup tables.
+
+    Args:
+        path_to_file (Path | str): Path to the audio file to load.
+        encoding (AudioEncoding | str): Encoding of the file: "mulaw" or "alaw".
+
+    Returns:
+        npt.NDArray[np.int32]: Audio samples as a 1D numpy array (dtype=int32).
+
+    """
+    encoding = AudioEncoding(encoding)
+    if encoding == AudioEncoding.PCM_S16LE:
+        raise ValueError("Use 'read_audio' to read PCM audio files")
+    return decode_audio(Path(path_to_file).read_bytes(), encoding)
+
+
 def read_stream_example_audio(*, long_audio: bool = False) -> Iterator[StreamingCTCPipeline.InputType]:
     """Simple example of streaming audio source using example audio from the package."""
     chunk_size = StreamingCTCPipeline.CHUNK_SIZE
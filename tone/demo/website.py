@@ -2,24 +2,45 @@
 
 from __future__ import annotations
 
+import asyncio
 import os
+import uuid
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any
 
-import numpy as np
-import numpy.typing as npt
-from fastapi import APIRouter, FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, FastAPI, WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 
-from tone.pipeline import StreamingCTCPipeline
+from tone.inference_config import InferenceConfig
+from tone.onnx_wrapper import StreamingCTCModel
+from tone.pipeline import StreamingCTCPipeline, TextPhrase
 from tone.project import VERSION
+from tone.serving.admission import AdmissionConfig, LoadMonitor
+from tone.serving.audio_encoding import AudioEncoding
+from tone.serving.chunker import AudioChunker
+from tone.serving.elastic import ELASTIC_STATE_CODEC, ElasticConfig, ElasticPipeline, ElasticPolicy
+from tone.serving.scheduler import DeadlineScheduler, Priority
+from tone.serving.sessions import SessionManager
+from tone.serving.shm_transport import InferenceClient, InferenceError
+from tone.serving.thread_pool import ThreadedPipeline, split_threads
+from tone.triton_backend import TritonAcousticModel
 
 if TYPE_CHECKING:
-    from collections.abc import AsyncIterator
+    from collections.abc import AsyncIterator, Callable
 
-_BYTES_PER_SAMPLE = 2
+    import numpy as np
+    import numpy.typing as npt
+
+_MAX_CREDITS = 8  # Maximum number of messages a client can send ahead in "credits" flow control mode
+
+
+def _env_path(name: str) -> Path | None:
+    """Return the path from the environment variable, or None if it is not set or empty."""
+    value = os.getenv(name)
+    return Path(value) if value else None
 
 
 @dataclass
@@ -31,12 +52,34 @@ class Settings:
 
     cors_allow_all: bool = False
     load_from_folder: Path | None = field(default_factory=lambda: os.getenv("LOAD_FROM_FOLDER", None))
+    inference_config: InferenceConfig = field(default_factory=InferenceConfig.from_env)
+    session_memory_budget_mb: int = field(default_factory=lambda: int(os.getenv("SESSION_MEMORY_BUDGET_MB", "2048")))
+    session_idle_timeout: float = field(default_factory=lambda: float(os.getenv("SESSION_IDLE_TIMEOUT", "10")))
+    session_spill_dir: Path | None = field(default_factory=lambda: _env_path("SESSION_SPILL_DIR"))
+    admission: AdmissionConfig = field(default_factory=AdmissionConfig.from_env)
+    triton_url: str | None = field(default_factory=lambda: os.getenv("TRITON_URL", None))
+    triton_model_name: str = field(default_factory=lambda: os.getenv("TRITON_MODEL_NAME", "streaming_acoustic"))
+    triton_implicit_state: bool = field(default_factory=lambda: os.getenv("TRITON_IMPLICIT_STATE", "0") == "1")
+    elastic_model_path: Path | None = field(default_factory=lambda: _env_path("ELASTIC_MODEL_PATH"))
+    elastic: ElasticConfig = field(default_factory=ElasticConfig.from_env)
+    pipeline_threads: int = field(default_factory=lambda: int(os.getenv("PIPELINE_THREADS", "0")))
+    scheduler_max_batch_size: int = field(default_factory=lambda: int(os.getenv("SCHEDULER_MAX_BATCH_SIZE", "0")))
+    scheduler_live_budget: float = field(
+        default_factory=lambda: float(os.getenv("SCHEDULER_LIVE_BUDGET_MS", "100")) / 1000,
+    )
 
 
 class SingletonPipeline:
-    """Singleton object to store a single ASR pipeline."""
+    """Singleton object to store a single ASR pipeline and states of its sessions."""
 
     pipeline: StreamingCTCPipeline | None = None
+    sessions: SessionManager[Any] | None = None  # States of `ElasticPipeline` if `elastic` is set
+    client: InferenceClient | None = None  # Set if the pipeline runs in separate inference workers
+    monitor: LoadMonitor | None = None
+    elastic: ElasticPipeline | None = None  # Set if sessions are moved to a longer-chunk model under load
+    threaded: ThreadedPipeline | None = None  # Set if chunks of the sessions are processed in a pool of threads
+    scheduler: DeadlineScheduler | None = None  # Set if chunks of all sessions are batched by deadlines
+    live_pipeline: StreamingCTCPipeline | None = None  # Pipeline running its models through `scheduler`
 
     def __new__(cls) -> None:
         """Ensure the class is never created."""
@@ -45,10 +88,76 @@ class SingletonPipeline:
     @classmethod
     def init(cls, settings: Settings) -> None:
         """Initialize singleton object using settings."""
+        cls.sessions = SessionManager(
+            settings.session_memory_budget_mb * 1024 * 1024,
+            idle_timeout=settings.session_idle_timeout,
+            spill_dir=settings.session_spill_dir,
+            codec=ELASTIC_STATE_CODEC if settings.elastic_model_path and cls.client is None else None,
+        )
+        if cls.client is not None:  # See `set_inference_client`
+            # Compute time is not seen by front-ends, so the load is judged by the queue of the inference workers
+            cls.monitor = LoadMonitor(settings.admission, queue_depth=cls.client.queue_depth)
+            cls.client.start()
+            return
+        cls.monitor = LoadMonitor(settings.admission)
+        if cls.pipeline is None:  # Otherwise already loaded, see `set_pipeline`
+            cls.pipeline = cls._load_pipeline(settings)
+        if settings.scheduler_max_batch_size > 0:
+            if settings.elastic_model_path:
+                raise ValueError("Elastic chunk size cannot be used with the deadline scheduler")
+            # Streams are live traffic of the scheduler, so bulk work submitted to it in this process
+            # (e.g. `scheduler.wrap(pipeline, Priority.BULK).forward_offline`) yields to them
+            cls.scheduler = DeadlineScheduler(
+                cls.pipeline.model,
+                max_batch_size=settings.scheduler_max_batch_size,
+                live_budget=settings.scheduler_live_budget,
+                monitor=cls.monitor,
+                offline_model=cls.pipeline.offline_model,
+            )
+            cls.scheduler.start()
+            cls.live_pipeline = cls.scheduler.wrap(cls.pipeline, Priority.LIVE)
+        if settings.pipeline_threads > 0:
+            cls.threaded = ThreadedPipeline(cls.live_pipeline or cls.pipeline, pool_size=settings.pipeline_threads)
+        if settings.elastic_model_path:
+            cls.elastic = ElasticPipeline(
+                cls.pipeline,
+                StreamingCTCModel.from_local(settings.elastic_model_path, config=settings.inference_config),
+                ElasticPolicy(cls.monitor, settings.elastic),
+            )
+
+    @staticmethod
+    def _load_pipeline(settings: Settings) -> StreamingCTCPipeline:
+        inference_config = settings.inference_config
+        if settings.pipeline_threads > 0:  # The cores are split between the threads processing sessions
+            inference_config = split_threads(inference_config, settings.pipeline_threads)
+        # The acoustic model runs on a remote Triton server if its address is set
+        acoustic_model = None
+        if settings.triton_url and settings.load_from_folder is not None:
+            # Sizes and fingerprint of the served model are taken from its local copy
+            acoustic_model = TritonAcousticModel.for_local_model(
+                settings.triton_url,
+                Path(settings.load_from_folder) / "model.onnx",
+                model_name=settings.triton_model_name,
+                implicit_state=settings.triton_implicit_state,
+            )
+        elif settings.triton_url:  # The published model is served
+            acoustic_model = TritonAcousticModel(
+                settings.triton_url,
+                model_name=settings.triton_model_name,
+                implicit_state=settings.triton_implicit_state,
+            )
+        if acoustic_model is not None:  # Warmup of a model with implicit state is not in its Triton config
+            acoustic_model.warmup()
         if settings.load_from_folder is None:
-            cls.pipeline = StreamingCTCPipeline.from_hugging_face()
-        else:
-            cls.pipeline = StreamingCTCPipeline.from_local(settings.load_from_folder)
+            return StreamingCTCPipeline.from_hugging_face(
+                inference_config=inference_config,
+                acoustic_model=acoustic_model,
+            )
+        return StreamingCTCPipeline.from_local(
+            settings.load_from_folder,
+            inference_config=inference_config,
+            acoustic_model=acoustic_model,
+        )
 
     @classmethod
     def process_chunk(
@@ -64,56 +173,257 @@ class SingletonPipeline:
         """
         if cls.pipeline is None:
             raise RuntimeError("Pipeline is not initialized")
-        return cls.pipeline.forward(audio_chunk, state, is_last=is_last)
+        if cls.threaded is not None:  # Called in a thread of the pool, see `process_session_chunk_async`
+            return cls.threaded.forward(audio_chunk, state, is_last=is_last)
+        return (cls.live_pipeline or cls.pipeline).forward(audio_chunk, state, is_last=is_last)
+
+    @classmethod
+    def process_session_chunk(
+        cls,
+        session_id: str,
+        audio_chunk: StreamingCTCPipeline.InputType,
+        *,
+        is_last: bool = False,
+    ) -> StreamingCTCPipeline.OutputType:
+        """Process audio chunk of the session keeping its state in the session manager."""
+        if cls.sessions is None:
+            raise RuntimeError("Pipeline is not initialized")
+        process_chunk: Callable[..., tuple[StreamingCTCPipeline.OutputType, Any]] = (
+            cls.elastic.forward if cls.elastic is not None else cls.process_chunk
+        )
+        if cls.monitor is None or cls.scheduler is not None:  # The scheduler reports the compute time of batches
+            output, state = process_chunk(audio_chunk, cls.sessions.get(session_id), is_last=is_last)
+        else:
+            with cls.monitor.measure(len(audio_chunk) / StreamingCTCModel.SAMPLE_RATE):
+                output, state = process_chunk(audio_chunk, cls.sessions.get(session_id), is_last=is_last)
+        if is_last:  # The stream is finished, its state is not needed anymore
+            cls.sessions.close(session_id)
+        else:
+            cls.sessions.put(session_id, state)
+        return output
+
+    @classmethod
+    async def process_session_chunk_async(
+        cls,
+        session_id: str,
+        audio_chunk: StreamingCTCPipeline.InputType,
+        *,
+        is_last: bool = False,
+    ) -> StreamingCTCPipeline.OutputType:
+        """Process audio chunk of the session in the pool of threads if it is enabled, see `process_session_chunk`."""
+        if cls.threaded is None and cls.scheduler is not None:  # Wait for the batch outside of the event loop
+            return await asyncio.to_thread(cls.process_session_chunk, session_id, audio_chunk, is_last=is_last)
+        if cls.threaded is None:
+            return cls.process_session_chunk(session_id, audio_chunk, is_last=is_last)
+        future = cls.threaded.submit(cls.process_session_chunk, session_id, audio_chunk, is_last=is_last)
+        return await asyncio.wrap_future(future)
+
+    @classmethod
+    def close_session(cls, session_id: str) -> None:
+        """Forget the state of the session."""
+        if cls.sessions is None:
+            return
+        # The session is aborted before its last chunk: only a state kept by the model server is released,
+        # other states are dropped without restoring them from disk (states of elastic sessions are local)
+        if (
+            cls.pipeline is not None
+            and cls.elastic is None
+            and getattr(cls.pipeline.model, "implicit_state", False)
+            and (state := cls.sessions.get(session_id)) is not None
+        ):
+            cls.pipeline.release(state)
+        cls.sessions.close(session_id)
+
+    @classmethod
+    def shutdown(cls) -> None:
+        """Stop the deadline scheduler if it is running."""
+        if cls.scheduler is not None:
+            cls.scheduler.stop()
+            cls.scheduler = None
+
+    @classmethod
+    async def hibernate_idle_sessions(cls, period: float = 1.0) -> None:
+        """Periodically spill states of idle sessions to disk."""
+        while True:
+            await asyncio.sleep(period)
+            if cls.sessions is not None:  # Serialization and writes to disk, outside of the event loop
+                await asyncio.to_thread(cls.sessions.hibernate_idle)
 
 
 router = APIRouter()
 
 
-async def get_chunk_stream(ws: WebSocket) -> AsyncIterator[tuple[npt.NDArray[np.int16], bool]]:
-    """Get audio chunks from websocket and return them as async iterator."""
-    audio_data = bytearray()
-    # See description of PADDING in StreamingCTCPipeline
-    audio_data.extend(np.zeros((StreamingCTCPipeline.PADDING,), dtype=np.int16).tobytes())
+def set_pipeline(pipeline: StreamingCTCPipeline) -> None:
+    """Use already loaded pipeline instead of loading it on startup (used by the pre-fork launcher)."""
+    SingletonPipeline.pipeline = pipeline
+
+
+def set_inference_client(client: InferenceClient) -> None:
+    """Send audio to separate inference workers instead of loading the pipeline (used by the split launcher)."""
+    SingletonPipeline.client = client
+
+
+async def _create_chunker(ws: WebSocket) -> AudioChunker | None:
+    """Create audio chunker for the format from query parameters or close the websocket if it is not supported."""
+    try:
+        encoding = AudioEncoding(ws.query_params.get("encoding", AudioEncoding.PCM_S16LE.value))
+    except ValueError:
+        await ws.close(code=status.WS_1003_UNSUPPORTED_DATA, reason="Unsupported audio encoding")
+        return None
+    if SingletonPipeline.client is not None:  # Chunks of the pipeline of the inference workers
+        chunk_size = SingletonPipeline.client.chunk_size
+    elif SingletonPipeline.pipeline is not None:
+        chunk_size = SingletonPipeline.pipeline.CHUNK_SIZE
+    else:
+        raise RuntimeError("Pipeline is not initialized")
+    try:
+        sample_rate = int(ws.query_params.get("sample_rate", StreamingCTCModel.SAMPLE_RATE))
+        return AudioChunker(encoding, sample_rate=sample_rate, chunk_size=chunk_size)
+    except ValueError:
+        await ws.close(code=status.WS_1003_UNSUPPORTED_DATA, reason="Unsupported sample rate")
+        return None
+
+
+async def get_chunk_stream(ws: WebSocket) -> AsyncIterator[tuple[npt.NDArray[np.int32], bool]]:
+    """Get audio chunks from websocket and return them as async iterator.
+
+    Flow control mode is selected with `flow_control` query parameter:
+        - "ready" (default): the server sends `{"event": "ready"}` before receiving each message;
+        - "credits": the server grants credits with `{"event": "credit", "credits": N}` messages, each credit
+          allows the client to send one more message, so several messages can be in flight at once.
+
+    Audio encoding is selected with `encoding` query parameter: "pcm_s16le" (default), "mulaw" or "alaw".
+    Sample rate of the client audio is selected with `sample_rate` query parameter (8000 by default),
+    audio of other sample rates is resampled on the server chunk-by-chunk.
+
+    Chunks are views into a ring buffer and are valid only until the next iteration.
+    """
+    use_credits = ws.query_params.get("flow_control", "ready") == "credits"
+    if (chunker := await _create_chunker(ws)) is None:
+        return
 
-    is_last = False
+    granted = 0  # Number of messages the client is allowed to send
     while True:
-        await ws.send_json({"event": "ready"})
+        if not use_credits:
+            await ws.send_json({"event": "ready"})
+        elif granted <= _MAX_CREDITS // 2:  # Grant credits in batches to reduce the number of messages
+            await ws.send_json({"event": "credit", "credits": _MAX_CREDITS - granted})
+            granted = _MAX_CREDITS
         recv_bytes = await ws.receive_bytes()
+        granted -= 1
+
         if len(recv_bytes) == 0:  # Last chunk of audio
-            is_last = True
-            audio_data.extend(np.zeros((StreamingCTCPipeline.PADDING,), dtype=np.int16).tobytes())
-            fill_chunk_size = -(len(audio_data) // _BYTES_PER_SAMPLE) % StreamingCTCPipeline.CHUNK_SIZE
-            audio_data.extend(np.zeros((fill_chunk_size,), dtype=np.int16).tobytes())
-        else:
-            audio_data.extend(recv_bytes)
+            for chunk, is_last in chunker.finish():
+                yield chunk, is_last
+            return
+        for chunk in chunker.feed(recv_bytes):
+            yield chunk, False
 
-        while len(audio_data) >= StreamingCTCPipeline.CHUNK_SIZE * _BYTES_PER_SAMPLE:
-            chunk = np.frombuffer(audio_data[: StreamingCTCPipeline.CHUNK_SIZE * _BYTES_PER_SAMPLE], dtype=np.int16)
-            del audio_data[: StreamingCTCPipeline.CHUNK_SIZE * _BYTES_PER_SAMPLE]
-            yield chunk, is_last and (len(audio_data) == 0)
 
-        if len(recv_bytes) == 0:
-            return
+async def _send_phrase(ws: WebSocket, phrase: TextPhrase) -> None:
+    await ws.send_json(
+        {
+            "event": "transcript",
+            "phrase": {"text": phrase.text, "start_time": phrase.start_time, "end_time": phrase.end_time},
+        },
+    )
 
 
-@router.websocket("/ws")
-async def websocket_stt(ws: WebSocket) -> None:
-    """Websocket endpoint for streaming audio processing."""
-    await ws.accept()
+async def _remote_stt(ws: WebSocket, client: InferenceClient) -> None:
+    """Stream audio chunks to an inference worker and phrases back to the websocket concurrently."""
+    session = client.open_session()
+
+    async def send_phrases() -> None:
+        try:
+            async for phrase in session:
+                await _send_phrase(ws, phrase)
+        except InferenceError:
+            await ws.close(code=status.WS_1011_INTERNAL_ERROR, reason="Recognition failed")
+
+    sender = asyncio.create_task(send_phrases())
+    try:
+        async for audio_chunk, is_last in get_chunk_stream(ws):
+            await session.send(audio_chunk, is_last=is_last)
+        await sender
+    except (WebSocketDisconnect, RuntimeError):  # RuntimeError: websocket was closed on error of the session
+        pass
+    finally:
+        sender.cancel()
+        await session.close()
+
+
+async def _local_stt(ws: WebSocket) -> None:
+    """Process audio chunks of the websocket with the pipeline of this process."""
+    session_id = uuid.uuid4().hex
     try:
-        state: StreamingCTCPipeline.StateType | None = None
         async for audio_chunk, is_last in get_chunk_stream(ws):
-            output, state = SingletonPipeline.process_chunk(audio_chunk.astype(np.int32), state, is_last=is_last)
+            output = await SingletonPipeline.process_session_chunk_async(session_id, audio_chunk, is_last=is_last)
             for phrase in output:
-                await ws.send_json(
-                    {
-                        "event": "transcript",
-                        "phrase": {"text": phrase.text, "start_time": phrase.start_time, "end_time": phrase.end_time},
-                    },
-                )
+                await _send_phrase(ws, phrase)
     except WebSocketDisconnect:
         pass
+    finally:
+        await asyncio.to_thread(SingletonPipeline.close_session, session_id)
+
+
+async def _admit(ws: WebSocket, monitor: LoadMonitor) -> bool:
+    """Check that the server has capacity for a new stream or reject it with "try again later" close code.
+
+    If another server is configured, `{"event": "redirect", "url": ...}` is sent before closing.
+    """
+    if (reason := monitor.admit_stream()) is None:
+        return True
+    if monitor.config.redirect_url is not None:
+        await ws.send_json({"event": "redirect", "url": monitor.config.redirect_url})
+    await ws.close(code=status.WS_1013_TRY_AGAIN_LATER, reason=reason)
+    return False
+
+
+@router.get("/health")
+async def health() -> JSONResponse:
+    """Readiness of the server to accept new streams based on the headroom of the acoustic stage."""
+    monitor = SingletonPipeline.monitor
+    if monitor is None:
+        return JSONResponse({"ready": False}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    stats = monitor.stats()
+    code = status.HTTP_200_OK if stats["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE
+    return JSONResponse(stats, status_code=code)
+
+
+@router.get("/elastic")
+async def elastic_stats() -> JSONResponse:
+    """Choice of the elastic chunk size policy, switches of sessions and RTF of the short and the long model."""
+    if SingletonPipeline.elastic is None:
+        return JSONResponse({"enabled": False})
+    return JSONResponse({"enabled": True, **SingletonPipeline.elastic.stats()})
+
+
+@router.get("/scheduler")
+async def scheduler_stats() -> JSONResponse:
+    """Numbers of batches and chunks of the deadline scheduler and missed deadlines of the streams."""
+    if SingletonPipeline.scheduler is None:
+        return JSONResponse({"enabled": False})
+    return JSONResponse({"enabled": True, **SingletonPipeline.scheduler.stats()})
+
+
+@router.websocket("/ws")
+async def websocket_stt(ws: WebSocket) -> None:
+    """Websocket endpoint for streaming audio processing.
+
+    New streams are rejected with 1013 (try again later) close code when the server is at capacity.
+    """
+    await ws.accept()
+    monitor = SingletonPipeline.monitor
+    if monitor is None:
+        await ws.close(code=status.WS_1013_TRY_AGAIN_LATER, reason="Pipeline is not initialized")
+        return
+    if not await _admit(ws, monitor):
+        return
+    with monitor.track_stream():
+        if SingletonPipeline.client is not None:
+            await _remote_stt(ws, SingletonPipeline.client)
+        else:
+            await _local_stt(ws)
 
 
 def get_application() -> FastAPI:
@@ -130,6 +440,13 @@ def get_application() -> FastAPI:
         )
 
     app.add_event_handler("startup", lambda: SingletonPipeline.init(settings))
+    background_tasks: set[asyncio.Task] = set()  # Keep references, so tasks are not garbage collected
+    app.add_event_handler(
+        "startup",
+        lambda: background_tasks.add(asyncio.create_task(SingletonPipeline.hibernate_idle_sessions())),
+    )
+    app.add_event_handler("shutdown", lambda: [task.cancel() for task in background_tasks])
+    app.add_event_handler("shutdown", SingletonPipeline.shutdown)
 
     app.include_router(router, prefix="/api")
     app.mount("/", StaticFiles(directory=Path(__file__).parent / "static", html=True), name="Main website page")
@@ -0,0 +1,231 @@
+"""Module with ONNX Runtime inference settings for the acoustic model."""
+
+from __future__ import annotations
+
+import dataclasses
+import json
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from typing_extensions import Self
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Mapping
+
+    import onnxruntime as ort
+
+GRAPH_OPTIMIZATION_LEVELS = ("disable", "basic", "extended", "all")
+TUNED_CONFIG_VARIABLE = "INFERENCE_CONFIG"
+DEFAULT_PROVIDER = "CPUExecutionProvider"
+
+
+def _parse_bool(value: str) -> bool:
+    if value.lower() in {"1", "true", "yes", "on"}:
+        return True
+    if value.lower() in {"0", "false", "no", "off"}:
+        return False
+    raise ValueError(f"Incorrect boolean value: {value!r}")
+
+
+# Settings of the session that can be overridden for a single execution provider
+SESSION_SETTINGS: dict[str, Callable[[str], Any]] = {
+    "intra_op_num_threads": int,
+    "inter_op_num_threads": int,
+    "graph_optimization_level": str.lower,
+    "enable_cpu_mem_arena": _parse_bool,
+    "enable_mem_pattern": _parse_bool,
+}
+
+
+def read_tuned_settings(section: str, prefix: str = "TONE_") -> dict[str, Any]:
+    """Return a section of the tuned config file named by the `{prefix}INFERENCE_CONFIG` variable.
+
+    The file is written by `tone.scripts.autotune`: section "inference" holds `InferenceConfig` settings,
+    section "server" holds the number of workers and the maximum batch size. If the variable is not set,
+    an empty dict is returned.
+    """
+    path = os.getenv(f"{prefix}{TUNED_CONFIG_VARIABLE}")
+    if not path:
+        return {}
+    settings = json.loads(Path(path).read_text()).get(section, {})
+    if not isinstance(settings, dict):
+        raise TypeError(f"Section {section!r} of {path} must be an object, but got {settings!r}")
+    return settings
+
+
+@dataclass
+class ExecutionProvider:
+    """ONNX Runtime execution provider with its options, a candidate of `InferenceConfig.execution_providers`.
+
+    Written as "Name[:key=value,...]", e.g. "OpenVINOExecutionProvider:device_type=CPU" or
+    "CPUExecutionProvider:enable_cpu_mem_arena=0,intra_op_num_threads=2". Options named as session
+    settings of `InferenceConfig` (threads, graph optimization, memory arena and pattern) override
+    them for this provider, the other options are passed to the provider.
+
+    Attributes:
+        name: name of the provider in ONNX Runtime
+        options: options of the provider
+        session: overrides of session settings of `InferenceConfig`
+
+    """
+
+    name: str
+    options: dict[str, str] = field(default_factory=dict)
+    session: dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def parse(cls, spec: str) -> Self:
+        """Parse provider written as "Name[:key=value,...]"."""
+        name, _, options_spec = spec.partition(":")
+        if not name.strip():
+            raise ValueError(f"Incorrect execution provider: {spec!r}")
+        provider = cls(name.strip())
+        for option in filter(None, (item.strip() for item in options_spec.split(","))):
+            key, sep, value = option.partition("=")
+            if not sep:
+                raise ValueError(f"Option {option!r} of execution provider {spec!r} must be in key=value format")
+            key, value = key.strip(), value.strip()
+            if key in SESSION_SETTINGS:
+                provider.session[key] = SESSION_SETTINGS[key](value)
+            else:
+                provider.options[key] = value
+        return provider
+
+    def apply(self, config: InferenceConfig) -> InferenceConfig:
+        """Return session settings with the overrides of the provider."""
+        return dataclasses.replace(config, **self.session) if self.session else config
+
+    def to_ort(self) -> tuple[str, dict[str, str]]:
+        """Return provider with options in the format of `providers` of `ort.InferenceSession`."""
+        return self.name, self.options
+
+
+@dataclass
+class InferenceConfig:
+    """Settings of ONNX Runtime session used by `StreamingCTCModel`.
+
+    Attributes:
+        intra_op_num_threads: number of threads used to parallelize an operator (0 - ONNX Runtime default)
+        inter_op_num_threads: number of threads used to run independent operators (0 - ONNX Runtime default)
+        graph_optimization_level: one of "disable", "basic", "extended", "all"
+        enable_cpu_mem_arena: whether to use memory arena for CPU allocations
+        enable_mem_pattern: whether to preallocate memory based on the previous runs
+        optimized_model_cache_dir: directory to store optimized models in (None - do not cache)
+        warmup_batch_sizes: batch sizes of warmup requests run before the model is returned
+        warmup_count: number of warmup requests for every batch size
+        prefer_quantized: load the quantized model (`model.int8.onnx` next to `model.onnx`) if it exists
+        execution_providers: candidate execution providers (see `ExecutionProvider`), the fastest one passing
+            the parity check is picked at startup (empty - default CPU provider, one - used without benchmark)
+        provider_benchmark_runs: number of timed runs of every candidate provider
+        provider_parity_tolerance: maximum difference of outputs of a provider and the default CPU provider
+        share_weights: share weights of the model between processes forked by `tone.scripts.serve` (requires
+            `onnx`). Sessions over shared weights do not prepack them, which saves a copy of the weights per
+            process but slows down MatMul and Gemm, and do not use the optimized model cache, so it is
+            disabled by default and is worth enabling only when memory is the limit
+
+    """
+
+    intra_op_num_threads: int = 0
+    inter_op_num_threads: int = 0
+    graph_optimization_level: str = "all"
+    enable_cpu_mem_arena: bool = True
+    enable_mem_pattern: bool = True
+    optimized_model_cache_dir: Path | None = None
+    warmup_batch_sizes: tuple[int, ...] = ()
+    warmup_count: int = 10
+    prefer_quantized: bool = False
+    execution_providers: tuple[str, ...] = ()
+    provider_benchmark_runs: int = 10
+    provider_parity_tolerance: float = 1e-2
+    share_weights: bool = False
+
+    def __post_init__(self) -> None:
+        """Validate settings."""
+        if self.graph_optimization_level not in GRAPH_OPTIMIZATION_LEVELS:
+            raise ValueError(
+                f"'graph_optimization_level' must be one of {GRAPH_OPTIMIZATION_LEVELS}, "
+                f"but got {self.graph_optimization_level!r}",
+            )
+        if self.intra_op_num_threads < 0 or self.inter_op_num_threads < 0:
+            raise ValueError("Number of threads must be non-negative")
+        if any(batch_size <= 0 for batch_size in self.warmup_batch_sizes):
+            raise ValueError(f"Warmup batch sizes must be positive, but got {self.warmup_batch_sizes}")
+        for spec in self.execution_providers:
+            ExecutionProvider.parse(spec)
+        if self.provider_benchmark_runs <= 0:
+            raise ValueError(f"'provider_benchmark_runs' must be positive, but got {self.provider_benchmark_runs}")
+
+    @classmethod
+    def from_dict(cls, settings: Mapping[str, Any]) -> Self:
+        """Create settings from a dict with attribute names as keys (see `to_dict`)."""
+        names = {item.name for item in dataclasses.fields(cls)}
+        if unknown := sorted(set(settings) - names):
+            raise ValueError(f"Unknown inference settings: {unknown}")
+        settings = dict(settings)
+        if settings.get("optimized_model_cache_dir") is not None:
+            settings["optimized_model_cache_dir"] = Path(settings["optimized_model_cache_dir"])
+        for name in ("warmup_batch_sizes", "execution_providers"):
+            if name in settings:
+                settings[name] = tuple(settings[name])
+        return cls(**settings)
+
+    def to_dict(self) -> dict[str, Any]:
+        """Return settings as a JSON-serializable dict."""
+        settings = dataclasses.asdict(self)
+        if self.optimized_model_cache_dir is not None:
+            settings["optimized_model_cache_dir"] = str(self.optimized_model_cache_dir)
+        settings["warmup_batch_sizes"] = list(self.warmup_batch_sizes)
+        settings["execution_providers"] = list(self.execution_providers)
+        return settings
+
+    @classmethod
+    def from_tuned(cls, prefix: str = "TONE_") -> Self:
+        """Create settings from the tuned config file of `{prefix}INFERENCE_CONFIG`, or defaults if it is not set."""
+        return cls.from_dict(read_tuned_settings("inference", prefix))
+
+    @classmethod
+    def from_env(cls, prefix: str = "TONE_") -> Self:
+        """Create settings from environment variables.
+
+        Settings are read from the tuned config file (`TONE_INFERENCE_CONFIG=/models/inference_config.json`,
+        see `tone.scripts.autotune`) if it is set, then every attribute can be overridden by an upper-cased
+        variable with the prefix, e.g. `TONE_INTRA_OP_NUM_THREADS=4` or `TONE_WARMUP_BATCH_SIZES=1,16`.
+        Execution providers are separated by semicolons, e.g.
+        `TONE_EXECUTION_PROVIDERS="OpenVINOExecutionProvider:device_type=CPU;CPUExecutionProvider"`.
+        """
+        config = cls.from_tuned(prefix)
+        parsers: dict[str, Callable[[str], Any]] = {
+            **SESSION_SETTINGS,
+            "optimized_model_cache_dir": lambda value: Path(value) if value else None,
+            "warmup_batch_sizes": lambda value: tuple(int(i) for i in value.split(",") if i.strip()),
+            "warmup_count": int,
+            "prefer_quantized": _parse_bool,
+            "execution_providers": lambda value: tuple(spec.strip() for spec in value.split(";") if spec.strip()),
+            "provider_benchmark_runs": int,
+            "provider_parity_tolerance": float,
+            "share_weights": _parse_bool,
+        }
+        for name, parse in parsers.items():
+            if (value := os.getenv(f"{prefix}{name.upper()}")) is not None:
+                setattr(config, name, parse(value))
+        config.__post_init__()
+        return config
+
+    def to_session_options(self) -> ort.SessionOptions:
+        """Build ONNX Runtime session options from the settings."""
+        import onnxruntime as ort
+
+        sess_options = ort.SessionOptions()
+        sess_options.intra_op_num_threads = self.intra_op_num_threads
+        sess_options.inter_op_num_threads = self.inter_op_num_threads
+        sess_options.graph_optimization_level = {
+            "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+            "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+            "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+            "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+        }[self.graph_optimization_level]
+        sess_options.enable_cpu_mem_arena = self.enable_cpu_mem_arena
+        sess_options.enable_mem_pattern = self.enable_mem_pattern
+        return sess_options
@@ -57,6 +57,24 @@ class StreamingLogprobSplitter:
     SPEECH_EXPAND_SIZE = 3  # in acoustic frames
     MAX_PHRASE_DURATION = 2000  # in acoustic frames
 
+    @property
+    def fingerprint(self) -> str:
+        """Identity of the splitter settings."""
+        return (
+            f"splitter-t{self.SILENCE_THRESHOLD}-s{self.MIN_SILENCE_DURATION}"
+            f"-e{self.SPEECH_EXPAND_SIZE}-m{self.MAX_PHRASE_DURATION}"
+        )
+
+    def has_unfinished_phrase(self, state: StateType | None) -> bool:
+        """Check whether the state has speech that is not yet returned as a phrase.
+
+        Without it the stream is at a phrase boundary: the next phrase starts with the next chunk.
+        """
+        return state is not None and bool(self._is_speech(state.past_logprobs).any())
+
+    def _is_speech(self, logprobs: InputType) -> npt.NDArray[np.bool_]:
+        return np.exp(logprobs[..., -2:]).sum(axis=-1) <= self.SILENCE_THRESHOLD
+
     def _iterate_over_phrases(
         self,
         is_speech: npt.NDArray[np.bool_],
@@ -131,7 +149,7 @@ class StreamingLogprobSplitter:
         logprobs = np.concatenate((state.past_logprobs, logprobs), axis=-2)
 
         # Step 2. If the probability of space + blank tokens is less than a threshold, consider it as speech
-        is_speech = np.exp(logprobs[..., -2:]).sum(axis=-1) <= self.SILENCE_THRESHOLD
+        is_speech = self._is_speech(logprobs)
 
         # Step 3. Iterate through all the speeches and construct phrases out of them
         phrases: list[LogprobPhrase] = []
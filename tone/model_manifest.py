@@ -0,0 +1,196 @@
+"""Module with the manifest of an exported acoustic model variant.
+
+The manifest is stored next to the model (`model.onnx` -> `model.json`) and describes the constants
+the model was exported with: chunk length, number of frames per chunk, state size and type, static
+batch size. `StreamingCTCModel` reads them from the manifest instead of using the hardcoded values
+of the published model, so variants exported with other settings (see `tone.scripts.export`) can be loaded.
+
+The mean time bias of a variant depends on how the model aligns labels with a longer or shorter chunk,
+so it is measured at export time against the model with the chunk of the published one (see `measure_time_bias`).
+"""
+
+from __future__ import annotations
+
+import json
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+from typing_extensions import Self
+
+if TYPE_CHECKING:
+    import numpy.typing as npt
+    import onnx
+
+    from tone.acoustic_backend import AcousticBackend
+
+STATE_DTYPES = ("float16", "float32")
+
+
+@dataclass(frozen=True)
+class ModelManifest:
+    """Constants of an exported acoustic model, defaults describe the published model.
+
+    Attributes:
+        sample_rate: sample rate of the input audio (in Hz)
+        audio_chunk_samples: number of audio samples in the input chunk
+        num_frames: number of frames of log-probabilities per chunk
+        num_labels: number of labels (size of the alphabet with blank)
+        state_size: size of the fused state
+        state_dtype: type of the state, "float16" or "float32"
+        batch_size: static batch size of the model, or None if the batch dimension is dynamic
+        mean_time_bias: mean delay of the emitted labels relative to the audio (in sec)
+
+    """
+
+    sample_rate: int = 8000
+    audio_chunk_samples: int = 2400
+    num_frames: int = 10
+    num_labels: int = 35
+    state_size: int = 219729
+    state_dtype: str = "float16"
+    batch_size: int | None = None
+    mean_time_bias: float = 0.33
+
+    def __post_init__(self) -> None:
+        """Validate manifest."""
+        if self.state_dtype not in STATE_DTYPES:
+            raise ValueError(f"'state_dtype' must be one of {STATE_DTYPES}, but got {self.state_dtype!r}")
+        if self.audio_chunk_samples <= 0 or self.num_frames <= 0 or self.state_size <= 0:
+            raise ValueError(f"Dimensions of the model must be positive, but got {self}")
+        if self.batch_size is not None and self.batch_size <= 0:
+            raise ValueError(f"'batch_size' must be positive or None, but got {self.batch_size}")
+
+    @property
+    def chunk_duration(self) -> float:
+        """Duration of the input chunk (in sec)."""
+        return self.audio_chunk_samples / self.sample_rate
+
+    @property
+    def frame_size(self) -> float:
+        """Duration of a frame of log-probabilities (in sec)."""
+        return self.chunk_duration / self.num_frames
+
+    @property
+    def numpy_state_dtype(self) -> np.dtype[Any]:
+        """Type of the state as numpy dtype."""
+        return np.dtype(self.state_dtype)
+
+    @staticmethod
+    def path_for(model_path: str | Path) -> Path:
+        """Path of the manifest of the model stored at `model_path`."""
+        return Path(model_path).with_suffix(".json")
+
+    @classmethod
+    def load(cls, model_path: str | Path) -> Self | None:
+        """Load the manifest of the model stored at `model_path`, or return None if there is none."""
+        path = cls.path_for(model_path)
+        if not path.exists():
+            return None
+        return cls(**json.loads(path.read_text()))
+
+    def to_json(self) -> str:
+        """Serialize the manifest to JSON."""
+        return json.dumps(asdict(self), indent=2) + "\n"
+
+    @classmethod
+    def from_onnx(cls, model: onnx.ModelProto, *, sample_rate: int = 8000, mean_time_bias: float | None = None) -> Self:
+        """Read the manifest from the graph of the exported model.
+
+        Args:
+            model (onnx.ModelProto): Exported model (weights are not needed).
+            sample_rate (int): Sample rate of the input audio (in Hz).
+            mean_time_bias (float | None): Mean delay of the emitted labels (in sec), or None to use the delay
+                of the published model, which is exact for its chunk only (see `measure_time_bias`).
+
+        Returns:
+            Self: Manifest of the model.
+
+        """
+        from onnx import TensorProto
+
+        shapes: dict[str, list[int]] = {}
+        types: dict[str, int] = {}
+        for value in [*model.graph.input, *model.graph.output]:
+            shapes[value.name] = [dim.dim_value for dim in value.type.tensor_type.shape.dim]
+            types[value.name] = value.type.tensor_type.elem_type
+        for name in ("signal", "state", "logprobs", "state_next"):
+            if name not in shapes:
+                raise ValueError(f"Model has no '{name}' tensor")
+            if not all(shapes[name][1:]):
+                raise ValueError(f"Dimensions of '{name}' tensor are not static: {shapes[name]}")
+        if shapes["state"] != shapes["state_next"] or types["state"] != types["state_next"]:
+            raise ValueError("Shapes or types of 'state' and 'state_next' differ")
+        state_dtypes: dict[int, str] = {TensorProto.FLOAT16: "float16", TensorProto.FLOAT: "float32"}
+        if types["state"] not in state_dtypes:
+            raise ValueError(f"Unsupported type of 'state': {TensorProto.DataType.Name(types['state'])}")
+
+        return cls(
+            sample_rate=sample_rate,
+            audio_chunk_samples=shapes["signal"][1],
+            num_frames=shapes["logprobs"][1],
+            num_labels=shapes["logprobs"][2],
+            state_size=shapes["state"][1],
+            state_dtype=state_dtypes[types["state"]],
+            batch_size=shapes["signal"][0] or None,
+            mean_time_bias=mean_time_bias if mean_time_bias is not None else cls.mean_time_bias,
+        )
+
+
+def _speech_probabilities(model: AcousticBackend, audio: npt.NDArray[np.int32]) -> npt.NDArray[np.float64]:
+    """Run the model over the audio and return probability of speech (not space or blank) for every frame."""
+    chunk_size = model.AUDIO_CHUNK_SAMPLES
+    batch_size = model.manifest.batch_size or 1
+    audio = np.pad(audio, (0, -len(audio) % chunk_size))
+    state = None
+    logprobs = []
+    for audio_chunk in np.split(audio, len(audio) // chunk_size):
+        chunk_logprobs, state = model.forward(np.repeat(audio_chunk[None, :, None], batch_size, axis=0), state)
+        logprobs.append(chunk_logprobs[0])
+    return 1 - np.exp(np.concatenate(logprobs).astype(np.float64)[:, -2:]).sum(axis=-1)
+
+
+def measure_time_bias(
+    model: AcousticBackend,
+    reference: AcousticBackend,
+    audio: npt.NDArray[np.int32],
+    *,
+    max_shift: float = 5.0,
+) -> float:
+    """Measure mean delay of the labels of the model by aligning its output with the output of a reference model.
+
+    Both models run over the same audio, and the shift between their probabilities of speech with the
+    highest correlation is added to the known time bias of the reference (e.g. the published 300 ms model).
+
+    Args:
+        model (AcousticBackend): Model to measure, e.g. a variant exported with a longer chunk.
+        reference (AcousticBackend): Model with known `MEAN_TIME_BIAS` and the same frame size.
+        audio (npt.NDArray[np.int32]): Reference audio with speech, 1D array of samples.
+        max_shift (float): Maximum difference of the delays of the models (in sec).
+
+    Returns:
+        float: Mean time bias of the model (in sec).
+
+    Raises:
+        ValueError: If the models have different frame sizes or sample rates.
+
+    """
+    if model.SAMPLE_RATE != reference.SAMPLE_RATE or not np.isclose(model.FRAME_SIZE, reference.FRAME_SIZE):
+        raise ValueError(
+            f"Models must have the same sample rate and frame size, but got {model.SAMPLE_RATE} Hz, "
+            f"{model.FRAME_SIZE} sec and {reference.SAMPLE_RATE} Hz, {reference.FRAME_SIZE} sec",
+        )
+    # Silence after the audio, so labels delayed by up to `max_shift` are emitted by both models
+    audio = np.pad(audio, (0, round(max_shift * model.SAMPLE_RATE)))
+    speech = _speech_probabilities(model, audio)
+    reference_speech = _speech_probabilities(reference, audio)
+    num_frames = min(len(speech), len(reference_speech))
+    speech = speech[:num_frames] - speech[:num_frames].mean()
+    reference_speech = reference_speech[:num_frames] - reference_speech[:num_frames].mean()
+    max_lag = min(round(max_shift / model.FRAME_SIZE), num_frames - 1)
+    # correlation[k] is the sum of speech[t + lag] * reference_speech[t] for lag = k - (num_frames - 1)
+    correlation = np.correlate(speech, reference_speech, mode="full")
+    lags = np.arange(-max_lag, max_lag + 1)
+    lag = lags[np.argmax(correlation[lags + num_frames - 1])]
+    return round(reference.MEAN_TIME_BIAS + lag * model.FRAME_SIZE, 6)
@@ -2,17 +2,131 @@
 
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
-
-if TYPE_CHECKING:
-    from pathlib import Path
+import dataclasses
+import hashlib
+import logging
+import os
+import platform
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
 
 import numpy as np
 import numpy.typing as npt
-import onnxruntime as ort
-from huggingface_hub import hf_hub_download
 from typing_extensions import Self, TypeAlias
 
+from tone.inference_config import DEFAULT_PROVIDER, ExecutionProvider, InferenceConfig
+from tone.model_manifest import ModelManifest
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    import onnxruntime as ort
+
+logger = logging.getLogger(__name__)
+
+QUANTIZED_SUFFIX = ".int8"  # model.onnx -> model.int8.onnx
+SHARED_INITIALIZER_MIN_BYTES = 1024  # Smaller initializers (e.g. shapes) stay in the graph for shape inference
+
+
+def file_sha256(path: Path) -> str:
+    """Return hex SHA-256 digest of the file content."""
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        while block := f.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cpu_features_digest(cpuinfo_path: Path = Path("/proc/cpuinfo")) -> str:
+    """Return a short digest of the instruction set extensions of the CPU.
+
+    The flags are read from `/proc/cpuinfo` ("flags" on x86, "Features" on ARM). If it is not
+    available, the processor name reported by the platform is used instead.
+    """
+    features = platform.processor()
+    try:
+        with cpuinfo_path.open() as f:
+            for line in f:
+                key, sep, value = line.partition(":")
+                if sep and key.strip() in {"flags", "Features"}:
+                    features = " ".join(sorted(value.split()))
+                    break
+    except OSError:
+        pass
+    return hashlib.sha256(features.encode()).hexdigest()[:8]
+
+
+@dataclass
+class SharedWeights:
+    """Weights of an ONNX model loaded once as numpy arrays to share them between sessions.
+
+    The graph is kept without the weights: their initializers reference external data which is never
+    read, and sessions get the arrays with `SessionOptions.add_initializer`. So a session neither parses
+    the weights embedded in the model nor copies them, and sessions created in processes forked after
+    the weights were loaded share them copy-on-write. Prepacking of weights is disabled in these
+    sessions, otherwise every session keeps a packed copy of the weights of MatMul and Gemm.
+
+    Attributes:
+        model_path: path to the ONNX model file the weights are loaded from
+        graph: serialized ONNX model with the shared initializers removed
+        initializers: shared initializers by name
+
+    """
+
+    model_path: Path
+    graph: bytes
+    initializers: dict[str, npt.NDArray[Any]]
+
+    @classmethod
+    def load(cls, model_path: str | Path) -> Self:
+        """Load weights of the ONNX model.
+
+        Args:
+            model_path (str | Path): Path to the ONNX model file.
+
+        Returns:
+            Self: The graph without the weights and the weights as numpy arrays.
+
+        Raises:
+            ModuleNotFoundError: If `onnx` is not installed.
+
+        """
+        try:
+            import onnx
+            from onnx import numpy_helper
+        except ImportError as e:
+            raise ModuleNotFoundError(
+                "Package 'onnx' not found.\n"
+                "Install it with the following command:\n"
+                "  poetry install -E tools   # using package extras\n",
+            ) from e
+
+        model_path = Path(model_path)
+        model = onnx.load(model_path)
+        initializers = {}
+        for initializer in model.graph.initializer:
+            if initializer.data_location == onnx.TensorProto.EXTERNAL:
+                continue
+            array = numpy_helper.to_array(initializer)
+            if array.nbytes < SHARED_INITIALIZER_MIN_BYTES:
+                continue
+            initializers[initializer.name] = array
+            initializer.ClearField("raw_data")
+            for data_field in ("float_data", "int32_data", "int64_data", "double_data", "uint64_data", "string_data"):
+                initializer.ClearField(data_field)
+            initializer.data_location = onnx.TensorProto.EXTERNAL
+            # Initializers given to the session replace these ones, so the data is never read from the file
+            # (resolved, as the file must be in the directory of the model, e.g. not a symlink to a blob)
+            initializer.external_data.add(key="location", value=model_path.resolve().name)
+        return cls(model_path=model_path, graph=model.SerializeToString(), initializers=initializers)
+
+    def copy(self) -> Self:
+        """Return weights with a new copy of the arrays (allocated by the calling thread)."""
+        initializers = {name: array.copy() for name, array in self.initializers.items()}
+        return dataclasses.replace(self, initializers=initializers)
+
 
 class StreamingCTCModel:
     """Wrapper for a pretrained CTC acoustic model, running with ONNX Runtime.
@@ -21,6 +135,10 @@ class StreamingCTCModel:
     batched streaming inputs. It provides factory methods to load the model
     from Hugging Face or from a local file, and exposes a forward method to compute
     log-probabilities from audio chunks.
+
+    The class constants describe the published model. A model loaded with a manifest (see
+    `ModelManifest`, e.g. a variant exported with another chunk duration) overrides them with
+    the values of the manifest on the instance.
     """
 
     InputType: TypeAlias = npt.NDArray[np.int32]
@@ -36,18 +154,21 @@ class StreamingCTCModel:
     _ort_sess: ort.InferenceSession
 
     @classmethod
-    def from_hugging_face(cls) -> Self:
+    def from_hugging_face(cls, *, config: InferenceConfig | None = None) -> Self:
         """Load and initialize the model from Hugging Face Hub.
 
         Downloads the model if not present locally, and initializes
         an ONNX inference session.
 
+        Args:
+            config (InferenceConfig | None): ONNX Runtime settings, or None to use defaults.
+
         Returns:
             Self: An instance of StreamingCTCModel ready for inference.
 
         """
         model_path = cls.download_from_hugging_face()
-        return cls.from_local(model_path)
+        return cls.from_local(model_path, config=config)
 
     @classmethod
     def download_from_hugging_face(cls) -> str:
@@ -57,28 +178,329 @@ class StreamingCTCModel:
             str: Path to the downloaded ONNX model file.
 
         """
+        from huggingface_hub import hf_hub_download
+
         return hf_hub_download(
             "t-tech/T-one",
             "model.onnx",
         )
 
     @classmethod
-    def from_local(cls, model_path: str | Path) -> Self:
+    def from_local(
+        cls,
+        model_path: str | Path,
+        *,
+        config: InferenceConfig | None = None,
+        shared_weights: SharedWeights | None = None,
+        fingerprint: str | None = None,
+        execution_provider: ExecutionProvider | None = None,
+    ) -> Self:
         """Initialize the model from a local ONNX file.
 
+        Constants of the model are read from its manifest (`model.json` next to `model.onnx`) if it exists.
+        With `config.prefer_quantized`, the quantized model is loaded instead (see `resolve_model_path`).
+        If `config.optimized_model_cache_dir` is set, the graph optimized by ONNX Runtime is saved
+        to this directory and reused on the next start, so the optimization is not redone. The model
+        is warmed up according to `config.warmup_batch_sizes` before it is returned.
+
         Args:
             model_path (str | Path): Path to the ONNX model file.
+            config (InferenceConfig | None): ONNX Runtime settings, or None to use defaults (servers pass
+                `InferenceConfig.from_env()`, which applies the config file tuned for the host).
+            shared_weights (SharedWeights | None): Weights of the model (the one `model_path` resolves to) loaded
+                in advance. The session uses these arrays without copying, so sessions created in processes
+                forked after the weights were loaded share them copy-on-write. The optimized model cache is
+                not used with shared weights.
+            fingerprint (str | None): Fingerprint of the model if it is already known.
+            execution_provider (ExecutionProvider | None): Execution provider selected in advance (e.g. by the
+                parent of forked workers), or None to select one of `config.execution_providers`.
 
         Returns:
             Self: An instance of StreamingCTCModel ready for inference.
 
         """
-        ort_sess = ort.InferenceSession(model_path)
-        return cls(ort_sess)
+        config = config if config is not None else InferenceConfig()
+        model_path = cls.resolve_model_path(model_path, config)
+        manifest = ModelManifest.load(model_path)
+        if shared_weights is not None and shared_weights.model_path != model_path:
+            raise ValueError(f"Shared weights are loaded from {shared_weights.model_path}, not from {model_path}")
+        benchmark: list[dict[str, Any]] = []
+        if execution_provider is not None:
+            provider = execution_provider
+        elif len(config.execution_providers) > 1:
+            provider, benchmark = cls.select_execution_provider(model_path, config, manifest, shared_weights)
+        else:
+            provider = ExecutionProvider.parse(next(iter(config.execution_providers), DEFAULT_PROVIDER))
+        ort_sess, ort_values = cls._create_session(model_path, provider.apply(config), provider, shared_weights)
+        model = cls(ort_sess, model_path=model_path, fingerprint=fingerprint, manifest=manifest)
+        # The session references the arrays, they must outlive it
+        model._shared_initializers = ort_values
+        model.execution_provider = provider
+        model.provider_benchmark = benchmark
+        warmup_batch_sizes = config.warmup_batch_sizes
+        if model.manifest.batch_size is not None and warmup_batch_sizes:
+            warmup_batch_sizes = (model.manifest.batch_size,)  # The model accepts only its static batch size
+        model.warmup(warmup_batch_sizes, count=config.warmup_count)
+        return model
+
+    @staticmethod
+    def resolve_model_path(model_path: str | Path, config: InferenceConfig | None = None) -> Path:
+        """Return path of the model to load: the quantized model next to it if preferred by the config.
+
+        The quantized model (see `tone.scripts.quantize`) is stored as `model.int8.onnx` next to
+        `model.onnx`, the original model is used if there is none.
+
+        Args:
+            model_path (str | Path): Path to the ONNX model file.
+            config (InferenceConfig | None): ONNX Runtime settings, or None to use defaults.
+
+        Returns:
+            Path: Path to the ONNX model file to load.
+
+        """
+        model_path = Path(model_path)
+        if config is None or not config.prefer_quantized or model_path.stem.endswith(QUANTIZED_SUFFIX):
+            return model_path
+        quantized_path = model_path.with_name(f"{model_path.stem}{QUANTIZED_SUFFIX}{model_path.suffix}")
+        if not quantized_path.exists():
+            logger.warning("Quantized model %s not found, loading %s", quantized_path, model_path)
+            return model_path
+        logger.info("Loading quantized model %s", quantized_path)
+        return quantized_path
+
+    @classmethod
+    def select_execution_provider(
+        cls,
+        model_path: Path,
+        config: InferenceConfig,
+        manifest: ModelManifest | None = None,
+        shared_weights: SharedWeights | None = None,
+    ) -> tuple[ExecutionProvider, list[dict[str, Any]]]:
+        """Benchmark candidate execution providers of the config and pick the fastest one.
+
+        Every candidate installed in ONNX Runtime runs the model on a warmup batch of random audio with
+        the state passed between chunks. Outputs of the first chunk are compared with the outputs of
+        the default CPU provider, candidates with a difference above `config.provider_parity_tolerance`
+        are rejected. The timings and the choice are logged.
+
+        Args:
+            model_path (Path): Path to the ONNX model file.
+            config (InferenceConfig): ONNX Runtime settings with the candidates in `execution_providers`.
+            manifest (ModelManifest | None): Manifest of the model, or None for the published model.
+            shared_weights (SharedWeights | None): Weights of the model loaded in advance.
+
+        Returns:
+            tuple[ExecutionProvider, list[dict[str, Any]]]: The fastest provider passing the parity check
+                (the default CPU provider if none does) and the results of all candidates.
+
+        """
+        import onnxruntime as ort
+
+        manifest = manifest if manifest is not None else ModelManifest()
+        batch_size = manifest.batch_size or max(config.warmup_batch_sizes, default=1)
+        rng = np.random.default_rng(0)
+        audio_chunk = rng.integers(-3000, 3000, (batch_size, manifest.audio_chunk_samples, 1), dtype=np.int32)
+
+        def create_model(provider: ExecutionProvider) -> StreamingCTCModel:
+            provider_config = dataclasses.replace(provider.apply(config), optimized_model_cache_dir=None)
+            ort_sess, ort_values = cls._create_session(model_path, provider_config, provider, shared_weights)
+            model = cls(ort_sess, model_path=model_path, manifest=manifest)
+            model._shared_initializers = ort_values
+            return model
+
+        reference_logprobs, reference_state = create_model(ExecutionProvider(DEFAULT_PROVIDER)).forward(audio_chunk)
+        available = set(ort.get_available_providers())
+        results: list[dict[str, Any]] = []
+        for spec in config.execution_providers:
+            provider = ExecutionProvider.parse(spec)
+            if provider.name not in available:
+                logger.info("Execution provider %s is not available in this ONNX Runtime build", spec)
+                results.append({"provider": spec, "status": "unavailable"})
+                continue
+            try:
+                model = create_model(provider)
+                logprobs, state = model.forward(audio_chunk)
+            except Exception as error:  # noqa: BLE001 - A failing candidate must not stop the server
+                logger.warning("Execution provider %s failed: %s", spec, error)
+                results.append({"provider": spec, "status": "failed", "error": str(error)})
+                continue
+            max_diff = max(
+                float(np.abs(logprobs.astype(np.float32) - reference_logprobs.astype(np.float32)).max()),
+                float(np.abs(state.astype(np.float32) - reference_state.astype(np.float32)).max()),
+            )
+            latencies = []
+            for _ in range(config.provider_benchmark_runs):
+                start = time.perf_counter()
+                _, state = model.forward(audio_chunk, state)
+                latencies.append(time.perf_counter() - start)
+            del model  # Only one candidate session is kept in memory at a time
+            passed = max_diff <= config.provider_parity_tolerance
+            result = {
+                "provider": spec,
+                "status": "ok" if passed else "parity_failed",
+                "latency_p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+                "max_diff": max_diff,
+            }
+            logger.info(
+                "Execution provider %s: %.2f ms per batch of %d, max difference from CPU %.2g%s",
+                spec,
+                result["latency_p50_ms"],
+                batch_size,
+                max_diff,
+                "" if passed else " (parity check failed)",
+            )
+            results.append(result)
+
+        passed_results = [result for result in results if result["status"] == "ok"]
+        if not passed_results:
+            logger.warning("No candidate execution provider passed, using %s", DEFAULT_PROVIDER)
+            return ExecutionProvider(DEFAULT_PROVIDER), results
+        best = min(passed_results, key=lambda result: result["latency_p50_ms"])
+        logger.info("Selected execution provider %s (%.2f ms per batch)", best["provider"], best["latency_p50_ms"])
+        return ExecutionProvider.parse(best["provider"]), results
 
-    def __init__(self, ort_sess: ort.InferenceSession) -> None:
-        """Create instance of StreamingCTCModel from onnx session."""
+    @classmethod
+    def _create_session(
+        cls,
+        model_path: Path,
+        config: InferenceConfig,
+        provider: ExecutionProvider,
+        shared_weights: SharedWeights | None,
+    ) -> tuple[ort.InferenceSession, list[ort.OrtValue]]:
+        """Create session of the model, return it with the shared weights it references."""
+        import onnxruntime as ort
+
+        sess_options = config.to_session_options()
+        if shared_weights is None:
+            if config.optimized_model_cache_dir is not None and config.graph_optimization_level != "disable":
+                return cls._create_cached_session(model_path, config, sess_options, provider), []
+            return ort.InferenceSession(model_path, sess_options, providers=[provider.to_ort()]), []
+
+        if config.optimized_model_cache_dir is not None:
+            # The optimized model would be saved with the weights, and every session would parse them again
+            logger.info("Optimized model cache is not used for a model with shared weights")
+        ort_values = {
+            name: ort.OrtValue.ortvalue_from_numpy(array) for name, array in shared_weights.initializers.items()
+        }
+        for name, value in ort_values.items():
+            sess_options.add_initializer(name, value)
+        # Packed weights of MatMul and Gemm would be a private copy in every session
+        sess_options.add_session_config_entry("session.disable_prepacking", "1")
+        # The graph is loaded from bytes, its references to external data are resolved next to the model
+        sess_options.add_session_config_entry(
+            "session.model_external_initializers_file_folder_path",
+            str(shared_weights.model_path.resolve().parent),
+        )
+        ort_sess = ort.InferenceSession(shared_weights.graph, sess_options, providers=[provider.to_ort()])
+        return ort_sess, list(ort_values.values())
+
+    @staticmethod
+    def _create_cached_session(
+        model_path: Path,
+        config: InferenceConfig,
+        sess_options: ort.SessionOptions,
+        provider: ExecutionProvider,
+    ) -> ort.InferenceSession:
+        """Create session from the cached optimized model, or optimize the model and put it into the cache."""
+        import onnxruntime as ort
+
+        assert config.optimized_model_cache_dir is not None
+        cache_dir = Path(config.optimized_model_cache_dir)
+        # Optimized graph may contain hardware, provider and version specific nodes, so they are a part of the key.
+        # Kernels picked at the "all" level depend on the instruction set (e.g. AVX-512, VNNI), not only the
+        # architecture, so a cache directory shared by different hosts needs the CPU features in the key too.
+        cache_key = "-".join(
+            [
+                file_sha256(model_path)[:32],
+                f"ort{ort.__version__}",
+                platform.machine(),
+                f"cpu{cpu_features_digest()}",
+                config.graph_optimization_level,
+                *([provider.name.removesuffix("ExecutionProvider")] if provider.name != DEFAULT_PROVIDER else []),
+            ],
+        )
+        cached_path = cache_dir / f"{model_path.stem}-{cache_key}.onnx"
+        if cached_path.exists():
+            logger.info("Loading optimized model from cache: %s", cached_path)
+            sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            return ort.InferenceSession(cached_path, sess_options, providers=[provider.to_ort()])
+
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = cached_path.with_name(f"{cached_path.name}.{os.getpid()}.tmp")
+        sess_options.optimized_model_filepath = str(tmp_path)
+        ort_sess = ort.InferenceSession(model_path, sess_options, providers=[provider.to_ort()])
+        tmp_path.replace(cached_path)  # Atomic, so other workers never read a partially written model
+        logger.info("Optimized model saved to cache: %s", cached_path)
+        return ort_sess
+
+    def __init__(
+        self,
+        ort_sess: ort.InferenceSession,
+        *,
+        model_path: Path | None = None,
+        fingerprint: str | None = None,
+        manifest: ModelManifest | None = None,
+    ) -> None:
+        """Create instance of StreamingCTCModel from onnx session (and path to the model it was loaded from).
+
+        Raises:
+            ValueError: If the manifest does not match inputs of the session.
+
+        """
         self._ort_sess = ort_sess
+        self._shared_initializers: list[ort.OrtValue] = []
+        self.execution_provider = ExecutionProvider(ort_sess.get_providers()[0])
+        self.provider_benchmark: list[dict[str, Any]] = []  # Results of `select_execution_provider`
+        self.model_path = model_path
+        self._fingerprint = fingerprint  # Computed on the first access if not known
+        self.manifest = manifest if manifest is not None else ModelManifest()
+        for model_input in ort_sess.get_inputs():
+            expected = {"signal": self.manifest.audio_chunk_samples, "state": self.manifest.state_size}
+            size = model_input.shape[1] if len(model_input.shape) > 1 else None
+            if model_input.name in expected and isinstance(size, int) and size != expected[model_input.name]:
+                raise ValueError(
+                    f"Size of input '{model_input.name}' of the model is {size}, "
+                    f"but the manifest expects {expected[model_input.name]}",
+                )
+        self.SAMPLE_RATE = self.manifest.sample_rate
+        self.MEAN_TIME_BIAS = self.manifest.mean_time_bias
+        self.AUDIO_CHUNK_SAMPLES = self.manifest.audio_chunk_samples
+        self.FRAME_SIZE = self.manifest.frame_size
+        self.STATE_SIZE = self.manifest.state_size
+
+    @property
+    def fingerprint(self) -> str:
+        """Identity of the model weights (hash of the model file), computed on the first access."""
+        if self._fingerprint is None:
+            if self.model_path is not None:
+                self._fingerprint = file_sha256(self.model_path)[:32]
+            else:  # Unknown origin of the session, the identity is unique for the object
+                self._fingerprint = f"session-{id(self._ort_sess):x}"
+        return self._fingerprint
+
+    def warmup(self, batch_sizes: Iterable[int] = (1,), *, count: int = 10) -> None:
+        """Run the model on silent input to make one-off allocations before the real requests.
+
+        Works like `model_warmup` section of Triton model configuration: for every batch size
+        `count` consecutive chunks are processed passing the state between them.
+
+        Args:
+            batch_sizes (Iterable[int]): Batch sizes to warm up the model with.
+            count (int): Number of consecutive chunks for each batch size.
+
+        """
+        for batch_size in batch_sizes:
+            audio_chunk = np.zeros((batch_size, self.AUDIO_CHUNK_SAMPLES, 1), dtype=np.int32)
+            state: StreamingCTCModel.StateType | None = None
+            start = time.perf_counter()
+            for _ in range(count):
+                _, state = self.forward(audio_chunk, state)
+            logger.info(
+                "Warmup with batch size %d: %d runs in %.3f sec",
+                batch_size,
+                count,
+                time.perf_counter() - start,
+            )
 
     def forward(self, audio_chunk: InputType, state: StateType | None = None) -> tuple[OutputType, StateType]:
         """Run the CTC acoustic model on a single audio chunk.
@@ -110,13 +532,16 @@ class StreamingCTCModel:
                 f"but it is in range [{audio_chunk.min()}; {audio_chunk.max()}]",
             )
         batch_size = audio_chunk.shape[0]
+        if self.manifest.batch_size is not None and batch_size != self.manifest.batch_size:
+            raise ValueError(f"Batch size must be {self.manifest.batch_size} (static), but got {batch_size}")
+        state_dtype = self.manifest.numpy_state_dtype
         if state is None:
-            state = np.zeros((batch_size, self.STATE_SIZE), dtype=np.float16)  # Create empty initial states
+            state = np.zeros((batch_size, self.STATE_SIZE), dtype=state_dtype)  # Create empty initial states
         if not isinstance(state, np.ndarray):
             raise TypeError(f"Incorrect 'state' type: expected np.ndarray or None, but got {type(state)}")
         if state.shape != (batch_size, self.STATE_SIZE):
             raise ValueError(f"Shape of 'state' must be ({batch_size}, {self.STATE_SIZE}), but got {state.shape}")
-        if state.dtype != np.float16:
-            raise ValueError(f"Incorrect dtype of 'state': expected np.int32, but got {state.dtype}")
+        if state.dtype != state_dtype:
+            raise ValueError(f"Incorrect dtype of 'state': expected np.{state_dtype}, but got {state.dtype}")
 
         return self._ort_sess.run(None, {"signal": audio_chunk, "state": state})
@@ -2,9 +2,11 @@
 
 from __future__ import annotations
 
+import math
 from dataclasses import dataclass
 from pathlib import Path
 from shutil import copyfile
+from typing import TYPE_CHECKING, cast
 
 import numpy as np
 import numpy.typing as npt
@@ -14,6 +16,13 @@ from tone.decoder import BeamSearchCTCDecoder, DecoderType, GreedyCTCDecoder
 from tone.logprob_splitter import StreamingLogprobSplitter
 from tone.onnx_wrapper import StreamingCTCModel
 
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+    from tone.acoustic_backend import AcousticBackend, BackendState
+    from tone.inference_config import InferenceConfig
+    from tone.triton_backend import TritonAcousticModel
+
 
 @dataclass
 class TextPhrase:
@@ -23,12 +32,14 @@ class TextPhrase:
         text: decoded text
         start_time: phrase start time (in sec)
         end_time: phrase end time (in sec)
+        channel: index of the audio channel the phrase was spoken in (None for mono audio)
 
     """
 
     text: str
     start_time: float  # in seconds
     end_time: float  # in seconds
+    channel: int | None = None
 
 
 class StreamingCTCPipeline:
@@ -42,36 +53,56 @@ class StreamingCTCPipeline:
     The pipeline is designed for low-latency streaming applications and operates
     on the CPU. For online streaming, use the `forward` method. For offline
     processing of a complete audio file, use the `forward_offline` method.
+
+    Offline processing may use a separate model variant exported with a longer chunk
+    (e.g. several seconds, see `--chunk-duration-ms` of `tone.scripts.export`): it needs
+    an order of magnitude fewer model calls than the 300 ms model, while phrase splitting
+    and timings adapt to the chunk of the model.
     """
 
     # Model was trained with left/right padding so it's necessary to add it to increase the recognition quality
     PADDING: int = 2400  # 300ms * 8KHz
     CHUNK_SIZE: int = StreamingCTCModel.AUDIO_CHUNK_SAMPLES
+    OFFLINE_MODEL_NAME = "model.offline.onnx"
 
     InputType: TypeAlias = npt.NDArray[np.int32]
     OutputType: TypeAlias = "list[TextPhrase]"
-    StateType: TypeAlias = tuple[npt.NDArray[np.float16], StreamingLogprobSplitter.StateType]
+    StateType: TypeAlias = "tuple[BackendState, StreamingLogprobSplitter.StateType]"
+    MultichannelStateType: TypeAlias = "list[StateType]"
 
     @classmethod
-    def from_hugging_face(cls, *, decoder_type: DecoderType = DecoderType.BEAM_SEARCH) -> Self:
+    def from_hugging_face(
+        cls,
+        *,
+        decoder_type: DecoderType = DecoderType.BEAM_SEARCH,
+        inference_config: InferenceConfig | None = None,
+        acoustic_model: AcousticBackend | None = None,
+        offline_model: AcousticBackend | None = None,
+    ) -> Self:
         """Creates a pipeline instance by downloading artifacts from Hugging Face Hub.
 
         Args:
             decoder_type (DecoderType, optional): The decoding strategy to use.
                 Defaults to `DecoderType.BEAM_SEARCH`.
+            inference_config (InferenceConfig | None, optional): ONNX Runtime settings of the acoustic model.
+                Defaults to None (default settings).
+            acoustic_model (AcousticBackend | None, optional): Acoustic model to use instead of downloading
+                the model, e.g. `TritonAcousticModel`. Defaults to None.
+            offline_model (AcousticBackend | None, optional): Model with a longer chunk for `forward_offline`.
+                Defaults to None (`forward_offline` uses the streaming model).
 
         Returns:
             An initialized `StreamingCTCPipeline` instance.
 
         """
-        model = StreamingCTCModel.from_hugging_face()
+        model = acoustic_model or StreamingCTCModel.from_hugging_face(config=inference_config)
         logprob_splitter = StreamingLogprobSplitter()
         if decoder_type == DecoderType.GREEDY:
             decoder = GreedyCTCDecoder()
-            return cls(model, logprob_splitter, decoder)
+            return cls(model, logprob_splitter, decoder, offline_model=offline_model)
         if decoder_type == DecoderType.BEAM_SEARCH:
             decoder = BeamSearchCTCDecoder.from_hugging_face()
-            return cls(model, logprob_splitter, decoder)
+            return cls(model, logprob_splitter, decoder, offline_model=offline_model)
         raise ValueError("Unknown decoder type")
 
     @staticmethod
@@ -84,29 +115,73 @@ class StreamingCTCPipeline:
             copyfile(BeamSearchCTCDecoder.download_from_hugging_face(), dir_path / "kenlm.bin")
 
     @classmethod
-    def from_local(cls, dir_path: str | Path, *, decoder_type: DecoderType = DecoderType.BEAM_SEARCH) -> Self:
-        """Create StreamingCTCPipeline instance using artifacts from local folder."""
+    def from_local(
+        cls,
+        dir_path: str | Path,
+        *,
+        decoder_type: DecoderType = DecoderType.BEAM_SEARCH,
+        inference_config: InferenceConfig | None = None,
+        acoustic_model: AcousticBackend | None = None,
+    ) -> Self:
+        """Create StreamingCTCPipeline instance using artifacts from local folder.
+
+        If `acoustic_model` is given (e.g. `TritonAcousticModel`), model.onnx is not loaded.
+        If the folder contains model.offline.onnx (a model variant with a longer chunk and its manifest
+        model.offline.json), it is used by `forward_offline`.
+        """
         dir_path = Path(dir_path)
-        model = StreamingCTCModel.from_local(dir_path / "model.onnx")
+        model = acoustic_model or StreamingCTCModel.from_local(dir_path / "model.onnx", config=inference_config)
+        offline_model = None
+        if (dir_path / cls.OFFLINE_MODEL_NAME).exists():
+            offline_model = StreamingCTCModel.from_local(dir_path / cls.OFFLINE_MODEL_NAME, config=inference_config)
         logprob_splitter = StreamingLogprobSplitter()
         if decoder_type == DecoderType.GREEDY:
             decoder = GreedyCTCDecoder()
-            return cls(model, logprob_splitter, decoder)
+            return cls(model, logprob_splitter, decoder, offline_model=offline_model)
         if decoder_type == DecoderType.BEAM_SEARCH:
             decoder = BeamSearchCTCDecoder.from_local(dir_path / "kenlm.bin")
-            return cls(model, logprob_splitter, decoder)
+            return cls(model, logprob_splitter, decoder, offline_model=offline_model)
         raise ValueError("Unknown decoder type")
 
     def __init__(
         self,
-        model: StreamingCTCModel,
+        model: AcousticBackend,
         logprob_splitter: StreamingLogprobSplitter,
         decoder: GreedyCTCDecoder | BeamSearchCTCDecoder,
+        *,
+        offline_model: AcousticBackend | None = None,
     ) -> None:
-        """Create StreamingCTCPipeline instance from model, logprob splitter and decoder."""
+        """Create StreamingCTCPipeline instance from model, logprob splitter and decoder.
+
+        Raises:
+            ValueError: If frames of `offline_model` differ from frames of `model`.
+
+        """
+        # Settings of the splitter are in acoustic frames, so the models must have the same frames
+        if offline_model is not None and (
+            offline_model.SAMPLE_RATE != model.SAMPLE_RATE or not np.isclose(offline_model.FRAME_SIZE, model.FRAME_SIZE)
+        ):
+            raise ValueError(
+                f"Offline model must have the same sample rate and frame size as the streaming model "
+                f"({model.SAMPLE_RATE} Hz, {model.FRAME_SIZE} sec), "
+                f"but got {offline_model.SAMPLE_RATE} Hz, {offline_model.FRAME_SIZE} sec",
+            )
         self.model = model
+        self.offline_model = offline_model
         self.logprob_splitter = logprob_splitter
         self.decoder = decoder
+        self.CHUNK_SIZE = model.AUDIO_CHUNK_SAMPLES
+
+    @property
+    def fingerprint(self) -> str:
+        """Identity of the pipeline: acoustic model, phrase splitter and decoder with their settings.
+
+        Outputs of pipelines with the same fingerprint are the same for the same input.
+        """
+        model_fingerprint = self.model.fingerprint
+        if self.offline_model is not None:
+            model_fingerprint += f"+{self.offline_model.fingerprint}"
+        return f"{model_fingerprint}:{self.logprob_splitter.fingerprint}:{self.decoder.fingerprint}"
 
     def forward(
         self,
@@ -138,27 +213,168 @@ class StreamingCTCPipeline:
         if not isinstance(state, (tuple, type(None))):
             raise TypeError(f"Incorrect 'state' type: expected tuple on None, but got {type(state)}")
 
-        frame_size, time_bias = StreamingCTCModel.FRAME_SIZE, StreamingCTCModel.MEAN_TIME_BIAS
-
         model_state = state[0] if state is not None else None
         logprob_state = state[1] if state is not None else None
 
-        logprobs, model_state_next = self.model.forward(audio_chunk[None, :, None], model_state)
-        logprob_phrases, logprob_state_next = self.logprob_splitter.forward(logprobs[0], logprob_state, is_last=is_last)
+        logprobs, model_state_next = self._run_model(self.model, audio_chunk[None, :, None], model_state, [is_last])
+        phrases, logprob_state_next = self._decode(self.model, logprobs[0], logprob_state, is_last=is_last)
+        return (phrases, (model_state_next, logprob_state_next))
+
+    def forward_batch(
+        self,
+        audio_chunks: InputType,
+        states: Sequence[StateType | None],
+        *,
+        is_last: Sequence[bool],
+    ) -> list[tuple[OutputType, StateType]]:
+        """Perform online (streaming) CTC decoding on 300 ms audio chunks of several independent streams.
+
+        The acoustic model runs once for the whole batch, phrase splitting and decoding are done
+        for every stream separately. The result for every stream is the same as from `forward`
+        (up to rounding differences of batched kernels).
+
+        Args:
+            audio_chunks (InputType): Audio chunks of the streams, shape (B, 2400).
+            states (Sequence[StateType | None]): Previous states of the streams (None for new streams).
+            is_last (Sequence[bool]): Whether the chunk is the final chunk of its stream.
+
+        Returns:
+            list[tuple[OutputType, StateType]]: Decoded output and updated state for every stream.
+
+        """
+        if not isinstance(audio_chunks, np.ndarray):
+            raise TypeError(f"Incorrect 'audio_chunks' type: expected np.ndarray, but got {type(audio_chunks)}")
+        if audio_chunks.ndim != 2 or audio_chunks.shape[1] != self.CHUNK_SIZE:
+            raise ValueError(f"Shape of 'audio_chunks' must be (B, {self.CHUNK_SIZE}), but got {audio_chunks.shape}")
+        batch_size = audio_chunks.shape[0]
+        if len(states) != batch_size or len(is_last) != batch_size:
+            raise ValueError(
+                f"Lengths of 'states' and 'is_last' must be equal to the batch size {batch_size}, "
+                f"but got {len(states)} and {len(is_last)}",
+            )
+        return self._forward_batch(self.model, audio_chunks, states, is_last=is_last)
+
+    def _forward_batch(
+        self,
+        model: AcousticBackend,
+        audio_chunks: InputType,
+        states: Sequence[StateType | None],
+        *,
+        is_last: Sequence[bool],
+    ) -> list[tuple[OutputType, StateType]]:
+        """Run `model` on chunks of several streams, see `forward_batch`."""
+        # Shape and type of the state are taken from the streams (they differ between model variants,
+        # backends with implicit state return handles instead), the model creates initial states itself
+        known = next((state[0] for state in states if state is not None), None)
+        model_state: BackendState | None = None
+        if known is not None:
+            model_state = np.concatenate([state[0] if state is not None else np.zeros_like(known) for state in states])
+        logprobs, model_state_next = self._run_model(model, audio_chunks[:, :, None], model_state, is_last)
+        results: list[tuple[StreamingCTCPipeline.OutputType, StreamingCTCPipeline.StateType]] = []
+        for i, state in enumerate(states):
+            logprob_state = state[1] if state is not None else None
+            phrases, logprob_state_next = self._decode(model, logprobs[i], logprob_state, is_last=is_last[i])
+            # Copy, so the state of a stream does not keep the state of the whole batch alive
+            results.append((phrases, (model_state_next[i : i + 1].copy(), logprob_state_next)))
+        return results
+
+    @staticmethod
+    def _run_model(
+        model: AcousticBackend,
+        audio_chunks: StreamingCTCModel.InputType,
+        model_state: BackendState | None,
+        is_last: Sequence[bool],
+    ) -> tuple[StreamingCTCModel.OutputType, BackendState]:
+        """Run `model` on a batch of chunks, a server keeping states of streams releases them after the last chunk."""
+        if getattr(model, "implicit_state", False):
+            return cast("TritonAcousticModel", model).forward(audio_chunks, model_state, sequence_end=is_last)
+        return model.forward(audio_chunks, model_state)
+
+    def release(self, state: StateType | None) -> None:
+        """Forget a stream abandoned before its last chunk.
+
+        If the states of the streams are kept by the acoustic model server (`TritonAcousticModel` with
+        implicit state), the state of the stream is released there, otherwise nothing is done.
+        """
+        if state is not None and getattr(self.model, "implicit_state", False):
+            cast("TritonAcousticModel", self.model).end_sequences(state[0])
+
+    def forward_multichannel(
+        self,
+        audio_chunks: InputType,
+        state: MultichannelStateType | None = None,
+        *,
+        is_last: bool = False,
+    ) -> tuple[OutputType, MultichannelStateType]:
+        """Perform online (streaming) CTC decoding on 300 ms audio chunks of all channels of one recording.
+
+        Channels (e.g. agent and customer of a call) are recognized independently, as rows of one batch
+        of the acoustic model, so the speakers are not mixed and only one model call is made.
+
+        Args:
+            audio_chunks (InputType): Audio chunks of the channels, shape (C, 2400).
+            state (MultichannelStateType | None): Previous state, or None to initialize.
+            is_last (bool): Whether this is the final chunk of the input stream.
+
+        Returns:
+            Tuple[OutputType, MultichannelStateType]:
+                - Decoded phrases of all channels for this chunk ordered by time, tagged with `channel`.
+                - Updated state to pass into the next call.
+
+        """
+        if not isinstance(audio_chunks, np.ndarray):
+            raise TypeError(f"Incorrect 'audio_chunks' type: expected np.ndarray, but got {type(audio_chunks)}")
+        if state is not None and len(state) != len(audio_chunks):
+            raise ValueError(f"State has {len(state)} channels, but 'audio_chunks' has {len(audio_chunks)}")
+
+        num_channels = len(audio_chunks)
+        results = self.forward_batch(
+            audio_chunks,
+            state if state is not None else [None] * num_channels,
+            is_last=[is_last] * num_channels,
+        )
+        return self._merge_channels(results)
+
+    @staticmethod
+    def _merge_channels(
+        results: list[tuple[OutputType, StateType]],
+    ) -> tuple[OutputType, MultichannelStateType]:
+        """Tag phrases of the channels (streams of a batch) with their channel and order them by time."""
+        phrases: StreamingCTCPipeline.OutputType = []
+        for channel, (channel_phrases, _) in enumerate(results):
+            for phrase in channel_phrases:
+                phrase.channel = channel
+                phrases.append(phrase)
+        phrases.sort(key=lambda phrase: (phrase.start_time, phrase.channel))
+        return phrases, [channel_state for _, channel_state in results]
+
+    def _decode(
+        self,
+        model: AcousticBackend,
+        logprobs: StreamingLogprobSplitter.InputType,
+        logprob_state: StreamingLogprobSplitter.StateType | None,
+        *,
+        is_last: bool,
+    ) -> tuple[OutputType, StreamingLogprobSplitter.StateType]:
+        """Split log-probabilities of a single stream from `model` into phrases and decode them."""
+        frame_size, time_bias = model.FRAME_SIZE, model.MEAN_TIME_BIAS
+        padding = self.PADDING / model.SAMPLE_RATE
+
+        logprob_phrases, logprob_state_next = self.logprob_splitter.forward(logprobs, logprob_state, is_last=is_last)
         phrases: list[TextPhrase] = []
         for logprob_phrase in logprob_phrases:
             text = self.decoder.forward(logprob_phrase.logprobs)
             start_time = max(
                 0,
                 round(
-                    logprob_phrase.start_frame * frame_size - time_bias - self.PADDING / StreamingCTCModel.SAMPLE_RATE,
+                    logprob_phrase.start_frame * frame_size - time_bias - padding,
                     2,
                 ),
             )
             end_time = max(
                 start_time,
                 round(
-                    logprob_phrase.end_frame * frame_size - time_bias - self.PADDING / StreamingCTCModel.SAMPLE_RATE,
+                    logprob_phrase.end_frame * frame_size - time_bias - padding,
                     2,
                 ),
             )
@@ -169,12 +385,17 @@ class StreamingCTCPipeline:
                     end_time=end_time,
                 ),
             )
-        return (phrases, (model_state_next, logprob_state_next))
+        return phrases, logprob_state_next
+
+    def _right_padding(self, model: AcousticBackend) -> int:
+        """Padding after the audio, long enough for the labels delayed by the time bias of the model to be emitted."""
+        return max(self.PADDING, math.ceil(model.MEAN_TIME_BIAS * model.SAMPLE_RATE))
 
     def forward_offline(self, audio: InputType) -> OutputType:
         """Performs offline CTC decoding on a complete audio segment.
 
         Processes the entire input in one shot without maintaining any state.
+        The offline model (a model with a longer chunk) is used if the pipeline has it.
 
         Args:
             audio (InputType): The full audio waveform to decode.
@@ -188,18 +409,58 @@ class StreamingCTCPipeline:
         if audio.ndim != 1:
             raise ValueError(f"Shape of 'audio' must be (L,), but got {audio.shape}")
 
-        audio = np.pad(audio, (self.PADDING, self.PADDING))
+        model = self.offline_model or self.model
+        chunk_size = model.AUDIO_CHUNK_SAMPLES
+        audio = np.pad(audio, (self.PADDING, self._right_padding(model)))
 
-        # Add padding to fill the last chunk and split into chunks of size self.CHUNK_SIZE
-        audio = np.pad(audio, (0, -len(audio) % self.CHUNK_SIZE))
-        audio_chunks = np.split(audio, len(audio) // self.CHUNK_SIZE)
+        # Add padding to fill the last chunk and split into chunks of the model
+        audio = np.pad(audio, (0, -len(audio) % chunk_size))
+        audio_chunks = np.split(audio, len(audio) // chunk_size)
 
         outputs: StreamingCTCPipeline.OutputType = []
-        state: StreamingCTCPipeline.StateType | None = None
+        model_state: BackendState | None = None
+        logprob_state: StreamingLogprobSplitter.StateType | None = None
         for i, audio_chunk in enumerate(audio_chunks):
-            output, state = self.forward(audio_chunk, state, is_last=i == len(audio_chunks) - 1)
+            is_last = i == len(audio_chunks) - 1
+            logprobs, model_state = self._run_model(model, audio_chunk[None, :, None], model_state, [is_last])
+            output, logprob_state = self._decode(model, logprobs[0], logprob_state, is_last=is_last)
+            outputs.extend(output)
+
+        return outputs
+
+    def forward_offline_multichannel(self, audio: InputType) -> OutputType:
+        """Performs offline CTC decoding on a complete multi-channel recording keeping the channels separate.
+
+        See `forward_multichannel` for more info. The offline model is used if the pipeline has it.
+
+        Args:
+            audio (InputType): The full audio waveforms of the channels, shape (C, L).
+
+        Returns:
+            OutputType: The decoded phrases of all channels ordered by time, tagged with `channel`.
+
+        """
+        if not isinstance(audio, np.ndarray):
+            raise TypeError(f"Incorrect 'audio' type: expected np.ndarray, but got {type(audio)}")
+        if audio.ndim != 2:
+            raise ValueError(f"Shape of 'audio' must be (C, L), but got {audio.shape}")
+
+        model = self.offline_model or self.model
+        chunk_size = model.AUDIO_CHUNK_SAMPLES
+        audio = np.pad(audio, ((0, 0), (self.PADDING, self._right_padding(model))))
+        audio = np.pad(audio, ((0, 0), (0, -audio.shape[1] % chunk_size)))
+        num_channels, num_chunks = audio.shape[0], audio.shape[1] // chunk_size
+
+        outputs: StreamingCTCPipeline.OutputType = []
+        states: Sequence[StreamingCTCPipeline.StateType | None] = [None] * num_channels
+        for i in range(num_chunks):
+            audio_chunks = audio[:, i * chunk_size : (i + 1) * chunk_size]
+            results = self._forward_batch(model, audio_chunks, states, is_last=[i == num_chunks - 1] * num_channels)
+            output, states = self._merge_channels(results)
             outputs.extend(output)
 
+        # Phrases of a channel may end in a later chunk than an earlier starting phrase of another channel
+        outputs.sort(key=lambda phrase: (phrase.start_time, phrase.channel))
         return outputs
 
     def finalize(self, state: StateType | None) -> tuple[OutputType, StateType]:
@@ -213,5 +474,5 @@ class StreamingCTCPipeline:
             StateType: The final state of the pipeline.
 
         """
-        audio_chunk = np.zeros((StreamingCTCPipeline.CHUNK_SIZE,), dtype=np.int32)
+        audio_chunk = np.zeros((self.CHUNK_SIZE,), dtype=np.int32)
         return self.forward(audio_chunk, state, is_last=True)
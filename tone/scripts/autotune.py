@@ -0,0 +1,430 @@
+"""Module that tunes ONNX Runtime threading, the number of workers and the batch size for the host.
+
+The best mix of intra-op threads, inter-op threads, concurrent workers and batch size depends on
+the CPU, so it is measured on the host itself with the real model or a synthetic one of the same
+shape (see `tone.scripts.synthetic_model`). For every combination `workers` processes, each with its
+own ONNX Runtime session (as workers of a server have), run the model concurrently on streams of random
+audio with the state passed between chunks, and throughput (seconds of audio per second) and p99
+latency of a call (the latency of every chunk of the batch) are measured. The combination with the
+highest throughput among those meeting the target p99 latency is written to a config file:
+
+    python -m tone.scripts.autotune --model-path /models/model.onnx --output /models/inference_config.json
+
+The file is loaded at startup when `TONE_INFERENCE_CONFIG` points to it: section "inference" by
+`InferenceConfig.from_env` (used by the servers and scripts, `StreamingCTCModel.from_local` without
+a config keeps the defaults), section "server" (workers and maximum batch size) by `tone.scripts.serve`
+and `tone.scripts.triton_config --tuned-config`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import queue
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, TypeVar
+
+import numpy as np
+
+from tone.inference_config import InferenceConfig
+from tone.model_manifest import ModelManifest
+from tone.onnx_wrapper import StreamingCTCModel
+from tone.serving.prefork import available_cpus
+from tone.serving.topology import pin_process
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+    from multiprocessing.process import BaseProcess
+    from multiprocessing.queues import Queue
+    from multiprocessing.synchronize import Barrier
+
+    from tone.onnx_wrapper import SharedWeights
+    from tone.serving.topology import WorkerPlacement
+
+logger = logging.getLogger(__name__)
+
+_T = TypeVar("_T")
+
+STARTUP_TIMEOUT = 300.0  # Time for the workers to load the model and warm up (in sec)
+MIN_CALLS = 10  # Calls of every worker for the percentiles to mean something, however slow the model is
+
+
+def _powers_of_two(limit: int) -> list[int]:
+    values = [1]
+    while values[-1] * 2 <= limit:
+        values.append(values[-1] * 2)
+    if values[-1] != limit:
+        values.append(limit)
+    return values
+
+
+def _run_worker(
+    model_path: Path,
+    config: InferenceConfig,
+    placement: WorkerPlacement | None,
+    weights: SharedWeights | None,
+    *,
+    batch_size: int,
+    duration: float,
+    barrier: Barrier,
+    ready: Queue[int],
+    results: Queue[tuple[float, list[float]]],
+) -> None:
+    if placement is not None:
+        pin_process(placement)  # Before the session, so its threads and memory are placed too
+        if config.intra_op_num_threads == 0:
+            config = dataclasses.replace(config, intra_op_num_threads=len(placement.cpus))
+    model = StreamingCTCModel.from_local(model_path, config=config, shared_weights=weights)
+    rng = np.random.default_rng(0)
+    audio_chunk = rng.integers(-3000, 3000, (batch_size, model.AUDIO_CHUNK_SAMPLES, 1), dtype=np.int32)
+    state = None
+    for _ in range(3):  # Warmup
+        _, state = model.forward(audio_chunk, state)
+    ready.put(os.getpid())
+    barrier.wait(timeout=STARTUP_TIMEOUT)
+    latencies: list[float] = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration or len(latencies) < MIN_CALLS:
+        call_start = time.perf_counter()
+        _, state = model.forward(audio_chunk, state)
+        latencies.append(time.perf_counter() - call_start)
+    results.put((model.manifest.chunk_duration, latencies))
+
+
+def _next_message(messages: Queue[_T], processes: Sequence[BaseProcess], timeout: float) -> _T:
+    """Wait for the next message of the workers, failing as soon as one of them dies."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return messages.get(timeout=min(1.0, timeout))
+        except queue.Empty:
+            pass
+        exit_codes = [process.exitcode for process in processes]
+        if any(exit_code not in (None, 0) for exit_code in exit_codes):
+            raise RuntimeError(f"worker process died, exit codes: {exit_codes}")
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"no result from the worker processes in {timeout} sec")
+
+
+def measure(
+    model_path: Path,
+    config: InferenceConfig,
+    *,
+    workers: int,
+    batch_size: int,
+    duration: float = 3.0,
+    placements: Sequence[WorkerPlacement | None] | None = None,
+    weights: Sequence[SharedWeights | None] | None = None,
+    startup_timeout: float = STARTUP_TIMEOUT,
+) -> dict[str, Any]:
+    """Measure throughput and latency of the model run by several worker processes concurrently.
+
+    Every worker process creates its own session, so the measurement includes contention of the
+    sessions for cores and memory bandwidth, as in a server with several workers. Workers are
+    spawned, unless they are given shared weights: these are inherited by forked workers copy-on-write.
+
+    Args:
+        model_path (Path): Path to the model (its manifest is used if it exists).
+        config (InferenceConfig): ONNX Runtime settings of every worker.
+        workers (int): Number of worker processes running the model at once.
+        batch_size (int): Number of streams in every call.
+        duration (float): Time to run the model for (in sec).
+        placements (Sequence[WorkerPlacement | None] | None): Cores every worker is pinned to (see
+            `tone.serving.topology`), they also set its intra-op threads unless `config` does, or None
+            to leave the workers unpinned.
+        weights (Sequence[SharedWeights | None] | None): Weights loaded in advance for every worker, or None
+            for every worker to load its own.
+        startup_timeout (float): Time for the workers to load the model, and to finish the last call
+            after `duration` (in sec).
+
+    Returns:
+        dict[str, Any]: Measurements: number of calls, p50 and p99 latency of a call, real-time factor
+            (time of the calls per second of audio), throughput.
+
+    Raises:
+        ValueError: If the number of placements or weights differs from the number of workers.
+        RuntimeError: If a worker process dies or does not respond in time, with the combination of the settings.
+
+    """
+    placements = list(placements) if placements is not None else [None] * workers
+    worker_weights = list(weights) if weights is not None else [None] * workers
+    if len(placements) != workers or len(worker_weights) != workers:
+        raise ValueError(f"Expected placements and weights of {workers} workers")
+    # Spawned workers do not inherit threads of the parent, but shared weights are inherited only by forked ones
+    context = multiprocessing.get_context("fork") if weights is not None else multiprocessing.get_context("spawn")
+    barrier = context.Barrier(workers + 1)
+    ready: Queue[int] = context.Queue()
+    results: Queue[tuple[float, list[float]]] = context.Queue()
+    processes = [
+        context.Process(
+            target=_run_worker,
+            args=(model_path, config, placement, worker_weights[index]),
+            kwargs={
+                "batch_size": batch_size,
+                "duration": duration,
+                "barrier": barrier,
+                "ready": ready,
+                "results": results,
+            },
+            daemon=True,
+        )
+        for index, placement in enumerate(placements)
+    ]
+    try:
+        for process in processes:
+            process.start()
+        for _ in processes:
+            _next_message(ready, processes, startup_timeout)
+        barrier.wait(timeout=startup_timeout)
+        start = time.perf_counter()
+        worker_results = [_next_message(results, processes, duration + startup_timeout) for _ in processes]
+        wall_seconds = time.perf_counter() - start
+    except (RuntimeError, threading.BrokenBarrierError) as error:
+        reason = str(error) or f"workers did not start in {startup_timeout} sec"
+        raise RuntimeError(
+            f"Measurement of {workers} workers with batch size {batch_size}, {config.intra_op_num_threads} "
+            f"intra-op and {config.inter_op_num_threads} inter-op threads failed: {reason}",
+        ) from error
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.join(timeout=1.0)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    all_latencies = [latency for _, worker_latencies in worker_results for latency in worker_latencies]
+    audio_seconds = sum(
+        len(worker_latencies) * batch_size * chunk_duration for chunk_duration, worker_latencies in worker_results
+    )
+    return {
+        "calls": len(all_latencies),
+        "latency_p50_ms": round(float(np.percentile(all_latencies, 50)) * 1000, 3),
+        "latency_p99_ms": round(float(np.percentile(all_latencies, 99)) * 1000, 3),
+        "rtf": round(sum(all_latencies) / audio_seconds, 5),
+        "throughput": round(audio_seconds / wall_seconds, 2),  # Seconds of audio per second
+    }
+
+
+def autotune(
+    model_path: Path,
+    *,
+    target_p99_ms: float,
+    intra_op_threads: list[int],
+    inter_op_threads: list[int],
+    workers: list[int],
+    batch_sizes: list[int],
+    max_threads: int,
+    duration: float = 3.0,
+    base_config: InferenceConfig | None = None,
+) -> dict[str, Any]:
+    """Sweep the settings and pick the fastest combination meeting the target latency.
+
+    Combinations using more than `max_threads` threads (workers x intra-op threads) are skipped,
+    they only oversubscribe the cores, as are combinations whose measurement failed (e.g. workers
+    ran out of memory), they are listed in the "tuning" section. If no combination meets the target,
+    the one with the lowest p99 latency is picked.
+
+    Args:
+        model_path (Path): Path to the model (its manifest is used if it exists).
+        target_p99_ms (float): Target p99 latency of a call (in ms).
+        intra_op_threads (list[int]): Numbers of intra-op threads to try.
+        inter_op_threads (list[int]): Numbers of inter-op threads to try.
+        workers (list[int]): Numbers of concurrent workers to try.
+        batch_sizes (list[int]): Batch sizes to try, a model with static batch size is tried with its own.
+        max_threads (int): Maximum total number of intra-op threads of all workers.
+        duration (float): Time to run every combination for (in sec).
+        base_config (InferenceConfig | None): Settings the thread counts are tuned in, or None to use defaults.
+
+    Returns:
+        dict[str, Any]: Config file contents: sections "inference", "server" and "tuning" (all measurements).
+
+    """
+    base_config = base_config if base_config is not None else InferenceConfig()
+    results: list[dict[str, Any]] = []
+    failed: list[str] = []
+    for intra in intra_op_threads:
+        for inter in inter_op_threads:
+            candidate_workers = [count for count in workers if count * intra <= max_threads]
+            if not candidate_workers:
+                continue
+            config = dataclasses.replace(
+                base_config,
+                intra_op_num_threads=intra,
+                inter_op_num_threads=inter,
+                warmup_batch_sizes=(),
+            )
+            manifest = ModelManifest.load(StreamingCTCModel.resolve_model_path(model_path, config)) or ModelManifest()
+            sizes = [manifest.batch_size] if manifest.batch_size is not None else batch_sizes
+            for worker_count in candidate_workers:
+                for batch_size in sizes:
+                    try:
+                        measurements = measure(
+                            model_path,
+                            config,
+                            workers=worker_count,
+                            batch_size=batch_size,
+                            duration=duration,
+                        )
+                    except RuntimeError as error:
+                        logger.error("%s, skipping the combination", error)  # noqa: TRY400 - traceback of the worker is logged by it
+                        failed.append(str(error))
+                        continue
+                    result = {
+                        "intra_op_num_threads": intra,
+                        "inter_op_num_threads": inter,
+                        "workers": worker_count,
+                        "batch_size": batch_size,
+                        **measurements,
+                    }
+                    logger.info("%s", result)
+                    results.append(result)
+    if not results:
+        if failed:
+            raise RuntimeError(f"Measurements of all combinations failed: {failed}")
+        raise ValueError(f"No combination of the settings fits into {max_threads} threads")
+
+    meeting_target = [result for result in results if result["latency_p99_ms"] <= target_p99_ms]
+    if meeting_target:
+        best = max(meeting_target, key=lambda result: result["throughput"])
+    else:
+        best = min(results, key=lambda result: result["latency_p99_ms"])
+        logger.warning("No combination meets p99 latency of %s ms, picked the fastest one", target_p99_ms)
+    best_config = dataclasses.replace(
+        base_config,
+        intra_op_num_threads=best["intra_op_num_threads"],
+        inter_op_num_threads=best["inter_op_num_threads"],
+    )
+    return {
+        "inference": best_config.to_dict(),
+        "server": {"workers": best["workers"], "max_batch_size": best["batch_size"]},
+        "tuning": {
+            "host": platform.node(),
+            "processor": platform.processor() or platform.machine(),
+            "cpus": available_cpus(),
+            "model": str(model_path),
+            "target_p99_ms": target_p99_ms,
+            "target_met": bool(meeting_target),
+            "best": best,
+            "results": results,
+            "failed": failed,
+        },
+    }
+
+
+def format_report(tuned: dict[str, Any]) -> str:
+    """Format measurements of the sweep as a text table."""
+    lines = [f"{'intra':>5} {'inter':>5} {'workers':>7} {'batch':>5} {'p50, ms':>9} {'p99, ms':>9} {'audio s/s':>10}"]
+    lines.extend(
+        f"{result['intra_op_num_threads']:>5} {result['inter_op_num_threads']:>5} {result['workers']:>7} "
+        f"{result['batch_size']:>5} {result['latency_p50_ms']:>9.2f} {result['latency_p99_ms']:>9.2f} "
+        f"{result['throughput']:>10.1f}"
+        for result in tuned["tuning"]["results"]
+    )
+    best = tuned["tuning"]["best"]
+    lines.append("")
+    lines.append(
+        f"Best{'' if tuned['tuning']['target_met'] else ' (target p99 latency not met)'}: "
+        f"{best['intra_op_num_threads']} intra-op and {best['inter_op_num_threads']} inter-op threads, "
+        f"{best['workers']} workers, batch size {best['batch_size']}",
+    )
+    return "\n".join(lines)
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Tune ONNX Runtime threads, workers and batch size for the host")
+    parser.add_argument(
+        "--model-path",
+        type=Path,
+        default=None,
+        help="Path to model.onnx (default: a synthetic model of the same shape, requires onnx package)",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=Path("inference_config.json"),
+        help="Path to write the config file to (default: inference_config.json)",
+    )
+    parser.add_argument(
+        "--target-p99-ms",
+        type=float,
+        default=100.0,
+        help="Target p99 latency of a call of the model, in ms (default: 100)",
+    )
+    parser.add_argument(
+        "--intra-op-threads",
+        type=int,
+        nargs="+",
+        default=None,
+        help="Numbers of intra-op threads to try (default: powers of 2 up to the number of cores)",
+    )
+    parser.add_argument(
+        "--inter-op-threads",
+        type=int,
+        nargs="+",
+        default=[1],
+        help="Numbers of inter-op threads to try (default: 1)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=None,
+        help="Numbers of concurrent workers to try (default: powers of 2 up to the number of cores)",
+    )
+    parser.add_argument(
+        "--batch-sizes",
+        type=int,
+        nargs="+",
+        default=[1, 4, 8, 16],
+        help="Batch sizes to try (default: 1 4 8 16)",
+    )
+    parser.add_argument(
+        "--max-threads",
+        type=int,
+        default=None,
+        help="Maximum total number of intra-op threads of all workers (default: number of cores)",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=3.0,
+        help="Time to run every combination, in sec (default: 3)",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO)
+    cpus = available_cpus()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_path = args.model_path
+        if model_path is None:
+            from tone.scripts.synthetic_model import build_synthetic_model
+
+            model_path = Path(tmp_dir) / "model.onnx"
+            model_path.write_bytes(build_synthetic_model())
+        tuned_config = autotune(
+            model_path,
+            target_p99_ms=args.target_p99_ms,
+            intra_op_threads=args.intra_op_threads or _powers_of_two(cpus),
+            inter_op_threads=args.inter_op_threads,
+            workers=args.workers or _powers_of_two(cpus),
+            batch_sizes=args.batch_sizes,
+            max_threads=args.max_threads or cpus,
+            duration=args.duration,
+            base_config=InferenceConfig.from_env(),
+        )
+    args.output.write_text(json.dumps(tuned_config, indent=2) + "\n")
+    print(format_report(tuned_config))
+    print(f"Config written to {args.output}, load it with TONE_INFERENCE_CONFIG={args.output}")
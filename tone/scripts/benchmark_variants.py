@@ -0,0 +1,161 @@
+"""Module that benchmarks exported acoustic model variants on CPU.
+
+Every variant (a directory with `model.onnx` and its manifest `model.json`, see `tone.scripts.export`)
+is run with ONNX Runtime on streams of random audio with the state passed between chunks, by a worker
+process as in `tone.scripts.autotune`. For every
+batch size the report contains per-call latency, real-time factor and throughput, and the fastest
+variant for every batch size (deployment tier):
+
+    python -m tone.scripts.benchmark_variants --model-dir models/variants --batch-sizes 1 16
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+from pathlib import Path
+from typing import Any
+
+from tone.inference_config import InferenceConfig
+from tone.model_manifest import ModelManifest
+from tone.onnx_wrapper import StreamingCTCModel
+from tone.scripts.autotune import measure
+
+
+def find_variants(model_dir: Path) -> dict[str, Path]:
+    """Find exported variants (models with a manifest) in the directory, by their names."""
+    return {
+        path.parent.name: path
+        for path in sorted(model_dir.glob("*/model.onnx"))
+        if ModelManifest.path_for(path).exists()
+    }
+
+
+def benchmark_model(
+    model_path: Path,
+    *,
+    batch_sizes: list[int],
+    duration: float = 5.0,
+    config: InferenceConfig | None = None,
+) -> list[dict[str, Any]]:
+    """Measure latency and throughput of the model for several batch sizes.
+
+    Args:
+        model_path (Path): Path to the model (its manifest is used if it exists).
+        batch_sizes (list[int]): Batch sizes to measure, a model with static batch size is measured with its own.
+        duration (float): Time to run the model for every batch size (in sec).
+        config (InferenceConfig | None): ONNX Runtime settings, or None to use defaults.
+
+    Returns:
+        list[dict[str, Any]]: Measurements for every batch size.
+
+    """
+    config = config if config is not None else InferenceConfig()
+    manifest = ModelManifest.load(StreamingCTCModel.resolve_model_path(model_path, config)) or ModelManifest()
+    if manifest.batch_size is not None:
+        batch_sizes = [manifest.batch_size]
+    results = []
+    for batch_size in batch_sizes:
+        measurements = measure(model_path, config, workers=1, batch_size=batch_size, duration=duration)
+        results.append(
+            {
+                "batch_size": batch_size,
+                **measurements,
+                "calls_per_audio_minute": round(60 / (batch_size * manifest.chunk_duration), 1),
+            },
+        )
+    return results
+
+
+def benchmark_variants(
+    variants: dict[str, Path],
+    *,
+    batch_sizes: list[int],
+    duration: float = 5.0,
+    config: InferenceConfig | None = None,
+) -> dict[str, Any]:
+    """Benchmark variants and pick the one with the highest throughput for every batch size.
+
+    Args:
+        variants (dict[str, Path]): Paths to the models by names of the variants.
+        batch_sizes (list[int]): Batch sizes to measure.
+        duration (float): Time to run every variant for every batch size (in sec).
+        config (InferenceConfig | None): ONNX Runtime settings, or None to use defaults.
+
+    Returns:
+        dict[str, Any]: Report with manifests and measurements of the variants and the best variant by batch size.
+
+    """
+    report: dict[str, Any] = {"variants": {}, "best": {}}
+    for name, model_path in variants.items():
+        manifest = ModelManifest.load(model_path) or ModelManifest()
+        results = benchmark_model(model_path, batch_sizes=batch_sizes, duration=duration, config=config)
+        report["variants"][name] = {"manifest": json.loads(manifest.to_json()), "results": results}
+        for result in results:
+            best = report["best"].get(str(result["batch_size"]))
+            if best is None or result["throughput"] > best["throughput"]:
+                report["best"][str(result["batch_size"])] = {"variant": name, **result}
+    return report
+
+
+def format_report(report: dict[str, Any]) -> str:
+    """Format benchmark report as a text table."""
+    lines = [f"{'variant':<32} {'batch':>5} {'p50, ms':>9} {'p99, ms':>9} {'RTF':>8} {'audio s/s':>10}"]
+    for name, variant in report["variants"].items():
+        lines.extend(
+            f"{name:<32} {result['batch_size']:>5} {result['latency_p50_ms']:>9.2f} "
+            f"{result['latency_p99_ms']:>9.2f} {result['rtf']:>8.4f} {result['throughput']:>10.1f}"
+            for result in variant["results"]
+        )
+    lines.append("")
+    lines.extend(
+        f"Fastest with batch size {batch_size}: {best['variant']}" for batch_size, best in report["best"].items()
+    )
+    return "\n".join(lines)
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Benchmark exported acoustic model variants on CPU")
+    parser.add_argument(
+        "--model-dir",
+        type=Path,
+        required=True,
+        help="Directory with variants: subdirectories with model.onnx and model.json",
+    )
+    parser.add_argument(
+        "--batch-sizes",
+        type=int,
+        nargs="+",
+        default=[1, 16],
+        help="Batch sizes to measure (default: 1 16)",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=5.0,
+        help="Time to run every variant for every batch size, in sec (default: 5)",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=None,
+        help="Path to write JSON report to (default: benchmark.json in the model directory)",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    found_variants = find_variants(args.model_dir)
+    if not found_variants:
+        raise SystemExit(f"No variants (model.onnx with model.json) found in {args.model_dir}")
+    benchmark_report = benchmark_variants(
+        found_variants,
+        batch_sizes=args.batch_sizes,
+        duration=args.duration,
+        config=InferenceConfig.from_env(),
+    )
+    output = args.output if args.output is not None else args.model_dir / "benchmark.json"
+    output.write_text(json.dumps(benchmark_report, indent=2) + "\n")
+    print(format_report(benchmark_report))
@@ -1,26 +1,47 @@
-"""Module that exports a T-one model to ONNX format."""
+"""Module that exports a T-one model to ONNX format.
+
+One run can export a matrix of variants (chunk durations, state types, static batch sizes) into
+a directory, every variant with its manifest (`model.json`, see `ModelManifest`), and benchmark them
+on CPU (see `tone.scripts.benchmark_variants`). The mean time bias of variants with a chunk other than
+300 ms is measured by aligning them with the 300 ms model on reference audio (see `measure_time_bias`):
+
+    python -m tone.scripts.export --output-dir models/variants \
+        --chunk-duration-ms 300 600 1200 --state-dtype float16 float32 --static-batch-size 1 8
+"""
 
 from __future__ import annotations
 
 import argparse
+import dataclasses
 import io
+import itertools
+import json
+from pathlib import Path
 from typing import IO, TYPE_CHECKING, Any
 
 if TYPE_CHECKING:
-    from pathlib import Path
+    import numpy as np
+    import numpy.typing as npt
 
     from tone.nn.model import Tone
 
 import onnx
+import onnxruntime as ort
 import torch
 from cloudpathlib import AnyPath
 
+from tone.demo.read_audio import read_audio, read_example_audio
+from tone.model_manifest import STATE_DTYPES, ModelManifest, measure_time_bias
+from tone.onnx_wrapper import StreamingCTCModel
+from tone.scripts.benchmark_variants import benchmark_variants, format_report
+from tone.scripts.triton_config import PLATFORMS, generate_config
 from tone.training.model_wrapper import ToneForCTC
 
 _old_layer_norm = torch.nn.functional.layer_norm
 DUMMY_BATCH_SIZE = 5
 DUMMY_AUDIO_RANGE_MIN = -32767
 DUMMY_AUDIO_RANGE_MAX = 32767
+REFERENCE_CHUNK_DURATION_MS = 300  # Chunk of the published model, its mean time bias is known
 
 
 def layer_norm(
@@ -56,6 +77,7 @@ class ModelToExport(torch.nn.Module):
     _state_shape: list[tuple[int, ...]]
     _state_place: list[tuple[int, int]]
     _signal_len: int
+    _state_dtype: torch.dtype
 
     @property
     def input_sample(self) -> tuple[torch.Tensor, torch.Tensor]:
@@ -70,23 +92,29 @@ class ModelToExport(torch.nn.Module):
                 - An initial fused state tensor for the corresponding batch size.
 
         """
+        return self.get_input_sample(DUMMY_BATCH_SIZE)
+
+    def get_input_sample(self, batch_size: int) -> tuple[torch.Tensor, torch.Tensor]:
+        """Provides a dummy input tuple of the given batch size, see `input_sample`."""
         signal = torch.randint(
             DUMMY_AUDIO_RANGE_MIN,
             DUMMY_AUDIO_RANGE_MAX,
-            (DUMMY_BATCH_SIZE, self._signal_len, 1),
+            (batch_size, self._signal_len, 1),
             dtype=torch.int32,
         )
 
-        return signal, self.get_initial_state(DUMMY_BATCH_SIZE)
+        return signal, self.get_initial_state(batch_size)
 
     def __init__(
         self,
         path_to_pretrained: Path | str,
         chunk_duration_ms: int,
+        state_dtype: torch.dtype = torch.float16,
     ) -> None:
         super().__init__()
         tone_ctc = ToneForCTC.from_pretrained(path_to_pretrained)
         self._model = tone_ctc.tone
+        self._state_dtype = state_dtype
 
         self._model.eval()
         self._signal_len = chunk_duration_ms * self._model.preprocessor.sample_rate // 1000
@@ -117,11 +145,11 @@ class ModelToExport(torch.nn.Module):
                 batch size for the initial state.
 
         Returns:
-            torch.Tensor: A zero-initialized tensor of dtype float16, representing
+            torch.Tensor: A zero-initialized tensor of the state dtype (float16 by default), representing
                 the initial fused state with shape (batch_size, total_state_dim).
 
         """
-        return torch.zeros(batch_size, self._state_place[-1][1], dtype=torch.float16)
+        return torch.zeros(batch_size, self._state_place[-1][1], dtype=self._state_dtype)
 
     def _checkpoint_to_bytes(self, checkpoint: dict[str, Any]) -> IO:
         """Serializes a PyTorch checkpoint dictionary into an in-memory byte stream.
@@ -192,11 +220,12 @@ class ModelToExport(torch.nn.Module):
         return res, torch.cat(
             [state.flatten(1) for state in state_next[3:4] + state_next[:3] + state_next[4:]],
             dim=-1,
-        ).half()
+        ).to(self._state_dtype)
 
 
-def _export_onnx(model: ModelToExport) -> bytes:
-    output_sample = model(*model.input_sample)
+def _export_onnx(model: ModelToExport, static_batch_size: int | None = None) -> bytes:
+    input_sample = model.input_sample if static_batch_size is None else model.get_input_sample(static_batch_size)
+    output_sample = model(*input_sample)
 
     # Patch LayerNorm: repare for ONNX export. Convert to float since tf32 is not supported.
     torch.nn.functional.layer_norm = layer_norm
@@ -204,12 +233,12 @@ def _export_onnx(model: ModelToExport) -> bytes:
     onnx_model_bytes = io.BytesIO()
     torch.onnx.export(
         model,
-        model.input_sample,
+        input_sample,
         onnx_model_bytes,
         input_names=["signal", "state"],
         output_names=["logprobs", "state_next"],
         opset_version=17,
-        dynamic_axes={
+        dynamic_axes=None if static_batch_size is not None else {
             k: {0: "batch_size"} for k in ["signal", "state", "logprobs", "state_next"]
         },
     )
@@ -225,6 +254,33 @@ def _export_onnx(model: ModelToExport) -> bytes:
     return onnx_model_bytes.getvalue()
 
 
+class TimeBiasMeter:
+    """Measures mean time bias of exported variants against the 300 ms model of the same checkpoint."""
+
+    def __init__(self, path_to_pretrained: Path | str, audio: npt.NDArray[np.int32]) -> None:
+        self.path_to_pretrained = path_to_pretrained
+        self.audio = audio
+        self._reference: StreamingCTCModel | None = None
+
+    @staticmethod
+    def load(model_bytes: bytes, manifest: ModelManifest) -> StreamingCTCModel:
+        """Create a session of the exported model."""
+        return StreamingCTCModel(ort.InferenceSession(model_bytes), manifest=manifest)
+
+    def manifest(self, model_bytes: bytes) -> ModelManifest:
+        """Read the manifest of the exported model with the measured mean time bias."""
+        manifest = ModelManifest.from_onnx(onnx.load_from_string(model_bytes))
+        if manifest.audio_chunk_samples * 1000 == REFERENCE_CHUNK_DURATION_MS * manifest.sample_rate:
+            return manifest  # The bias of the published model
+        if self._reference is None:
+            reference = ModelToExport(self.path_to_pretrained, REFERENCE_CHUNK_DURATION_MS)
+            reference_bytes = _export_onnx(reference)
+            reference_manifest = ModelManifest.from_onnx(onnx.load_from_string(reference_bytes))
+            self._reference = self.load(reference_bytes, reference_manifest)
+        mean_time_bias = measure_time_bias(self.load(model_bytes, manifest), self._reference, self.audio)
+        return dataclasses.replace(manifest, mean_time_bias=mean_time_bias)
+
+
 def parse_args() -> argparse.Namespace:
     """Parse command line arguments."""
     parser = argparse.ArgumentParser()
@@ -237,21 +293,137 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--chunk-duration-ms",
         type=int,
-        default=300,
-        help="Input audio chunk duration in ms",
+        nargs="+",
+        default=[300],
+        help="Input audio chunk duration in ms, several values export several variants (default: 300)",
+    )
+    parser.add_argument(
+        "--state-dtype",
+        type=str,
+        nargs="+",
+        choices=STATE_DTYPES,
+        default=["float16"],
+        help="Type of the state, several values export several variants (default: float16)",
+    )
+    parser.add_argument(
+        "--static-batch-size",
+        type=int,
+        nargs="*",
+        default=[],
+        help="Static batch sizes to export variants with, besides the dynamic batch (default: none)",
     )
     parser.add_argument(
         "--output_path",
         type=AnyPath,
-        required=True,
-        help="Path to output model (on s3 or locally)",
+        default=None,
+        help="Path to output model (on s3 or locally), when a single variant is exported",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=Path,
+        default=None,
+        help="Directory to export variants to, every variant into its own subdirectory",
+    )
+    parser.add_argument(
+        "--benchmark-batch-sizes",
+        type=int,
+        nargs="*",
+        default=[1, 16],
+        help="Batch sizes to benchmark variants exported to --output-dir with, none to skip (default: 1 16)",
+    )
+    parser.add_argument(
+        "--triton-config",
+        type=AnyPath,
+        default=None,
+        help="Path to write Triton config.pbtxt matching the exported model to, single variant only (default: none)",
+    )
+    parser.add_argument(
+        "--triton-platform",
+        type=str,
+        choices=PLATFORMS,
+        default="onnxruntime_onnx",
+        help="Triton platform of the config (default: onnxruntime_onnx)",
+    )
+    parser.add_argument(
+        "--triton-max-batch-size",
+        type=int,
+        default=16,
+        help="Maximum batch size of the config (default: 16)",
+    )
+    parser.add_argument(
+        "--reference-audio",
+        type=Path,
+        default=None,
+        help="Audio with speech to measure the time bias of variants on (default: long example audio)",
+    )
+    parser.add_argument(
+        "--implicit-state",
+        action="store_true",
+        help="Keep the state on the Triton server with a sequence batcher (default: False)",
     )
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    num_variants = len(args.chunk_duration_ms) * len(args.state_dtype) * (1 + len(args.static_batch_size))
+    if (args.output_path is None) == (args.output_dir is None):
+        parser.error("exactly one of --output_path and --output-dir is required")
+    if args.output_path is not None and num_variants > 1:
+        parser.error("--output_path takes a single variant, use --output-dir to export several")
+    if args.triton_config is not None and args.output_path is None:
+        parser.error("--triton-config is supported with --output_path only")
+    return args
+
+
+def variant_name(chunk_duration_ms: int, state_dtype: str, static_batch_size: int | None) -> str:
+    """Name of the exported variant, e.g. "chunk300ms-float16-dynamic"."""
+    batch = "dynamic" if static_batch_size is None else f"batch{static_batch_size}"
+    return f"chunk{chunk_duration_ms}ms-{state_dtype}-{batch}"
+
+
+def _time_bias_meter(args: argparse.Namespace) -> TimeBiasMeter:
+    if args.reference_audio is not None:
+        return TimeBiasMeter(args.path_to_pretrained, read_audio(args.reference_audio))
+    return TimeBiasMeter(args.path_to_pretrained, read_example_audio(long_audio=True))
+
+
+def export_variants(args: argparse.Namespace) -> dict[str, Path]:
+    """Export all variants of the matrix into `args.output_dir` and return paths to them by their names."""
+    variants = {}
+    meter = _time_bias_meter(args)
+    for chunk_duration_ms, state_dtype in itertools.product(args.chunk_duration_ms, args.state_dtype):
+        model = ModelToExport(args.path_to_pretrained, chunk_duration_ms, getattr(torch, state_dtype))
+        for static_batch_size in [None, *args.static_batch_size]:
+            name = variant_name(chunk_duration_ms, state_dtype, static_batch_size)
+            model_bytes = _export_onnx(model, static_batch_size)
+            model_path = args.output_dir / name / "model.onnx"
+            model_path.parent.mkdir(parents=True, exist_ok=True)
+            model_path.write_bytes(model_bytes)
+            manifest = meter.manifest(model_bytes)
+            ModelManifest.path_for(model_path).write_text(manifest.to_json())
+            variants[name] = model_path
+            print(f"Exported {name}: {manifest}")
+    return variants
 
 
 if __name__ == "__main__":
     args = parse_args()
-    model = ModelToExport(args.path_to_pretrained, args.chunk_duration_ms)
-    model_bytes = _export_onnx(model)
-    args.output_path.write_bytes(model_bytes)
+    if args.output_dir is not None:
+        exported = export_variants(args)
+        if args.benchmark_batch_sizes:
+            report = benchmark_variants(exported, batch_sizes=args.benchmark_batch_sizes)
+            (args.output_dir / "benchmark.json").write_text(json.dumps(report, indent=2) + "\n")
+            print(format_report(report))
+    else:
+        model = ModelToExport(args.path_to_pretrained, args.chunk_duration_ms[0], getattr(torch, args.state_dtype[0]))
+        model_bytes = _export_onnx(model, args.static_batch_size[0] if args.static_batch_size else None)
+        args.output_path.write_bytes(model_bytes)
+        manifest = _time_bias_meter(args).manifest(model_bytes)
+        # Manifest next to the model, see `ModelManifest.path_for`
+        args.output_path.with_suffix(".json").write_text(manifest.to_json())
+        if args.triton_config is not None:
+            config = generate_config(
+                manifest,
+                platform=args.triton_platform,
+                max_batch_size=args.triton_max_batch_size,
+                implicit_state=args.implicit_state,
+            )
+            args.triton_config.write_text(config)
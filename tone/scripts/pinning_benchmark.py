@@ -0,0 +1,180 @@
+"""Module that compares throughput of worker processes pinned to NUMA-local cores with unpinned ones.
+
+Worker processes run the model like the workers of `tone.scripts.serve` (the measurement of
+`tone.scripts.autotune`): every worker creates its own ONNX Runtime session (intra-op threads
+split between the workers) and runs the model on streams of random audio with the state passed
+between chunks. The same load is run without pinning and with the workers pinned to disjoint cores
+(see `tone.serving.topology`); pinned workers either load their own weights, share one copy of the
+weights loaded by the parent, or share a copy allocated by the parent on their NUMA node (as
+`tone.scripts.serve --pin-workers` does, the shared modes require `onnx`). The report contains
+throughput (seconds of audio per second) and p99 latency of a call for every run (Linux only):
+
+    python -m tone.scripts.pinning_benchmark --model-path /models/model.onnx --workers 4 --batch-size 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import importlib.util
+import json
+import tempfile
+from pathlib import Path
+from typing import Any
+
+from tone.inference_config import InferenceConfig
+from tone.onnx_wrapper import SharedWeights, StreamingCTCModel
+from tone.scripts.autotune import measure
+from tone.serving.prefork import available_cpus
+from tone.serving.topology import CpuTopology, WorkerPlacement, allocate_on_node
+
+WEIGHTS_MODES = ("private", "shared", "per_node")  # Own weights of every worker, one copy, a copy per NUMA node
+
+
+def benchmark(
+    model_path: Path,
+    *,
+    workers: int,
+    batch_size: int = 1,
+    duration: float = 10.0,
+    pin: bool,
+    weights: str = "private",
+    config: InferenceConfig | None = None,
+) -> dict[str, Any]:
+    """Run the model in worker processes and measure their total throughput.
+
+    Args:
+        model_path (Path): Path to the model (its manifest is used if it exists).
+        workers (int): Number of worker processes.
+        batch_size (int): Number of streams in every call.
+        duration (float): Time to run the model for (in sec).
+        pin (bool): Pin every worker to its own cores of one NUMA node.
+        weights (str): One of `WEIGHTS_MODES`: every worker loads its own weights ("private"), the workers
+            share the weights loaded by the parent ("shared") or a copy of them the parent allocated on their
+            NUMA node ("per_node", requires `pin`).
+        config (InferenceConfig | None): ONNX Runtime settings, or None to use defaults.
+
+    Returns:
+        dict[str, Any]: Placement of the workers, throughput and latency of a call.
+
+    """
+    if weights not in WEIGHTS_MODES:
+        raise ValueError(f"'weights' must be one of {WEIGHTS_MODES}, but got {weights!r}")
+    if weights == "per_node" and not pin:
+        raise ValueError("Weights can be allocated per NUMA node only for pinned workers")
+    config = config if config is not None else InferenceConfig()
+    placements: list[WorkerPlacement | None] = [None] * workers
+    if pin:
+        placements = list(CpuTopology.detect().plan(workers))
+    shared_weights = None
+    if weights != "private":
+        shared_weights = SharedWeights.load(StreamingCTCModel.resolve_model_path(model_path, config))
+    node_weights: dict[int, SharedWeights] = {}
+    if shared_weights is not None and weights == "per_node":
+        for node in sorted({placement.node for placement in placements if placement is not None}):
+            with allocate_on_node(node):
+                node_weights[node] = shared_weights.copy()
+    worker_weights = None
+    if shared_weights is not None:
+        worker_weights = [
+            node_weights.get(placement.node, shared_weights) if placement is not None else shared_weights
+            for placement in placements
+        ]
+    if not pin and config.intra_op_num_threads == 0:
+        config = dataclasses.replace(config, intra_op_num_threads=max(1, available_cpus() // workers))
+    measurements = measure(
+        model_path,
+        config,
+        workers=workers,
+        batch_size=batch_size,
+        duration=duration,
+        placements=placements,
+        weights=worker_weights,
+    )
+    return {
+        "pinned": pin,
+        "weights": weights,
+        "workers": workers,
+        "batch_size": batch_size,
+        "placements": [list(placement.cpus) for placement in placements if placement is not None],
+        **measurements,
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Compare throughput of pinned and unpinned worker processes")
+    parser.add_argument(
+        "--model-path",
+        type=Path,
+        default=None,
+        help="Path to model.onnx (default: a synthetic model of the same shape, requires onnx package)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: one worker per 2 available cores)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="Number of streams in every call of the model (default: 1)",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=10.0,
+        help="Time to run every mode, in sec (default: 10)",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=None,
+        help="Path to write JSON report to (default: do not write)",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    num_workers = args.workers if args.workers is not None else max(1, available_cpus() // 2)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_path = args.model_path
+        if model_path is None:
+            from tone.scripts.synthetic_model import build_synthetic_model
+
+            model_path = Path(tmp_dir) / "model.onnx"
+            model_path.write_bytes(build_synthetic_model())
+        modes = [(False, "private"), (True, "private")]
+        if importlib.util.find_spec("onnx") is not None:
+            modes += [(True, "shared"), (True, "per_node")]
+        else:
+            print("Package 'onnx' not found, modes with shared weights are skipped")
+        report = [
+            benchmark(
+                model_path,
+                workers=num_workers,
+                batch_size=args.batch_size,
+                duration=args.duration,
+                pin=pin,
+                weights=weights,
+                config=InferenceConfig.from_env(),
+            )
+            for pin, weights in modes
+        ]
+    print(f"{'mode':<10} {'weights':<9} {'workers':>7} {'batch':>5} {'p50, ms':>9} {'p99, ms':>9} {'audio s/s':>10}")
+    for result in report:
+        print(
+            f"{'pinned' if result['pinned'] else 'unpinned':<10} {result['weights']:<9} {result['workers']:>7} "
+            f"{result['batch_size']:>5} {result['latency_p50_ms']:>9.2f} {result['latency_p99_ms']:>9.2f} "
+            f"{result['throughput']:>10.1f}",
+        )
+    for result in report[1:]:
+        print(
+            f"Speedup of pinned workers with {result['weights']} weights: "
+            f"{result['throughput'] / report[0]['throughput']:.2f}x",
+        )
+    if args.output is not None:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
@@ -0,0 +1,373 @@
+"""Module that quantizes the acoustic model to INT8 and reports its accuracy and speed.
+
+Two modes of ONNX Runtime quantization are supported:
+
+- dynamic: weights are quantized ahead of time, activations are quantized on the fly;
+- static: activations are quantized with ranges calibrated on real audio. Calibration chunks are fed
+  in stream order with the states the original model produces for them, so the ranges match streaming.
+
+Only compute-heavy operators (`MatMul`, `Gemm`, `Conv` by default) are quantized, the recurrent state
+is kept in its original type, so quantization errors do not accumulate from chunk to chunk.
+
+    python -m tone.scripts.quantize --model-path models/model.onnx --mode static \
+        --audio-manifest data/calibration.jsonl --eval-manifest data/test.jsonl
+
+Audio manifests are JSON Lines files with `audio` (path to the file, relative to the manifest) and
+optional `text` (reference transcript) fields. The quantized model is written to `model.int8.onnx`
+next to the original one (with a copy of its manifest), and `StreamingCTCModel.from_local` loads it
+instead of `model.onnx` with `InferenceConfig(prefer_quantized=True)` (`TONE_PREFER_QUANTIZED=1`).
+The report (WER, per-chunk latency and throughput of both models) is written to `model.int8.report.json`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+
+try:
+    from onnxruntime.quantization import (
+        CalibrationDataReader,
+        CalibrationMethod,
+        QuantFormat,
+        QuantType,
+        quantize_dynamic,
+        quantize_static,
+    )
+except ImportError as e:
+    raise ModuleNotFoundError(
+        "Package 'onnx' not found.\n"
+        "Install it with the following command:\n"
+        "  poetry install -E tools   # using package extras\n",
+    ) from e
+
+from tone.decoder import BeamSearchCTCDecoder, GreedyCTCDecoder
+from tone.demo.read_audio import read_audio
+from tone.logprob_splitter import StreamingLogprobSplitter
+from tone.model_manifest import ModelManifest
+from tone.onnx_wrapper import QUANTIZED_SUFFIX, StreamingCTCModel
+from tone.pipeline import StreamingCTCPipeline
+from tone.scripts.benchmark_variants import benchmark_model
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    import numpy.typing as npt
+
+DEFAULT_OP_TYPES = ("MatMul", "Gemm", "Conv")
+CALIBRATE_METHODS = {
+    "minmax": CalibrationMethod.MinMax,
+    "entropy": CalibrationMethod.Entropy,
+    "percentile": CalibrationMethod.Percentile,
+}
+
+
+@dataclass
+class AudioSample:
+    """Audio file of a manifest with its reference transcript (if known)."""
+
+    path: Path
+    text: str | None = None
+
+
+def read_audio_manifest(manifest_path: Path) -> list[AudioSample]:
+    """Read JSON Lines audio manifest, paths are relative to the manifest."""
+    samples = []
+    for line in manifest_path.read_text().splitlines():
+        if line.strip():
+            entry = json.loads(line)
+            samples.append(AudioSample(manifest_path.parent / entry["audio"], entry.get("text")))
+    return samples
+
+
+def stream_chunks(audio: npt.NDArray[np.int32], chunk_samples: int) -> list[npt.NDArray[np.int32]]:
+    """Split audio into chunks of the model input, padded like in `StreamingCTCPipeline.forward_offline`."""
+    audio = np.pad(audio, (StreamingCTCPipeline.PADDING, StreamingCTCPipeline.PADDING))
+    audio = np.pad(audio, (0, -len(audio) % chunk_samples))
+    return np.split(audio, len(audio) // chunk_samples)
+
+
+class StreamingCalibrationReader(CalibrationDataReader):
+    """Calibration data: chunks of audio in stream order with the states of the original model."""
+
+    def __init__(self, model: StreamingCTCModel, samples: list[AudioSample], *, max_chunks: int = 500) -> None:
+        self.model = model
+        self.samples = samples
+        self.max_chunks = max_chunks
+        self._inputs = self._generate()
+
+    def _generate(self) -> Iterator[dict[str, npt.NDArray[Any]]]:
+        num_chunks = 0
+        for sample in self.samples:
+            state = None
+            for chunk in stream_chunks(read_audio(sample.path), self.model.AUDIO_CHUNK_SAMPLES):
+                if num_chunks >= self.max_chunks:
+                    return
+                signal = chunk[None, :, None]
+                if state is None:
+                    state = np.zeros((1, self.model.STATE_SIZE), dtype=self.model.manifest.numpy_state_dtype)
+                yield {"signal": signal, "state": state}
+                _, state = self.model.forward(signal, state)
+                num_chunks += 1
+
+    def get_next(self) -> dict[str, npt.NDArray[Any]] | None:  # type: ignore[override]
+        """Return inputs of the next calibration run, or None when the data is exhausted."""
+        return next(self._inputs, None)
+
+    def rewind(self) -> None:
+        """Start the calibration data from the beginning."""
+        self._inputs = self._generate()
+
+
+def quantize_model(
+    model_path: Path,
+    output_path: Path,
+    *,
+    mode: str = "dynamic",
+    calibration_reader: CalibrationDataReader | None = None,
+    calibrate_method: str = "minmax",
+    per_channel: bool = False,
+    op_types: tuple[str, ...] = DEFAULT_OP_TYPES,
+) -> None:
+    """Quantize the model to INT8 and copy its manifest.
+
+    Args:
+        model_path (Path): Path to the original model.
+        output_path (Path): Path to write the quantized model to.
+        mode (str): "dynamic" or "static".
+        calibration_reader (CalibrationDataReader | None): Calibration data, required for static quantization.
+        calibrate_method (str): Method of static calibration: "minmax", "entropy" or "percentile".
+        per_channel (bool): Quantize weights per output channel instead of per tensor.
+        op_types (tuple[str, ...]): Types of operators to quantize.
+
+    """
+    if mode == "dynamic":
+        quantize_dynamic(
+            model_path,
+            output_path,
+            op_types_to_quantize=list(op_types),
+            per_channel=per_channel,
+            weight_type=QuantType.QInt8,
+        )
+    elif mode == "static":
+        if calibration_reader is None:
+            raise ValueError("Static quantization requires 'calibration_reader'")
+        quantize_static(
+            model_path,
+            output_path,
+            calibration_reader,
+            quant_format=QuantFormat.QDQ,
+            op_types_to_quantize=list(op_types),
+            per_channel=per_channel,
+            activation_type=QuantType.QInt8,
+            weight_type=QuantType.QInt8,
+            calibrate_method=CALIBRATE_METHODS[calibrate_method],
+        )
+    else:
+        raise ValueError(f"'mode' must be 'dynamic' or 'static', but got {mode!r}")
+    if (manifest := ModelManifest.load(model_path)) is not None:
+        ModelManifest.path_for(output_path).write_text(manifest.to_json())
+
+
+def word_error_rate(references: list[str], hypotheses: list[str]) -> float:
+    """Word error rate of hypotheses: word-level edit distance divided by the number of reference words."""
+    errors, words = 0, 0
+    for reference, hypothesis in zip(references, hypotheses):
+        ref, hyp = reference.split(), hypothesis.split()
+        distances = list(range(len(hyp) + 1))
+        for i, ref_word in enumerate(ref, start=1):
+            previous, distances[0] = distances[0], i
+            for j, hyp_word in enumerate(hyp, start=1):
+                substitution = previous + (ref_word != hyp_word)
+                previous = distances[j]
+                distances[j] = min(distances[j] + 1, distances[j - 1] + 1, substitution)
+        errors += distances[-1]
+        words += len(ref)
+    return errors / max(words, 1)
+
+
+def evaluate_model(
+    model_path: Path,
+    samples: list[AudioSample],
+    *,
+    decoder: GreedyCTCDecoder | BeamSearchCTCDecoder,
+    batch_sizes: list[int],
+    duration: float,
+    baseline_texts: list[str] | None = None,
+) -> tuple[dict[str, Any], list[str]]:
+    """Measure accuracy and speed of the model.
+
+    Args:
+        model_path (Path): Path to the model.
+        samples (list[AudioSample]): Evaluation audio, WER is computed if all samples have references.
+        decoder (GreedyCTCDecoder | BeamSearchCTCDecoder): Decoder of the pipeline.
+        batch_sizes (list[int]): Batch sizes to measure latency and throughput with.
+        duration (float): Time to run the model for every batch size (in sec).
+        baseline_texts (list[str] | None): Transcripts of the original model to compare with.
+
+    Returns:
+        tuple[dict[str, Any], list[str]]: Measurements and transcripts of the samples.
+
+    """
+    pipeline = StreamingCTCPipeline(StreamingCTCModel.from_local(model_path), StreamingLogprobSplitter(), decoder)
+    texts = [" ".join(phrase.text for phrase in pipeline.forward_offline(read_audio(s.path))) for s in samples]
+    result: dict[str, Any] = {
+        "model": str(model_path),
+        "size_mb": round(model_path.stat().st_size / 2**20, 2),
+        "benchmark": benchmark_model(model_path, batch_sizes=batch_sizes, duration=duration),
+    }
+    if samples and all(sample.text is not None for sample in samples):
+        result["wer"] = round(word_error_rate([sample.text or "" for sample in samples], texts), 4)
+    if baseline_texts is not None:
+        result["wer_vs_baseline"] = round(word_error_rate(baseline_texts, texts), 4)
+    return result, texts
+
+
+def format_report(report: dict[str, Any]) -> str:
+    """Format quantization report as a text table."""
+    lines = [f"{'model':<10} {'size, MB':>9} {'WER':>7} {'batch':>5} {'p50, ms':>9} {'p99, ms':>9} {'audio s/s':>10}"]
+    for name in ("baseline", "quantized"):
+        result = report[name]
+        wer = f"{result['wer']:.4f}" if "wer" in result else "-"
+        lines.extend(
+            f"{name:<10} {result['size_mb']:>9.1f} {wer:>7} {bench['batch_size']:>5} "
+            f"{bench['latency_p50_ms']:>9.2f} {bench['latency_p99_ms']:>9.2f} {bench['throughput']:>10.1f}"
+            for bench in result["benchmark"]
+        )
+    if "wer_vs_baseline" in report["quantized"]:
+        lines.append(f"\nWER of the quantized model against the original one: {report['quantized']['wer_vs_baseline']}")
+    return "\n".join(lines)
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Quantize the acoustic model to INT8 and compare it with the original")
+    parser.add_argument(
+        "--model-path",
+        type=Path,
+        required=True,
+        help="Path to model.onnx",
+    )
+    parser.add_argument(
+        "--mode",
+        type=str,
+        choices=["dynamic", "static"],
+        default="dynamic",
+        help="Quantization mode (default: dynamic)",
+    )
+    parser.add_argument(
+        "--audio-manifest",
+        type=Path,
+        default=None,
+        help="JSON Lines manifest of calibration audio, required for static quantization",
+    )
+    parser.add_argument(
+        "--eval-manifest",
+        type=Path,
+        default=None,
+        help="JSON Lines manifest of evaluation audio with references (default: --audio-manifest)",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=None,
+        help="Path to the quantized model (default: model.int8.onnx next to the model)",
+    )
+    parser.add_argument(
+        "--calibrate-method",
+        type=str,
+        choices=list(CALIBRATE_METHODS),
+        default="minmax",
+        help="Calibration method of static quantization (default: minmax)",
+    )
+    parser.add_argument(
+        "--max-calibration-chunks",
+        type=int,
+        default=500,
+        help="Maximum number of chunks used for calibration (default: 500)",
+    )
+    parser.add_argument(
+        "--per-channel",
+        action="store_true",
+        help="Quantize weights per output channel (default: False)",
+    )
+    parser.add_argument(
+        "--op-types",
+        type=str,
+        nargs="+",
+        default=list(DEFAULT_OP_TYPES),
+        help=f"Types of operators to quantize (default: {' '.join(DEFAULT_OP_TYPES)})",
+    )
+    parser.add_argument(
+        "--kenlm-path",
+        type=Path,
+        default=None,
+        help="Path to kenlm.bin to evaluate with beam search decoder (default: greedy decoder)",
+    )
+    parser.add_argument(
+        "--batch-sizes",
+        type=int,
+        nargs="+",
+        default=[1, 16],
+        help="Batch sizes to measure latency and throughput with (default: 1 16)",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=5.0,
+        help="Time to run each model for every batch size, in sec (default: 5)",
+    )
+    args = parser.parse_args()
+    if args.mode == "static" and args.audio_manifest is None:
+        parser.error("--audio-manifest is required for static quantization")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    output_path = args.output
+    if output_path is None:
+        output_path = args.model_path.with_name(f"{args.model_path.stem}{QUANTIZED_SUFFIX}{args.model_path.suffix}")
+
+    reader = None
+    if args.mode == "static":
+        reader = StreamingCalibrationReader(
+            StreamingCTCModel.from_local(args.model_path),
+            read_audio_manifest(args.audio_manifest),
+            max_chunks=args.max_calibration_chunks,
+        )
+    quantize_model(
+        args.model_path,
+        output_path,
+        mode=args.mode,
+        calibration_reader=reader,
+        calibrate_method=args.calibrate_method,
+        per_channel=args.per_channel,
+        op_types=tuple(args.op_types),
+    )
+
+    eval_manifest = args.eval_manifest if args.eval_manifest is not None else args.audio_manifest
+    eval_samples = read_audio_manifest(eval_manifest) if eval_manifest is not None else []
+    eval_decoder = GreedyCTCDecoder() if args.kenlm_path is None else BeamSearchCTCDecoder.from_local(args.kenlm_path)
+    baseline, baseline_texts = evaluate_model(
+        args.model_path,
+        eval_samples,
+        decoder=eval_decoder,
+        batch_sizes=args.batch_sizes,
+        duration=args.duration,
+    )
+    quantized, _ = evaluate_model(
+        output_path,
+        eval_samples,
+        decoder=eval_decoder,
+        batch_sizes=args.batch_sizes,
+        duration=args.duration,
+        baseline_texts=baseline_texts if eval_samples else None,
+    )
+    quantization_report = {"mode": args.mode, "baseline": baseline, "quantized": quantized}
+    output_path.with_suffix(".report.json").write_text(json.dumps(quantization_report, indent=2) + "\n")
+    print(format_report(quantization_report))
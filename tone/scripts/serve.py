@@ -0,0 +1,148 @@
+"""Module that runs a web application in several pre-forked workers sharing one loaded model.
+
+The model and the language model are loaded once in the parent process, workers are forked
+from it and share them copy-on-write. The model weights are shared only with `TONE_SHARE_WEIGHTS=1`
+(requires `onnx` package, see `InferenceConfig.share_weights`), otherwise every worker has its
+own prepacked copy.
+Send SIGHUP to the parent to reload the workers:
+
+    python -m tone.scripts.serve simple_api:app --model-dir /models --workers 4
+    python -m tone.scripts.serve tone.demo.website:app --model-dir /models --port 8080
+
+The application module must provide `set_pipeline` function that receives the pipeline.
+
+With `--inference-workers N` the model runs in N separate inference worker processes, and the
+workers (front-ends) only handle websockets and exchange audio chunks and phrases with them
+through shared memory. In this mode the application module must provide `set_inference_client`
+function (only `tone.demo.website:app` supports it):
+
+    python -m tone.scripts.serve tone.demo.website:app --model-dir /models --workers 2 --inference-workers 4
+
+ONNX Runtime settings are read from TONE_* environment variables (see `InferenceConfig.from_env`).
+With `TONE_INFERENCE_CONFIG` pointing to a config file tuned for the host (see `tone.scripts.autotune`),
+the number of workers and the maximum batch size not given on the command line are taken from it
+(the tuned number of workers is the number of processes running the model, i.e. of inference workers
+with `--split`).
+On multi-socket hosts `--pin-workers` keeps every worker on its own cores of one NUMA node.
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+from pathlib import Path
+
+from tone.decoder import DecoderType
+from tone.inference_config import InferenceConfig, read_tuned_settings
+from tone.serving.prefork import PreforkServer, SharedArtifacts, SplitServer
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Run web application in pre-forked workers sharing one model")
+    parser.add_argument(
+        "app",
+        type=str,
+        help='Application in "module:attribute" format, e.g. "simple_api:app"',
+    )
+    parser.add_argument(
+        "--model-dir",
+        type=Path,
+        required=True,
+        help="Folder with model.onnx (and kenlm.bin for beam search decoder)",
+    )
+    parser.add_argument(
+        "--decoder",
+        type=DecoderType,
+        choices=list(DecoderType),
+        default=DecoderType.BEAM_SEARCH,
+        help="Decoder type (default: beam_search)",
+    )
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="0.0.0.0",  # noqa: S104
+        help="Host to listen on (default: 0.0.0.0)",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8000,
+        help="Port to listen on (default: 8000)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of workers (default: from the tuned config file, or one worker per 2 available cores), "
+        "or of front-end workers if inference workers are used (default: 1)",
+    )
+    parser.add_argument(
+        "--inference-workers",
+        type=int,
+        default=0,
+        help="Number of separate inference workers, 0 to run the model in the workers (default: 0, "
+        "or from the tuned config file with --split)",
+    )
+    parser.add_argument(
+        "--split",
+        action="store_true",
+        help="Run the model in separate inference workers even if --inference-workers is not set (default: False)",
+    )
+    parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        default=None,
+        help="Maximum number of chunks processed by an inference worker at once "
+        "(default: from the tuned config file, or 16)",
+    )
+    parser.add_argument(
+        "--pin-workers",
+        action="store_true",
+        help="Pin every worker (inference worker, if they are used) to disjoint cores of one NUMA node, "
+        "Linux only (default: False)",
+    )
+    parser.add_argument(
+        "--log-level",
+        type=str,
+        default="info",
+        help="Log level (default: info)",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.basicConfig(level=args.log_level.upper())
+
+    inference_config = InferenceConfig.from_env()
+    tuned_server = read_tuned_settings("server")
+    # The tuned number of workers is the number of processes running the model
+    model_workers = tuned_server.get("workers")
+    max_batch_size = args.max_batch_size if args.max_batch_size is not None else tuned_server.get("max_batch_size", 16)
+    artifacts = SharedArtifacts.from_local(args.model_dir, decoder_type=args.decoder, inference_config=inference_config)
+    if args.split or args.inference_workers > 0:
+        server: PreforkServer = SplitServer(
+            args.app,
+            artifacts,
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+            inference_workers=args.inference_workers or model_workers or 1,
+            max_batch_size=max_batch_size,
+            inference_config=inference_config,
+            log_level=args.log_level,
+            pin_workers=args.pin_workers,
+        )
+    else:
+        server = PreforkServer(
+            args.app,
+            artifacts,
+            host=args.host,
+            port=args.port,
+            workers=args.workers if args.workers is not None else model_workers,
+            inference_config=inference_config,
+            log_level=args.log_level,
+            pin_workers=args.pin_workers,
+        )
+    server.run()
@@ -0,0 +1,101 @@
+"""Module that measures startup time of the package, its CLI and server workers.
+
+Besides the timings it checks that importing the package does not pull heavy third-party
+modules (ONNX Runtime, KenLM, Hugging Face Hub, ...) which must be imported lazily on first use.
+The script exits with non-zero code if this check fails, so it can be used as a regression test:
+
+    python -m tone.scripts.startup_time --repeats 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+# Modules that must not be imported by `import tone` or by the lightweight public objects
+HEAVY_MODULES = (
+    "onnxruntime",
+    "pyctcdecode",
+    "kenlm",
+    "huggingface_hub",
+    "miniaudio",
+    "fastapi",
+)
+
+# Name of the measurement and Python code (or CLI arguments) to run in a fresh interpreter
+STARTUP_COMMANDS: dict[str, list[str]] = {
+    "python (baseline)": ["-c", "pass"],
+    "import tone": ["-c", "import tone"],
+    "from tone import TextPhrase": ["-c", "from tone import TextPhrase"],
+    "tone --help": ["-m", "tone", "--help"],
+    "tone download --help": ["-m", "tone", "download", "--help"],
+    "worker spawn (website app)": ["-c", "import tone.demo.website"],
+}
+
+# Python code and the modules that must not be imported after running it
+IMPORT_CHECKS: dict[str, str] = {
+    "import tone": "import tone",
+    "from tone import TextPhrase": "from tone import TextPhrase",
+    "from tone import StreamingCTCPipeline": "from tone import StreamingCTCPipeline",
+    "tone CLI parser": "import tone.__main__",
+}
+
+
+def measure_command(args: list[str], repeats: int) -> list[float]:
+    """Run Python interpreter with given arguments several times and return wall-clock durations (in sec)."""
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)  # noqa: S603
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def find_heavy_imports(code: str) -> list[str]:
+    """Run code in a fresh interpreter and return heavy modules imported by it."""
+    probe = f"{code}\nimport json, sys\nprint(json.dumps(sorted(m for m in {HEAVY_MODULES!r} if m in sys.modules)))"
+    output = subprocess.run([sys.executable, "-c", probe], check=True, capture_output=True, text=True).stdout  # noqa: S603
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Measure startup time of T-one package, CLI and workers")
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=5,
+        help="Number of runs of each command (default: 5)",
+    )
+    parser.add_argument(
+        "--skip-timings",
+        action="store_true",
+        help="Only check for heavy imports without measuring startup time (default: False)",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if not args.skip_timings:
+        print(f"{'Command':<40} {'median, ms':>12} {'min, ms':>10}")
+        for name, command in STARTUP_COMMANDS.items():
+            try:
+                durations = measure_command(command, args.repeats)
+            except subprocess.CalledProcessError:
+                print(f"{name:<40} {'failed':>12}")
+                continue
+            print(f"{name:<40} {statistics.median(durations) * 1000:>12.1f} {min(durations) * 1000:>10.1f}")
+        print()
+
+    failed = False
+    for name, code in IMPORT_CHECKS.items():
+        heavy_imports = find_heavy_imports(code)
+        print(f"{name:<40} {'OK' if not heavy_imports else 'heavy imports: ' + ', '.join(heavy_imports)}")
+        failed |= bool(heavy_imports)
+    sys.exit(1 if failed else 0)
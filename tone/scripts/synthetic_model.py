@@ -0,0 +1,215 @@
+"""Module that builds a synthetic stand-in for the T-one acoustic model.
+
+The generated ONNX model has exactly the same I/O contract as the real `model.onnx`
+(see `StreamingCTCModel`) but contains only a few randomly initialized dense layers.
+It does not recognize speech, yet it produces plausible logprobs: frames with low energy
+are dominated by the blank token, while loud frames are spread over letters. This makes it
+possible to load-test the whole pipeline (batching, splitter, decoders, servers) offline.
+"""
+
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from tone.model_manifest import ModelManifest
+from tone.onnx_wrapper import StreamingCTCModel
+
+NUM_LABELS = 35  # 33 letters, space and blank (see tone.decoder.LABELS)
+FRAME_SAMPLES = round(StreamingCTCModel.FRAME_SIZE * StreamingCTCModel.SAMPLE_RATE)
+SILENCE_LOG_ENERGY = -6.0  # log of mean squared amplitude (normalized to [-1; 1]) considered as silence
+BLANK_SLOPE = 2.0  # how fast blank logit decreases when frame energy grows
+LETTER_LOGIT_SCALE = 4.0
+STATE_DECAY = 0.99
+
+
+def build_synthetic_model(
+    *,
+    hidden_size: int = 512,
+    num_layers: int = 8,
+    chunk_samples: int = StreamingCTCModel.AUDIO_CHUNK_SAMPLES,
+    state_size: int = StreamingCTCModel.STATE_SIZE,
+    seed: int = 0,
+) -> bytes:
+    """Build a synthetic acoustic model compatible with `StreamingCTCModel`.
+
+    Compute cost of the model is controlled by `hidden_size` and `num_layers`: each frame
+    passes through `num_layers` residual dense layers of size `hidden_size`. The first
+    `hidden_size` values of the state carry the context between chunks, the rest of the
+    state is decayed and passed through to mimic the memory traffic of the real model.
+
+    Args:
+        hidden_size (int): Size of the hidden dense layers.
+        num_layers (int): Number of hidden dense layers.
+        chunk_samples (int): Number of audio samples in the input chunk.
+        state_size (int): Size of the fused fp16 state.
+        seed (int): Seed used to initialize the weights.
+
+    Returns:
+        bytes: Serialized ONNX model.
+
+    Raises:
+        ModuleNotFoundError: If `onnx` is not installed.
+
+    """
+    try:
+        import onnx
+        from onnx import TensorProto, helper, numpy_helper
+    except ImportError as e:
+        raise ModuleNotFoundError(
+            "Package 'onnx' not found.\n"
+            "Install it with the following command:\n"
+            "  poetry install -E tools   # using package extras\n",
+        ) from e
+
+    if chunk_samples <= 0 or chunk_samples % FRAME_SAMPLES != 0:
+        raise ValueError(f"'chunk_samples' must be a positive multiple of {FRAME_SAMPLES}, but got {chunk_samples}")
+    if not 0 < hidden_size < state_size:
+        raise ValueError(f"'hidden_size' must be in range (0; {state_size}), but got {hidden_size}")
+    if num_layers < 0:
+        raise ValueError(f"'num_layers' must be non-negative, but got {num_layers}")
+
+    num_frames = chunk_samples // FRAME_SAMPLES
+    rng = np.random.default_rng(seed)
+
+    def dense(name: str, fan_in: int, fan_out: int, scale: float = 1.0) -> onnx.TensorProto:
+        weight = rng.standard_normal((fan_in, fan_out)).astype(np.float32) * (scale / np.sqrt(fan_in))
+        return numpy_helper.from_array(weight, name)
+
+    def const(name: str, value: np.ndarray) -> onnx.TensorProto:
+        return numpy_helper.from_array(value, name)
+
+    initializers = [
+        const("frame_shape", np.array([0, num_frames, FRAME_SAMPLES], dtype=np.int64)),
+        const("amplitude_scale", np.array(1 / 32768, dtype=np.float32)),
+        const("energy_eps", np.array(1e-8, dtype=np.float32)),
+        const("silence_log_energy", np.array(SILENCE_LOG_ENERGY, dtype=np.float32)),
+        const("blank_slope", np.array(BLANK_SLOPE, dtype=np.float32)),
+        const("space_shift", np.array(-2.0, dtype=np.float32)),
+        const("state_decay", np.array(STATE_DECAY, dtype=np.float16)),
+        const("context_starts", np.array([0], dtype=np.int64)),
+        const("context_ends", np.array([hidden_size], dtype=np.int64)),
+        const("rest_ends", np.array([state_size], dtype=np.int64)),
+        const("state_axes", np.array([1], dtype=np.int64)),
+        dense("w_in", FRAME_SAMPLES, hidden_size, scale=8.0),
+        dense("w_out", hidden_size, NUM_LABELS - 2, scale=LETTER_LOGIT_SCALE),
+        *(dense(f"w_hidden_{i}", hidden_size, hidden_size) for i in range(num_layers)),
+    ]
+
+    nodes = [
+        # Split the signal into frames and compute their log-energy
+        helper.make_node("Cast", ["signal"], ["signal_float"], to=TensorProto.FLOAT),
+        helper.make_node("Mul", ["signal_float", "amplitude_scale"], ["signal_norm"]),
+        helper.make_node("Reshape", ["signal_norm", "frame_shape"], ["frames"]),
+        helper.make_node("Mul", ["frames", "frames"], ["frames_sq"]),
+        helper.make_node("ReduceMean", ["frames_sq"], ["energy"], axes=[2], keepdims=1),
+        helper.make_node("Add", ["energy", "energy_eps"], ["energy_safe"]),
+        helper.make_node("Log", ["energy_safe"], ["log_energy"]),
+        # Project frames into hidden space and add the context from the state
+        helper.make_node("MatMul", ["frames", "w_in"], ["hidden_in"]),
+        helper.make_node("Slice", ["state", "context_starts", "context_ends", "state_axes"], ["context_half"]),
+        helper.make_node("Cast", ["context_half"], ["context"], to=TensorProto.FLOAT),
+        helper.make_node("Unsqueeze", ["context", "state_axes"], ["context_3d"]),
+        helper.make_node("Add", ["hidden_in", "context_3d"], ["hidden_ctx"]),
+        helper.make_node("Tanh", ["hidden_ctx"], ["hidden_0"]),
+    ]
+    for i in range(num_layers):
+        nodes += [
+            helper.make_node("MatMul", [f"hidden_{i}", f"w_hidden_{i}"], [f"hidden_{i}_mm"]),
+            helper.make_node("Tanh", [f"hidden_{i}_mm"], [f"hidden_{i}_act"]),
+            helper.make_node("Add", [f"hidden_{i}", f"hidden_{i}_act"], [f"hidden_{i}_res"]),
+            helper.make_node("Tanh", [f"hidden_{i}_res"], [f"hidden_{i + 1}"]),
+        ]
+    hidden = f"hidden_{num_layers}"
+    nodes += [
+        # Letters come from the hidden state, space and blank dominate on quiet frames
+        helper.make_node("MatMul", [hidden, "w_out"], ["letter_logits"]),
+        helper.make_node("Sub", ["silence_log_energy", "log_energy"], ["energy_margin"]),
+        helper.make_node("Mul", ["energy_margin", "blank_slope"], ["blank_logit"]),
+        helper.make_node("Add", ["blank_logit", "space_shift"], ["space_logit"]),
+        helper.make_node("Concat", ["letter_logits", "space_logit", "blank_logit"], ["logits"], axis=-1),
+        helper.make_node("LogSoftmax", ["logits"], ["logprobs"], axis=-1),
+        # New state: summary of the current chunk followed by the decayed rest of the old state
+        helper.make_node("ReduceMean", [hidden], ["summary"], axes=[1], keepdims=0),
+        helper.make_node("Cast", ["summary"], ["summary_half"], to=TensorProto.FLOAT16),
+        helper.make_node("Slice", ["state", "context_ends", "rest_ends", "state_axes"], ["state_rest"]),
+        helper.make_node("Mul", ["state_rest", "state_decay"], ["state_rest_decayed"]),
+        helper.make_node("Concat", ["summary_half", "state_rest_decayed"], ["state_next"], axis=1),
+    ]
+
+    graph = helper.make_graph(
+        nodes,
+        "synthetic_streaming_acoustic",
+        inputs=[
+            helper.make_tensor_value_info("signal", TensorProto.INT32, ["batch_size", chunk_samples, 1]),
+            helper.make_tensor_value_info("state", TensorProto.FLOAT16, ["batch_size", state_size]),
+        ],
+        outputs=[
+            helper.make_tensor_value_info("logprobs", TensorProto.FLOAT, ["batch_size", num_frames, NUM_LABELS]),
+            helper.make_tensor_value_info("state_next", TensorProto.FLOAT16, ["batch_size", state_size]),
+        ],
+        initializer=initializers,
+    )
+    model = helper.make_model(
+        graph,
+        opset_imports=[helper.make_opsetid("", 17)],
+        ir_version=8,  # IR version matching opset 17, readable by all supported onnxruntime versions
+        producer_name="tone-synthetic",
+    )
+    onnx.checker.check_model(model)
+    return model.SerializeToString()
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Build a synthetic acoustic model for offline load testing")
+    parser.add_argument(
+        "--hidden-size",
+        type=int,
+        default=512,
+        help="Size of the hidden dense layers (default: 512)",
+    )
+    parser.add_argument(
+        "--num-layers",
+        type=int,
+        default=8,
+        help="Number of hidden dense layers, controls compute cost (default: 8)",
+    )
+    parser.add_argument(
+        "--chunk-duration-ms",
+        type=int,
+        default=300,
+        help="Input audio chunk duration in ms (default: 300)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed used to initialize the weights (default: 0)",
+    )
+    parser.add_argument(
+        "--output_path",
+        type=Path,
+        required=True,
+        help="Path to output model",
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    import onnx
+
+    args = parse_args()
+    model_bytes = build_synthetic_model(
+        hidden_size=args.hidden_size,
+        num_layers=args.num_layers,
+        chunk_samples=args.chunk_duration_ms * StreamingCTCModel.SAMPLE_RATE // 1000,
+        seed=args.seed,
+    )
+    args.output_path.write_bytes(model_bytes)
+    # The manifest lets `StreamingCTCModel` load models built with other chunk durations
+    manifest = ModelManifest.from_onnx(onnx.load_from_string(model_bytes))
+    ModelManifest.path_for(args.output_path).write_text(manifest.to_json())
@@ -0,0 +1,231 @@
+"""Module that generates Triton Inference Server model configuration (`config.pbtxt`) for the acoustic model.
+
+Dimensions and types of the inputs and outputs (chunk length, state size and type, number of frames
+and labels) are read from the exported ONNX model (see `ModelManifest`), so they are not maintained
+by hand. Two variants are supported:
+
+- explicit state (default): the client sends `state` with every request and receives `state_next`
+  back (`configs/streaming_acoustic`), requests are batched by the dynamic batcher;
+- implicit state (`--implicit-state`): the state stays on the server between the requests of a
+  sequence (stream), the client sends only `signal` with sequence parameters and receives only
+  `logprobs` (see `TritonAcousticModel(implicit_state=True)`), requests of different sequences are
+  batched by the sequence batcher.
+
+    python -m tone.scripts.triton_config --model-path models/model.onnx \
+        --output models/streaming_acoustic/config.pbtxt --implicit-state
+
+The same configuration is written by `tone.scripts.export --triton-config`. With `--tuned-config`
+the ONNX Runtime thread counts, the maximum batch size and the number of model instances are taken from
+a config file tuned for the host (see `tone.scripts.autotune`).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+from pathlib import Path
+
+from tone.model_manifest import ModelManifest
+
+PLATFORMS = ("onnxruntime_onnx", "tensorrt_plan")
+
+
+def _tensor(name: str, data_type: str, dims: list[int]) -> str:
+    return f'  {{\n    name: "{name}"\n    data_type: {data_type}\n    dims: [ {", ".join(map(str, dims))} ]\n  }}'
+
+
+def _warmup_input(name: str, data_type: str, dims: list[int]) -> str:
+    return (
+        f'        inputs: {{\n          key: "{name}",\n          value: {{\n'
+        f"              data_type: {data_type}\n              dims: [ {', '.join(map(str, dims))} ]\n"
+        f"              zero_data: true\n          }}\n        }}"
+    )
+
+
+def generate_config(
+    manifest: ModelManifest,
+    *,
+    name: str = "streaming_acoustic",
+    platform: str = "onnxruntime_onnx",
+    max_batch_size: int = 16,
+    implicit_state: bool = False,
+    max_queue_delay_microseconds: int = 10000,
+    max_sequence_idle_microseconds: int = 60_000_000,
+    instance_count: int = 1,
+    intra_op_thread_count: int = 1,
+    inter_op_thread_count: int = 1,
+) -> str:
+    """Generate text of `config.pbtxt` for the acoustic model.
+
+    Args:
+        manifest (ModelManifest): Dimensions and types of the model tensors.
+        name (str): Name of the model in the model repository.
+        platform (str): "onnxruntime_onnx" (runs on CPU) or "tensorrt_plan" (runs on GPU).
+        max_batch_size (int): Maximum batch size, the model is warmed up with 1 and this batch size.
+        implicit_state (bool): Keep the state on the server (sequence batcher with implicit state).
+        max_queue_delay_microseconds (int): Maximum time a request waits for a batch to be formed.
+        max_sequence_idle_microseconds (int): Time after which the state of an idle sequence is released
+            (implicit state only, the client does not end sequences of abandoned streams).
+        instance_count (int): Number of model instances.
+        intra_op_thread_count (int): ONNX Runtime intra-op threads of every instance (0 - ONNX Runtime default).
+        inter_op_thread_count (int): ONNX Runtime inter-op threads of every instance (0 - ONNX Runtime default).
+
+    Returns:
+        str: Model configuration in protobuf text format.
+
+    """
+    if platform not in PLATFORMS:
+        raise ValueError(f"'platform' must be one of {PLATFORMS}, but got {platform!r}")
+    if max_batch_size <= 0:
+        raise ValueError(f"'max_batch_size' must be positive, but got {max_batch_size}")
+    if manifest.batch_size is not None:
+        raise ValueError(f"Model must have dynamic batch size to be batched by Triton, but got {manifest.batch_size}")
+
+    state_type = {"float16": "TYPE_FP16", "float32": "TYPE_FP32"}[manifest.state_dtype]
+    signal = ("signal", "TYPE_INT32", [manifest.audio_chunk_samples, 1])
+    state = ("state", state_type, [manifest.state_size])
+    logprobs = ("logprobs", "TYPE_FP32", [manifest.num_frames, manifest.num_labels])
+    state_next = ("state_next", state_type, [manifest.state_size])
+    inputs = [signal] if implicit_state else [signal, state]
+    outputs = [logprobs] if implicit_state else [logprobs, state_next]
+
+    sections = [f'name: "{name}"\nplatform: "{platform}"\nmax_batch_size: {max_batch_size}']
+    sections.append("\n".join(f"input [\n{_tensor(*tensor)}\n]" for tensor in inputs))
+    sections.append("\n".join(f"output [\n{_tensor(*tensor)}\n]" for tensor in outputs))
+    if implicit_state:
+        sections.append(
+            "sequence_batching {\n"
+            f"  max_sequence_idle_microseconds: {max_sequence_idle_microseconds}\n"
+            "  oldest {\n"
+            f"    max_candidate_sequences: {max_batch_size * 64}\n"
+            f"    preferred_batch_size: [ {max_batch_size} ]\n"
+            f"    max_queue_delay_microseconds: {max_queue_delay_microseconds}\n"
+            "  }\n"
+            "  state [\n"
+            "    {\n"
+            '      input_name: "state"\n'
+            '      output_name: "state_next"\n'
+            f"      data_type: {state_type}\n"
+            f"      dims: [ {manifest.state_size} ]\n"
+            "      initial_state: {\n"
+            f"        data_type: {state_type}\n"
+            f"        dims: [ {manifest.state_size} ]\n"
+            "        zero_data: true\n"
+            '        name: "initial_state"\n'
+            "      }\n"
+            "    }\n"
+            "  ]\n"
+            "}",
+        )
+    else:
+        sections.append(f"dynamic_batching {{\n  max_queue_delay_microseconds: {max_queue_delay_microseconds}\n}}")
+
+    if platform == "tensorrt_plan":
+        instance = f"      count: {instance_count}\n      kind: KIND_GPU\n      gpus: [ 0 ]"
+    else:
+        instance = f"      count: {instance_count}\n      kind: KIND_CPU"
+    sections.append(f"instance_group [\n    {{\n{instance}\n    }}\n]")
+
+    if implicit_state:
+        # Warmup requests do not belong to a sequence, so the implicit state can not be initialized for them
+        sections.append("# No model_warmup: clients warm up with a few sequences (TritonAcousticModel.warmup)")
+    else:
+        samples = [
+            f'    {{\n        name: "warmup_sample_{i}"\n        batch_size: {batch_size}\n        count: 10\n'
+            + ",\n".join(_warmup_input(*tensor) for tensor in inputs).replace(",\n        inputs", "\n        inputs")
+            + "\n    }"
+            for i, batch_size in enumerate(sorted({1, max_batch_size}), start=1)
+        ]
+        sections.append("model_warmup [\n\n" + ",\n\n".join(samples) + "\n]")
+
+    if platform == "onnxruntime_onnx":
+        sections.append(
+            "\n".join(
+                f'parameters {{\n  key: "{key}"\n  value: {{ string_value: "{value}" }}\n}}'
+                for key, value in (
+                    ("intra_op_thread_count", intra_op_thread_count),
+                    ("inter_op_thread_count", inter_op_thread_count),
+                )
+            ),
+        )
+    return "\n\n".join(sections) + "\n"
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Generate Triton model configuration for the acoustic model")
+    parser.add_argument(
+        "--model-path",
+        type=Path,
+        required=True,
+        help="Path to the exported model.onnx (for TensorRT, the model the engine was built from)",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        required=True,
+        help="Path to write config.pbtxt to",
+    )
+    parser.add_argument(
+        "--platform",
+        type=str,
+        choices=PLATFORMS,
+        default="onnxruntime_onnx",
+        help="Triton platform (default: onnxruntime_onnx)",
+    )
+    parser.add_argument(
+        "--name",
+        type=str,
+        default="streaming_acoustic",
+        help="Name of the model (default: streaming_acoustic)",
+    )
+    parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        default=None,
+        help="Maximum batch size (default: from the tuned config file, or 16)",
+    )
+    parser.add_argument(
+        "--tuned-config",
+        type=Path,
+        default=None,
+        help="Config file written by tone.scripts.autotune to take thread counts, batch size and instances from",
+    )
+    parser.add_argument(
+        "--implicit-state",
+        action="store_true",
+        help="Keep the state on the server with a sequence batcher (default: False)",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        import onnx
+    except ImportError as e:
+        raise ModuleNotFoundError(
+            "Package 'onnx' not found.\n"
+            "Install it with the following command:\n"
+            "  poetry install -E tools   # using package extras\n",
+        ) from e
+
+    # Weights are not needed to read the dimensions
+    manifest = ModelManifest.from_onnx(onnx.load(args.model_path, load_external_data=False))
+    tuned = json.loads(args.tuned_config.read_text()) if args.tuned_config is not None else {}
+    tuned_inference, tuned_server = tuned.get("inference", {}), tuned.get("server", {})
+    max_batch_size = args.max_batch_size if args.max_batch_size is not None else tuned_server.get("max_batch_size", 16)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(
+        generate_config(
+            manifest,
+            name=args.name,
+            platform=args.platform,
+            max_batch_size=max_batch_size,
+            implicit_state=args.implicit_state,
+            instance_count=tuned_server.get("workers", 1),
+            intra_op_thread_count=tuned_inference.get("intra_op_num_threads", 1),
+            inter_op_thread_count=tuned_inference.get("inter_op_num_threads", 1),
+        ),
+    )
+    print(f"Configuration for {manifest} written to {args.output}")
@@ -0,0 +1,212 @@
+"""Module that serves the acoustic model over KServe v2 HTTP protocol as a local stand-in for Triton.
+
+The server implements the subset of the protocol used by `TritonAcousticModel`: health and model
+readiness endpoints and inference requests with `signal`/`state` inputs and `logprobs`/`state_next`
+outputs (binary or JSON tensors). It runs the model with ONNX Runtime, so services using the remote
+backend can be tested without Triton (e.g. with the synthetic model):
+
+    python -m tone.scripts.triton_standin --model-path /models/model.onnx --port 8000
+
+With `--implicit-state` it emulates a sequence batcher with implicit state instead: requests carry
+only `signal` and sequence parameters, and the state of every sequence is kept by the server.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, ClassVar
+
+import numpy as np
+
+from tone.inference_config import InferenceConfig
+from tone.onnx_wrapper import StreamingCTCModel
+from tone.triton_backend import DATATYPES, INPUT_NAMES, OUTPUT_NAMES, TritonError, decode_message, encode_message
+
+logger = logging.getLogger(__name__)
+
+_MODEL_PATH = re.compile(r"^/v2/models/(?P<name>[^/]+)(?:/versions/(?P<version>[^/]+))?(?P<action>/ready|/infer)?$")
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """Handler of KServe v2 requests to one model."""
+
+    protocol_version = "HTTP/1.1"  # Keep-alive connections, like Triton
+    model: ClassVar[StreamingCTCModel]
+    model_name: ClassVar[str] = "streaming_acoustic"
+    implicit_state: ClassVar[bool] = False
+    max_sequence_idle: ClassVar[float] = 60.0
+    # Implicit states by sequence ids with the time of the last request
+    sequences: ClassVar[dict[int, tuple[StreamingCTCModel.StateType, float]]] = {}
+    sequences_lock: ClassVar[threading.Lock] = threading.Lock()
+
+    def do_GET(self) -> None:
+        """Answer health, readiness and metadata requests."""
+        if self.path in {"/v2/health/live", "/v2/health/ready"}:
+            self._send_json(200, {})
+            return
+        match = _MODEL_PATH.match(self.path)
+        if match is None or match["name"] != self.model_name or match["action"] == "/infer":
+            self._send_json(404, {"error": f"Unknown path: {self.path}"})
+        elif match["action"] == "/ready":
+            self._send_json(200, {})
+        else:
+            self._send_json(
+                200,
+                {
+                    "name": self.model_name,
+                    "versions": ["1"],
+                    "platform": "onnxruntime_onnx",
+                    "inputs": [{"name": name} for name in self._input_names],
+                    "outputs": [{"name": name} for name in self._output_names],
+                },
+            )
+
+    def do_POST(self) -> None:
+        """Run inference request."""
+        match = _MODEL_PATH.match(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if match is None or match["name"] != self.model_name or match["action"] != "/infer":
+            self._send_json(404, {"error": f"Unknown path: {self.path}"})
+            return
+        header_length = self.headers.get("Inference-Header-Content-Length")
+        try:
+            request, inputs = decode_message(body, int(header_length) if header_length else None, "inputs")
+            if self.implicit_state:
+                outputs = {"logprobs": self._forward_sequence(inputs["signal"], request.get("parameters", {}))}
+            else:
+                logprobs, state_next = self.model.forward(inputs["signal"], inputs["state"])
+                outputs = {"logprobs": logprobs, "state_next": state_next}
+        except (KeyError, ValueError, TypeError, TritonError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        response = {"model_name": self.model_name, "model_version": "1", "id": request.get("id", "")}
+        # Outputs are JSON unless binary data is requested (mixing binary and JSON outputs is not supported)
+        entries = request.get("outputs") or [{"name": name} for name in self._output_names]
+        default_binary = request.get("parameters", {}).get("binary_data_output", False)
+        binary = any(entry.get("parameters", {}).get("binary_data", default_binary) for entry in entries)
+        requested = {entry["name"] for entry in entries}
+        selected = {name: output for name, output in outputs.items() if name in requested}
+        if binary:
+            data, response_header_length = encode_message(response, "outputs", selected)
+            self._send(200, data, "application/octet-stream", response_header_length)
+        else:
+            response["outputs"] = [
+                {
+                    "name": name,
+                    "shape": list(output.shape),
+                    "datatype": DATATYPES[output.dtype],
+                    "data": output.flatten().tolist(),
+                }
+                for name, output in selected.items()
+            ]
+            self._send_json(200, response)
+
+    @property
+    def _input_names(self) -> tuple[str, ...]:
+        return ("signal",) if self.implicit_state else INPUT_NAMES
+
+    @property
+    def _output_names(self) -> tuple[str, ...]:
+        return ("logprobs",) if self.implicit_state else OUTPUT_NAMES
+
+    def _forward_sequence(
+        self,
+        signal: StreamingCTCModel.InputType,
+        parameters: dict[str, Any],
+    ) -> StreamingCTCModel.OutputType:
+        """Run one request of a sequence with the state kept by the server, like Triton sequence batcher."""
+        sequence_id = parameters.get("sequence_id", 0)
+        if not sequence_id:
+            raise ValueError("Inference request to a model with implicit state must specify 'sequence_id'")
+        if signal.shape[0] != 1:
+            raise ValueError(f"Inference request of a sequence must have batch size 1, but got {signal.shape[0]}")
+        now = time.monotonic()
+        with self.sequences_lock:
+            for idle_id in [key for key, (_, last) in self.sequences.items() if now - last > self.max_sequence_idle]:
+                del self.sequences[idle_id]
+            if parameters.get("sequence_start", False):
+                state = np.zeros((1, StreamingCTCModel.STATE_SIZE), dtype=np.float16)
+            elif sequence_id in self.sequences:
+                state, _ = self.sequences.pop(sequence_id)
+            else:
+                raise ValueError(f"Inference request for sequence {sequence_id} must specify 'sequence_start'")
+        logprobs, state_next = self.model.forward(signal, state)
+        if not parameters.get("sequence_end", False):
+            with self.sequences_lock:
+                self.sequences[sequence_id] = (state_next, time.monotonic())
+        return logprobs
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        """Log requests with the module logger instead of stderr."""
+        logger.debug(format, *args)
+
+    def _send_json(self, status: int, payload: dict[str, Any]) -> None:
+        self._send(status, json.dumps(payload).encode(), "application/json")
+
+    def _send(self, status: int, data: bytes, content_type: str, header_length: int | None = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        if header_length is not None:
+            self.send_header("Inference-Header-Content-Length", str(header_length))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Serve acoustic model over KServe v2 HTTP protocol")
+    parser.add_argument(
+        "--model-path",
+        type=Path,
+        required=True,
+        help="Path to model.onnx",
+    )
+    parser.add_argument(
+        "--model-name",
+        type=str,
+        default="streaming_acoustic",
+        help="Name of the model in request paths (default: streaming_acoustic)",
+    )
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="Host to listen on (default: 127.0.0.1)",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8000,
+        help="Port to listen on (default: 8000)",
+    )
+    parser.add_argument(
+        "--implicit-state",
+        action="store_true",
+        help="Keep the state of sequences on the server like a sequence batcher (default: False)",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    StandinHandler.model = StreamingCTCModel.from_local(args.model_path, config=InferenceConfig.from_env())
+    StandinHandler.model_name = args.model_name
+    StandinHandler.implicit_state = args.implicit_state
+    server = ThreadingHTTPServer((args.host, args.port), StandinHandler)
+    logger.info("Serving %s as '%s' on %s:%d", args.model_path, args.model_name, args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1 @@
+"""Building blocks for serving the ASR pipeline in web services."""
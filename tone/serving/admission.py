@@ -0,0 +1,237 @@
+"""Module with admission control of new work based on the measured load of the acoustic stage."""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from typing_extensions import Self
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterator
+
+
+@dataclass
+class AdmissionConfig:
+    """Settings of admission control.
+
+    Attributes:
+        capacity: number of chunks the server processes in parallel (1 for a single pipeline)
+        window: length of the window the load is measured over (in sec)
+        max_utilization: maximum projected load of the acoustic stage for admitting a new live stream
+        offline_max_utilization: maximum load for admitting offline work (lower, so live streams are
+            protected: offline work is throttled first)
+        max_queue_depth: maximum number of chunks waiting for the acoustic stage
+        redirect_url: address of another server to send rejected live streams to (optional)
+        expected_rtf: RTF assumed for admitted offline work before any work is measured
+
+    """
+
+    capacity: float = 1.0
+    window: float = 10.0
+    max_utilization: float = 0.85
+    offline_max_utilization: float = 0.6
+    max_queue_depth: int = 32
+    redirect_url: str | None = None
+    expected_rtf: float = 0.1
+
+    @classmethod
+    def from_env(cls, prefix: str = "TONE_ADMISSION_") -> Self:
+        """Read settings from environment variables, e.g. TONE_ADMISSION_MAX_UTILIZATION=0.9."""
+        config = cls()
+        for name, parse in (
+            ("capacity", float),
+            ("window", float),
+            ("max_utilization", float),
+            ("offline_max_utilization", float),
+            ("max_queue_depth", int),
+            ("redirect_url", str),
+            ("expected_rtf", float),
+        ):
+            value = os.getenv(f"{prefix}{name.upper()}")
+            if value:
+                setattr(config, name, parse(value))
+        return config
+
+
+class LoadMonitor:
+    """Tracks live capacity of the acoustic stage and admits or rejects new work.
+
+    Every processed piece of audio is reported with `record`. From the reports of the last `window`
+    seconds the monitor computes the aggregate real-time factor (RTF: compute time per second of audio)
+    and the utilization of the stage (compute time per second of wall time and per unit of capacity).
+    A live stream at real time needs RTF seconds of compute every second, so the projected load of
+    the admitted streams is `active_streams * RTF / capacity`. Offline work admitted but not finished
+    yet is counted by its expected compute time (`audio_seconds * RTF`, at most the whole next window)
+    until the work is released with `release_offline`. Depth of the queue in front of the
+    acoustic stage (if the server has one) is taken into account too.
+
+    New live streams are admitted while the projected load with one more stream stays below
+    `max_utilization`. Offline work is admitted only below the lower `offline_max_utilization`,
+    so it is shed before live streams are affected. Admitted streams are never cut.
+
+    The class is thread-safe.
+    """
+
+    def __init__(self, config: AdmissionConfig | None = None, *, queue_depth: Callable[[], int] | None = None) -> None:
+        """Create monitor.
+
+        Args:
+            config (AdmissionConfig | None): Settings, or None to use defaults.
+            queue_depth (Callable[[], int] | None): Function returning number of chunks waiting for
+                the acoustic stage, if the server has a queue in front of it.
+
+        """
+        self.config = config if config is not None else AdmissionConfig()
+        if self.config.capacity <= 0:
+            raise ValueError(f"'capacity' must be positive, but got {self.config.capacity}")
+        if self.config.window <= 0:
+            raise ValueError(f"'window' must be positive, but got {self.config.window}")
+        self.queue_depth = queue_depth if queue_depth is not None else lambda: 0
+        self.active_streams = 0
+        self.pending_offline_seconds = 0.0  # Audio of admitted offline work not released yet
+        self._records: deque[tuple[float, float, float, float]] = deque()  # Time, audio, compute and busy seconds
+        self._audio_seconds = 0.0
+        self._compute_seconds = 0.0
+        self._busy_seconds = 0.0  # Compute time within the window (long offline work started before it is cut)
+        self._rejected = {"streams": 0, "offline": 0}
+        self._lock = threading.Lock()
+        self._admission_lock = threading.Lock()
+
+    def record(self, audio_seconds: float, compute_seconds: float, *, now: float | None = None) -> None:
+        """Report that `audio_seconds` of audio were processed in `compute_seconds`."""
+        now = time.monotonic() if now is None else now
+        busy_seconds = min(compute_seconds, self.config.window)
+        with self._lock:
+            self._records.append((now, audio_seconds, compute_seconds, busy_seconds))
+            self._audio_seconds += audio_seconds
+            self._compute_seconds += compute_seconds
+            self._busy_seconds += busy_seconds
+            self._expire(now)
+
+    @contextmanager
+    def measure(self, audio_seconds: float) -> Iterator[None]:
+        """Measure processing time of `audio_seconds` of audio and report it."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(audio_seconds, time.perf_counter() - start)
+
+    @contextmanager
+    def track_stream(self) -> Iterator[None]:
+        """Count an admitted live stream as active while the context is open."""
+        with self._lock:
+            self.active_streams += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active_streams -= 1
+
+    @property
+    def rtf(self) -> float | None:
+        """Aggregate real-time factor over the window, or None if nothing was processed."""
+        with self._lock:
+            self._expire(time.monotonic())
+            return self._compute_seconds / self._audio_seconds if self._audio_seconds > 0 else None
+
+    @property
+    def utilization(self) -> float:
+        """Share of the capacity used over the window (may exceed 1 if the server falls behind)."""
+        with self._lock:
+            self._expire(time.monotonic())
+            return self._busy_seconds / (self.config.window * self.config.capacity)
+
+    def projected_utilization(self, extra_streams: int = 0) -> float:
+        """Load of the acoustic stage if `extra_streams` more live streams were admitted."""
+        measured_rtf = self.rtf
+        rtf = measured_rtf or 0.0
+        offline_rtf = measured_rtf if measured_rtf is not None else self.config.expected_rtf
+        window_capacity = self.config.window * self.config.capacity
+        offline_load = min(self.pending_offline_seconds * offline_rtf, window_capacity) / window_capacity
+        streams_load = (self.active_streams + extra_streams) * rtf / self.config.capacity
+        return max(self.utilization + extra_streams * rtf / self.config.capacity, streams_load) + offline_load
+
+    def admit_stream(self) -> str | None:
+        """Check whether a new live stream can be admitted.
+
+        Returns:
+            str | None: Reason of the rejection, or None if the stream is admitted.
+
+        """
+        reason = self._check(self.config.max_utilization, extra_streams=1)
+        if reason is not None:
+            with self._lock:
+                self._rejected["streams"] += 1
+        return reason
+
+    def admit_offline(self, audio_seconds: float = 0.0) -> str | None:
+        """Check whether offline work can be started now.
+
+        The audio of admitted work is counted as pending until `release_offline` is called with it,
+        so work arriving at once is not admitted over capacity before any of it is measured.
+
+        Args:
+            audio_seconds (float): Duration of the audio of the work, if it is known (in sec).
+
+        Returns:
+            str | None: Reason of the rejection, or None if the work is admitted.
+
+        """
+        with self._admission_lock:  # Concurrent requests must see the reservations of each other
+            reason = self._check(self.config.offline_max_utilization)
+            with self._lock:
+                if reason is not None:
+                    self._rejected["offline"] += 1
+                else:
+                    self.pending_offline_seconds += audio_seconds
+        return reason
+
+    def release_offline(self, audio_seconds: float) -> None:
+        """Stop counting admitted offline work as pending (when it is finished or failed)."""
+        with self._lock:
+            self.pending_offline_seconds = max(0.0, self.pending_offline_seconds - audio_seconds)
+
+    def retry_after(self) -> int:
+        """Recommended delay before retrying rejected work (in sec)."""
+        return max(1, round(self.config.window / 2))
+
+    def stats(self) -> dict[str, float | int | bool | None]:
+        """Return load of the acoustic stage and readiness to accept new work."""
+        utilization = self.projected_utilization()
+        with self._lock:
+            rejected = dict(self._rejected)
+        queue_depth = self.queue_depth()
+        return {
+            "ready": utilization < self.config.max_utilization and queue_depth <= self.config.max_queue_depth,
+            "headroom": max(0.0, self.config.max_utilization - utilization),
+            "utilization": utilization,
+            "rtf": self.rtf,
+            "active_streams": self.active_streams,
+            "pending_offline_seconds": self.pending_offline_seconds,
+            "queue_depth": queue_depth,
+            "rejected_streams": rejected["streams"],
+            "rejected_offline": rejected["offline"],
+        }
+
+    def _check(self, max_utilization: float, *, extra_streams: int = 0) -> str | None:
+        queue_depth = self.queue_depth()
+        if queue_depth > self.config.max_queue_depth:
+            return f"Queue of the acoustic stage is full ({queue_depth} chunks)"
+        utilization = self.projected_utilization(extra_streams)
+        if utilization > max_utilization:
+            return f"Server is at capacity (load {utilization:.2f})"
+        return None
+
+    def _expire(self, now: float) -> None:
+        while self._records and self._records[0][0] < now - self.config.window:
+            _, audio_seconds, compute_seconds, busy_seconds = self._records.popleft()
+            self._audio_seconds -= audio_seconds
+            self._compute_seconds -= compute_seconds
+            self._busy_seconds -= busy_seconds
@@ -0,0 +1,67 @@
+"""Module for decoding audio payloads (raw PCM and G.711) into pipeline input samples."""
+
+from __future__ import annotations
+
+from enum import Enum
+
+import numpy as np
+import numpy.typing as npt
+
+
+def _build_ulaw_table() -> npt.NDArray[np.int32]:
+    codes = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent, mantissa = (codes >> 4) & 0x07, codes & 0x0F
+    magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return np.where(codes & 0x80, -magnitude, magnitude).astype(np.int32)
+
+
+def _build_alaw_table() -> npt.NDArray[np.int32]:
+    codes = np.arange(256, dtype=np.int32) ^ 0x55
+    exponent, mantissa = (codes >> 4) & 0x07, codes & 0x0F
+    magnitude = np.where(
+        exponent == 0,
+        (mantissa << 4) + 0x08,
+        ((mantissa << 4) + 0x108) << np.maximum(exponent - 1, 0),
+    )
+    return np.where(codes & 0x80, magnitude, -magnitude).astype(np.int32)
+
+
+# Lookup tables from G.711 code to 16-bit linear PCM sample (stored as int32, ready for the pipeline)
+ULAW_TO_PCM = _build_ulaw_table()
+ALAW_TO_PCM = _build_alaw_table()
+
+
+class AudioEncoding(Enum):
+    """Enumeration of supported encodings of incoming audio (8 kHz mono)."""
+
+    PCM_S16LE = "pcm_s16le"
+    MULAW = "mulaw"
+    ALAW = "alaw"
+
+    @property
+    def sample_width(self) -> int:
+        """Number of bytes per sample."""
+        return 2 if self == AudioEncoding.PCM_S16LE else 1
+
+
+def decode_audio(data: bytes, encoding: AudioEncoding = AudioEncoding.PCM_S16LE) -> npt.NDArray[np.int32]:
+    """Decode raw audio payload into int32 samples in range [-32768; 32767].
+
+    G.711 payloads are decoded with vectorized lookup tables, which is a single gather operation.
+
+    Args:
+        data (bytes): Raw audio payload, its length must be a multiple of the sample width.
+        encoding (AudioEncoding): Encoding of the payload.
+
+    Returns:
+        npt.NDArray[np.int32]: Decoded samples as a 1D numpy array.
+
+    """
+    if encoding == AudioEncoding.PCM_S16LE:
+        return np.frombuffer(data, dtype="<i2").astype(np.int32)
+    codes = np.frombuffer(data, dtype=np.uint8)
+    if encoding == AudioEncoding.MULAW:
+        return ULAW_TO_PCM[codes]
+    if encoding == AudioEncoding.ALAW:
+        return ALAW_TO_PCM[codes]
+    raise ValueError("Unknown audio encoding")
@@ -0,0 +1,192 @@
+"""Module with a content-addressed cache of transcription results."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_lru ON results (accessed_at);
+CREATE TABLE IF NOT EXISTS usage (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL);
+INSERT OR IGNORE INTO usage (id, size) VALUES (0, 0);
+CREATE TRIGGER IF NOT EXISTS results_insert AFTER INSERT ON results BEGIN
+    UPDATE usage SET size = size + NEW.size;
+END;
+CREATE TRIGGER IF NOT EXISTS results_delete AFTER DELETE ON results BEGIN
+    UPDATE usage SET size = size - OLD.size;
+END;
+"""
+
+
+def transcription_key(payload: bytes, *, fingerprint: str, encoding: str = "") -> str:
+    """Return cache key of the transcription of the audio payload.
+
+    BLAKE2b is used as a fast hash: it is faster than SHA-256 on 64-bit CPUs and does not
+    require additional dependencies.
+
+    Args:
+        payload (bytes): Raw audio payload.
+        fingerprint (str): Identity of the pipeline, see `StreamingCTCPipeline.fingerprint`.
+        encoding (str): Encoding of the payload.
+
+    Returns:
+        str: Hex digest identifying the payload and the pipeline.
+
+    """
+    digest = hashlib.blake2b(f"{fingerprint}|{encoding}|".encode(), digest_size=20)
+    digest.update(payload)
+    return digest.hexdigest()
+
+
+class TranscriptionCache:
+    """Two-tier LRU cache of JSON-serializable transcription results.
+
+    The first tier keeps up to `max_memory_items` results in memory. The second (optional)
+    tier stores results in an SQLite database in `disk_dir` and evicts the least recently used
+    ones when their total size exceeds `max_disk_bytes`. Results found on disk are promoted to memory.
+    The disk tier is shared by all processes using the directory: lookups, the LRU order and
+    the size limit are kept in the database, so a result stored by one process is found by the others.
+
+    The class is thread-safe, every thread uses its own connection.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_memory_items: int = 1024,
+        disk_dir: Path | str | None = None,
+        max_disk_bytes: int = 1 << 30,
+    ) -> None:
+        if max_memory_items < 0:
+            raise ValueError(f"'max_memory_items' must be non-negative, but got {max_memory_items}")
+        if max_disk_bytes <= 0:
+            raise ValueError(f"'max_disk_bytes' must be positive, but got {max_disk_bytes}")
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: OrderedDict[str, Any] = OrderedDict()  # From the least to the most recently used
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "disk_evictions": 0}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        self.disk_dir = Path(disk_dir) if disk_dir is not None else None
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            connection = self._connection()
+            connection.executescript(_SCHEMA)
+            items, size = connection.execute("SELECT COUNT(*), (SELECT size FROM usage) FROM results").fetchone()
+            logger.info("Transcription cache: %d results (%d bytes) found on disk", items, size)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            assert self.disk_dir is not None
+            # Autocommit mode, transactions are opened explicitly where several statements must be atomic
+            connection = sqlite3.connect(self.disk_dir / "results.sqlite3", timeout=30.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key: str) -> Any | None:
+        """Return cached result, or None if the key is not in the cache."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return self._memory[key]
+        result = self._get_disk(key) if self.disk_dir is not None else None
+        with self._lock:
+            if result is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["disk_hits"] += 1
+            self._put_memory(key, result)
+            return result
+
+    def put(self, key: str, result: Any) -> None:
+        """Store JSON-serializable result in the cache."""
+        data = json.dumps(result, ensure_ascii=False).encode()
+        with self._lock:
+            self._put_memory(key, result)
+        if self.disk_dir is None or len(data) > self.max_disk_bytes:
+            return
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")  # Lock the database for writing, so the size is checked by one process
+        try:
+            connection.execute("DELETE FROM results WHERE key = ?", (key,))  # REPLACE would not fire the trigger
+            connection.execute(
+                "INSERT INTO results (key, data, size, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time()),
+            )
+            evicted = self._evict(connection)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        if evicted:
+            with self._lock:
+                self._counters["disk_evictions"] += evicted
+
+    def stats(self) -> dict[str, int | float]:
+        """Return hit/miss counters and sizes of the cache tiers (of this process, except for the disk sizes)."""
+        disk_items, disk_bytes = 0, 0
+        if self.disk_dir is not None:
+            disk_items, disk_bytes = (
+                self._connection().execute("SELECT COUNT(*), (SELECT size FROM usage) FROM results").fetchone()
+            )
+        with self._lock:
+            lookups = self._counters["memory_hits"] + self._counters["disk_hits"] + self._counters["misses"]
+            hits = lookups - self._counters["misses"]
+            return {
+                **self._counters,
+                "hit_ratio": hits / lookups if lookups else 0.0,
+                "memory_items": len(self._memory),
+                "disk_items": disk_items,
+                "disk_bytes": disk_bytes,
+            }
+
+    def _get_disk(self, key: str) -> Any | None:
+        connection = self._connection()
+        row = connection.execute("SELECT data FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        # Keep the LRU order shared by the processes
+        connection.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def _evict(self, connection: sqlite3.Connection) -> int:
+        """Delete the least recently used results until they fit into `max_disk_bytes`, return their number."""
+        (disk_bytes,) = connection.execute("SELECT size FROM usage").fetchone()
+        evicted = 0
+        while disk_bytes > self.max_disk_bytes:
+            rows = connection.execute("SELECT key, size FROM results ORDER BY accessed_at LIMIT 64").fetchall()
+            for key, size in rows:
+                if disk_bytes <= self.max_disk_bytes:
+                    break
+                connection.execute("DELETE FROM results WHERE key = ?", (key,))
+                disk_bytes -= size
+                evicted += 1
+        return evicted
+
+    def _put_memory(self, key: str, result: Any) -> None:
+        if self.max_memory_items == 0:
+            return
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
@@ -0,0 +1,85 @@
+"""Module for splitting a stream of encoded audio bytes into pipeline chunks."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from tone.onnx_wrapper import StreamingCTCModel
+from tone.pipeline import StreamingCTCPipeline
+from tone.serving.audio_encoding import AudioEncoding, decode_audio
+from tone.serving.resample import StreamingResampler
+from tone.serving.ring_buffer import AudioRingBuffer
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    import numpy as np
+    import numpy.typing as npt
+
+
+class AudioChunker:
+    """Converts audio bytes arriving in arbitrary pieces into chunks for `StreamingCTCPipeline.forward`.
+
+    Incoming bytes are decoded (and resampled if the sample rate differs from the model one) into a
+    ring buffer. The stream is padded with `StreamingCTCPipeline.PADDING` zeros at both ends and the
+    last chunk is filled with zeros, so the chunks are the same as in `StreamingCTCPipeline.forward_offline`.
+    Pieces of any size are accepted: they are processed in parts small enough to fit the buffer.
+
+    Chunks are `chunk_size` samples long (`CHUNK_SIZE` of the pipeline they are fed to), they are views
+    into the ring buffer and are valid only until the next `feed` or `finish` call resumes. Not thread-safe.
+    """
+
+    def __init__(
+        self,
+        encoding: AudioEncoding = AudioEncoding.PCM_S16LE,
+        *,
+        sample_rate: int = StreamingCTCModel.SAMPLE_RATE,
+        chunk_size: int = StreamingCTCPipeline.CHUNK_SIZE,
+        capacity: int | None = None,
+    ) -> None:
+        if chunk_size <= 0:
+            raise ValueError(f"'chunk_size' must be positive, but got {chunk_size}")
+        capacity = capacity if capacity is not None else chunk_size * 16
+        if capacity < 4 * chunk_size:
+            raise ValueError(f"'capacity' must be at least {4 * chunk_size}, but got {capacity}")
+        self.encoding = encoding
+        self.chunk_size = chunk_size
+        self.resampler = StreamingResampler(sample_rate) if sample_rate != StreamingCTCModel.SAMPLE_RATE else None
+        self._buffer = AudioRingBuffer(capacity)
+        # See description of PADDING in StreamingCTCPipeline
+        self._buffer.write_zeros(StreamingCTCPipeline.PADDING)
+        # Max bytes decoded at once: the buffer holds less than a chunk before every write
+        self._max_piece = (capacity - 2 * chunk_size) * encoding.sample_width
+        self._leftover = b""  # Incomplete sample from the previous piece
+        self.num_bytes = 0
+
+    def feed(self, data: bytes) -> Iterator[npt.NDArray[np.int32]]:
+        """Add the next piece of audio bytes and yield all complete chunks."""
+        self.num_bytes += len(data)
+        if self._leftover:
+            data, self._leftover = self._leftover + data, b""
+        for start in range(0, len(data), self._max_piece):
+            piece = data[start : start + self._max_piece]
+            split = len(piece) - len(piece) % self.encoding.sample_width
+            self._write(piece[:split])
+            self._leftover = piece[split:]
+            while len(self._buffer) >= self.chunk_size:
+                yield self._buffer.read(self.chunk_size)
+
+    def finish(self) -> Iterator[tuple[npt.NDArray[np.int32], bool]]:
+        """Finish the stream and yield the remaining chunks with a flag of the last chunk."""
+        if self.resampler is not None:
+            self._buffer.write(self.resampler.flush())
+        self._buffer.write_zeros(StreamingCTCPipeline.PADDING)
+        self._buffer.write_zeros(-len(self._buffer) % self.chunk_size)
+        while len(self._buffer) > 0:
+            chunk = self._buffer.read(self.chunk_size)
+            yield chunk, len(self._buffer) == 0
+
+    def _write(self, data: bytes) -> None:
+        if self.resampler is not None:
+            self._buffer.write(self.resampler.process(decode_audio(data, self.encoding)))
+        elif self.encoding == AudioEncoding.PCM_S16LE:
+            self._buffer.write_bytes(data)  # Converted to int32 while copying into the buffer
+        else:
+            self._buffer.write(decode_audio(data, self.encoding))
@@ -0,0 +1,394 @@
+"""Module with elastic chunk size of live sessions: a longer-chunk model is used when the server is hot.
+
+A model exported with a longer chunk (e.g. 600 ms, see `--chunk-duration-ms` of `tone.scripts.export`)
+needs fewer calls per second of audio than the 300 ms model at the cost of higher latency. Under heavy
+load it is better to give live sessions slightly higher latency than to fall behind real time, so
+`ElasticPipeline` hosts both models and moves sessions between them:
+
+- `ElasticPolicy` picks the model for the current load of the acoustic stage (utilization measured by
+  `LoadMonitor`) with hysteresis: the long model above `high_utilization`, the short one below
+  `low_utilization`, and no policy change for `min_dwell` seconds after the previous one;
+- a session switches to the model of the policy only at a phrase boundary (the splitter has no
+  unfinished speech), so every phrase is recognized by one model. The new model starts with a fresh
+  state and replays the last audio the old model has not emitted yet (its time bias), so nothing is lost.
+
+The policy and the effect on RTF are observable with `ElasticPipeline.stats`:
+
+    policy = ElasticPolicy(monitor)
+    elastic = ElasticPipeline(pipeline, StreamingCTCModel.from_local("model.600ms.onnx"), policy)
+    phrases, state = elastic.forward(audio_chunk, state)  # 300 ms chunks from `AudioChunker`
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+import numpy as np
+from typing_extensions import Self
+
+from tone.logprob_splitter import StreamingLogprobSplitterState
+from tone.onnx_wrapper import StreamingCTCModel
+from tone.pipeline import StreamingCTCPipeline
+from tone.serving.sessions import StateCodec, deserialize_state, serialize_state, state_nbytes
+
+if TYPE_CHECKING:
+    from tone.serving.admission import LoadMonitor
+
+logger = logging.getLogger(__name__)
+
+# Serialized elastic state layout (little-endian):
+#   header: magic, version, flags, position, number of pending and history chunks, chunk size (samples)
+#   payload (zlib-compressed if FLAG_COMPRESSED is set): pending chunks, history chunks (int32 samples),
+#           then the pipeline state serialized with `serialize_state` (if FLAG_PIPELINE_STATE is set)
+_ELASTIC_STATE_MAGIC = b"TONE"
+_ELASTIC_STATE_VERSION = 1
+_FLAG_COMPRESSED = 0x01
+_FLAG_USE_LONG = 0x02
+_FLAG_PIPELINE_STATE = 0x04
+_ELASTIC_STATE_HEADER = struct.Struct("<4sBBqIII")
+
+
+@dataclass
+class ElasticConfig:
+    """Settings of the elastic chunk size policy.
+
+    Attributes:
+        high_utilization: load of the acoustic stage to move sessions to the long model at
+        low_utilization: load to move sessions back to the short model at
+        min_dwell: minimum time between policy changes (in sec)
+        check_interval: how often the load is checked (in sec)
+
+    """
+
+    high_utilization: float = 0.75
+    low_utilization: float = 0.45
+    min_dwell: float = 10.0
+    check_interval: float = 1.0
+
+    @classmethod
+    def from_env(cls, prefix: str = "TONE_ELASTIC_") -> Self:
+        """Read settings from environment variables, e.g. TONE_ELASTIC_HIGH_UTILIZATION=0.8."""
+        config = cls()
+        for name in ("high_utilization", "low_utilization", "min_dwell", "check_interval"):
+            value = os.getenv(f"{prefix}{name.upper()}")
+            if value:
+                setattr(config, name, float(value))
+        return config
+
+
+class ElasticPolicy:
+    """Chooses between the short and the long model by the load of the acoustic stage.
+
+    The class is thread-safe.
+    """
+
+    def __init__(self, monitor: LoadMonitor, config: ElasticConfig | None = None) -> None:
+        """Create policy.
+
+        Args:
+            monitor (LoadMonitor): Monitor measuring the load of the acoustic stage.
+            config (ElasticConfig | None): Settings, or None to use defaults.
+
+        """
+        self.monitor = monitor
+        self.config = config if config is not None else ElasticConfig()
+        if not 0 <= self.config.low_utilization < self.config.high_utilization:
+            raise ValueError(
+                f"'low_utilization' must be in range [0; high_utilization), "
+                f"but got {self.config.low_utilization} and {self.config.high_utilization}",
+            )
+        self._use_long = False
+        self._changed_at = -math.inf
+        self._checked_at = -math.inf
+        self._changes = 0
+        self._lock = threading.Lock()
+
+    def use_long(self, now: float | None = None) -> bool:
+        """Return whether sessions should use the long model now."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if now - self._checked_at < self.config.check_interval or now - self._changed_at < self.config.min_dwell:
+                return self._use_long
+            self._checked_at = now
+        utilization = self.monitor.utilization
+        with self._lock:
+            if self._use_long and utilization <= self.config.low_utilization:
+                use_long = False
+            elif not self._use_long and utilization >= self.config.high_utilization:
+                use_long = True
+            else:
+                return self._use_long
+            self._use_long, self._changed_at = use_long, now
+            self._changes += 1
+        logger.info("Elastic policy: %s model for load %.2f", "long" if use_long else "short", utilization)
+        return use_long
+
+    def stats(self) -> dict[str, float | int | str]:
+        """Return current choice of the policy and its thresholds."""
+        with self._lock:
+            return {
+                "model": "long" if self._use_long else "short",
+                "policy_changes": self._changes,
+                "high_utilization": self.config.high_utilization,
+                "low_utilization": self.config.low_utilization,
+            }
+
+
+@dataclass
+class ElasticState:
+    """State of a session of `ElasticPipeline`.
+
+    Attributes:
+        use_long: whether the session uses the long model
+        pipeline_state: state of the pipeline of the current model
+        position: number of samples of the stream processed by the current model
+        pending: chunks received but not processed yet (the long model waits for a full chunk)
+        history: last processed chunks, replayed by the new model after a switch
+
+    """
+
+    use_long: bool
+    pipeline_state: StreamingCTCPipeline.StateType | None = None
+    position: int = 0
+    pending: list[StreamingCTCPipeline.InputType] = field(default_factory=list)
+    history: deque[StreamingCTCPipeline.InputType] = field(default_factory=deque)
+
+
+def elastic_state_nbytes(state: ElasticState) -> int:
+    """Return number of bytes occupied by arrays of the elastic state."""
+    chunks_nbytes = sum(chunk.nbytes for chunk in state.pending) + sum(chunk.nbytes for chunk in state.history)
+    return chunks_nbytes + (state_nbytes(state.pipeline_state) if state.pipeline_state is not None else 0)
+
+
+def serialize_elastic_state(state: ElasticState, *, compress_level: int = 1) -> bytes:
+    """Serialize elastic state into a compact binary representation, see `serialize_state`.
+
+    Args:
+        state (ElasticState): Elastic state to serialize.
+        compress_level (int): zlib compression level (0 - no compression, 9 - best compression).
+
+    Returns:
+        bytes: Serialized state.
+
+    """
+    chunks = [*state.pending, *state.history]
+    chunk_size = len(chunks[0]) if chunks else 0
+    if any(chunk.shape != (chunk_size,) for chunk in chunks):
+        raise ValueError("Pending and history chunks of the state must be 1-dimensional and of the same size")
+    payload = b"".join(np.ascontiguousarray(chunk, dtype=np.int32).tobytes() for chunk in chunks)
+    flags = _FLAG_USE_LONG if state.use_long else 0
+    if state.pipeline_state is not None:
+        payload += serialize_state(state.pipeline_state, compress_level=0)
+        flags |= _FLAG_PIPELINE_STATE
+    if compress_level > 0:
+        payload = zlib.compress(payload, compress_level)
+        flags |= _FLAG_COMPRESSED
+
+    header = _ELASTIC_STATE_HEADER.pack(
+        _ELASTIC_STATE_MAGIC,
+        _ELASTIC_STATE_VERSION,
+        flags,
+        state.position,
+        len(state.pending),
+        len(state.history),
+        chunk_size,
+    )
+    return header + payload
+
+
+def deserialize_elastic_state(data: bytes) -> ElasticState:
+    """Restore elastic state serialized with `serialize_elastic_state`.
+
+    Args:
+        data (bytes): Serialized state.
+
+    Returns:
+        ElasticState: Restored elastic state.
+
+    """
+    if len(data) < _ELASTIC_STATE_HEADER.size:
+        raise ValueError("Serialized state is too short")
+    magic, version, flags, position, num_pending, num_history, chunk_size = _ELASTIC_STATE_HEADER.unpack_from(data)
+    if magic != _ELASTIC_STATE_MAGIC:
+        raise ValueError("Data is not a serialized elastic state")
+    if version != _ELASTIC_STATE_VERSION:
+        raise ValueError(f"Unsupported version of serialized state: {version}")
+
+    payload = data[_ELASTIC_STATE_HEADER.size :]
+    if flags & _FLAG_COMPRESSED:
+        payload = zlib.decompress(payload)
+    chunks_nbytes = (num_pending + num_history) * chunk_size * 4
+    if len(payload) < chunks_nbytes or (len(payload) > chunks_nbytes) != bool(flags & _FLAG_PIPELINE_STATE):
+        raise ValueError("Size of serialized state does not match its header")
+
+    # Writable copy, so restored chunks are not read-only
+    samples = np.frombuffer(payload, dtype=np.int32, count=chunks_nbytes // 4).copy()
+    chunks = list(samples.reshape(num_pending + num_history, chunk_size))
+    pipeline_state = deserialize_state(payload[chunks_nbytes:]) if flags & _FLAG_PIPELINE_STATE else None
+    return ElasticState(
+        use_long=bool(flags & _FLAG_USE_LONG),
+        pipeline_state=pipeline_state,
+        position=position,
+        pending=chunks[:num_pending],
+        history=deque(chunks[num_pending:]),
+    )
+
+
+# Makes `SessionManager` keep states of `ElasticPipeline` sessions
+ELASTIC_STATE_CODEC: StateCodec[ElasticState] = StateCodec(
+    nbytes=elastic_state_nbytes,
+    serialize=lambda state, compress_level: serialize_elastic_state(state, compress_level=compress_level),
+    deserialize=deserialize_elastic_state,
+)
+
+
+class ElasticPipeline:
+    """Streaming pipeline recognizing every session with the short or the long model, see the module docstring.
+
+    Input chunks are always chunks of the short model (300 ms), in the long mode they are collected
+    until a chunk of the long model is full. The class is thread-safe for different sessions.
+    """
+
+    def __init__(self, pipeline: StreamingCTCPipeline, long_model: StreamingCTCModel, policy: ElasticPolicy) -> None:
+        """Create elastic pipeline.
+
+        Args:
+            pipeline (StreamingCTCPipeline): Pipeline with the short model, its splitter and decoder are shared.
+            long_model (StreamingCTCModel): Model with a chunk that is a multiple of the chunk of the short model.
+            policy (ElasticPolicy): Policy choosing the model by the load.
+
+        Raises:
+            TypeError: If the short model is not a local `StreamingCTCModel`.
+            ValueError: If the models are not compatible.
+
+        """
+        if not isinstance(pipeline.model, StreamingCTCModel):
+            raise TypeError(f"Model of the pipeline must be StreamingCTCModel, but got {type(pipeline.model)}")
+        short_model = pipeline.model
+        if long_model.AUDIO_CHUNK_SAMPLES % short_model.AUDIO_CHUNK_SAMPLES != 0:
+            raise ValueError(
+                f"Chunk of the long model ({long_model.AUDIO_CHUNK_SAMPLES} samples) must be a multiple "
+                f"of the chunk of the short model ({short_model.AUDIO_CHUNK_SAMPLES} samples)",
+            )
+        # The splitter continues the stream of frames of the other model after a switch
+        if long_model.SAMPLE_RATE != short_model.SAMPLE_RATE or not np.isclose(
+            long_model.FRAME_SIZE,
+            short_model.FRAME_SIZE,
+        ):
+            raise ValueError(
+                f"Long model must have the same sample rate and frame size as the short model "
+                f"({short_model.SAMPLE_RATE} Hz, {short_model.FRAME_SIZE} sec), "
+                f"but got {long_model.SAMPLE_RATE} Hz, {long_model.FRAME_SIZE} sec",
+            )
+        self.short = pipeline
+        self.long = StreamingCTCPipeline(long_model, pipeline.logprob_splitter, pipeline.decoder)
+        self.policy = policy
+        self.chunk_size = short_model.AUDIO_CHUNK_SAMPLES
+        self._frame_samples = round(short_model.FRAME_SIZE * short_model.SAMPLE_RATE)
+        # Number of last chunks not emitted by the model yet (the time bias), replayed after a switch
+        self._replay_chunks = {
+            use_long: math.ceil(model.MEAN_TIME_BIAS * model.SAMPLE_RATE / self.chunk_size)
+            for use_long, model in ((False, short_model), (True, long_model))
+        }
+        self._stats = {
+            "switches_to_long": 0,
+            "switches_to_short": 0,
+            **{f"{name}_{key}": 0 for name in ("short", "long") for key in ("calls", "chunks")},
+        }
+        self._compute_seconds = {"short": 0.0, "long": 0.0}
+        self._lock = threading.Lock()
+
+    def forward(
+        self,
+        audio_chunk: StreamingCTCPipeline.InputType,
+        state: ElasticState | None = None,
+        *,
+        is_last: bool = False,
+    ) -> tuple[StreamingCTCPipeline.OutputType, ElasticState]:
+        """Perform online (streaming) CTC decoding on a 300 ms audio chunk of a session.
+
+        See `StreamingCTCPipeline.forward` for more info.
+
+        Args:
+            audio_chunk (StreamingCTCPipeline.InputType): A chunk of the short model (2400 samples).
+            state (ElasticState | None): Previous state, or None to initialize.
+            is_last (bool): Whether this is the final chunk of the input stream.
+
+        Returns:
+            tuple[StreamingCTCPipeline.OutputType, ElasticState]: Decoded output and updated state.
+
+        """
+        if audio_chunk.shape != (self.chunk_size,):
+            raise ValueError(f"Shape of 'audio_chunk' must be ({self.chunk_size},), but got {audio_chunk.shape}")
+        use_long = self.policy.use_long()
+        if state is None:
+            state = ElasticState(use_long=use_long)
+        elif use_long != state.use_long and not self.short.logprob_splitter.has_unfinished_phrase(
+            state.pipeline_state[1] if state.pipeline_state is not None else None,
+        ):
+            self._switch(state)
+        state.pending.append(audio_chunk.copy())  # Chunks from `AudioChunker` are views into its buffer
+
+        pipeline = self.long if state.use_long else self.short
+        name = "long" if state.use_long else "short"
+        chunks_per_call = pipeline.CHUNK_SIZE // self.chunk_size
+        if is_last:
+            state.pending.extend(np.zeros_like(audio_chunk) for _ in range(-len(state.pending) % chunks_per_call))
+        outputs: StreamingCTCPipeline.OutputType = []
+        while len(state.pending) >= chunks_per_call:
+            chunks, state.pending = state.pending[:chunks_per_call], state.pending[chunks_per_call:]
+            start = time.perf_counter()
+            output, state.pipeline_state = pipeline.forward(
+                np.concatenate(chunks),
+                state.pipeline_state,
+                is_last=is_last and not state.pending,
+            )
+            compute_seconds = time.perf_counter() - start
+            outputs.extend(output)
+            state.position += pipeline.CHUNK_SIZE
+            state.history.extend(chunks)
+            while len(state.history) > self._replay_chunks[state.use_long]:
+                state.history.popleft()
+            with self._lock:
+                self._stats[f"{name}_calls"] += 1
+                self._stats[f"{name}_chunks"] += chunks_per_call
+                self._compute_seconds[name] += compute_seconds
+        return outputs, state
+
+    def stats(self) -> dict[str, float | int | str | None]:
+        """Return choice of the policy, numbers of switches and model calls, and RTF of both models."""
+        with self._lock:
+            stats: dict[str, float | int | str | None] = {**self.policy.stats(), **self._stats}
+            for name in ("short", "long"):
+                audio_seconds = self._stats[f"{name}_chunks"] * self.chunk_size / self.short.model.SAMPLE_RATE
+                stats[f"{name}_rtf"] = self._compute_seconds[name] / audio_seconds if audio_seconds > 0 else None
+        return stats
+
+    def _switch(self, state: ElasticState) -> None:
+        """Move the session to the other model at a phrase boundary.
+
+        The new model starts with a fresh state from the audio the old model has not emitted yet,
+        the splitter continues from the frame of that audio, so timings of the phrases stay right.
+        """
+        replay = list(state.history)
+        start = state.position - len(replay) * self.chunk_size
+        state.use_long = not state.use_long
+        pipeline = self.long if state.use_long else self.short
+        model = pipeline.model
+        assert isinstance(model, StreamingCTCModel)
+        model_state = np.zeros((1, model.STATE_SIZE), dtype=model.manifest.numpy_state_dtype)
+        state.pipeline_state = (model_state, StreamingLogprobSplitterState(offset=start // self._frame_samples))
+        state.pending = replay + state.pending
+        state.position = start
+        state.history.clear()
+        with self._lock:
+            self._stats["switches_to_long" if state.use_long else "switches_to_short"] += 1
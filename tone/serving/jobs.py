@@ -0,0 +1,441 @@
+"""Module with a local persistent job queue for asynchronous transcription."""
+
+from __future__ import annotations
+
+import json
+import logging
+import multiprocessing as mp
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from tone.decoder import DecoderType
+from tone.serving.audio_encoding import AudioEncoding, decode_audio
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from multiprocessing.process import BaseProcess
+    from multiprocessing.synchronize import Event
+
+    from tone.inference_config import InferenceConfig
+
+logger = logging.getLogger(__name__)
+
+# Job statuses follow the names used by Celery, so HTTP clients written for it keep working
+PENDING, STARTED, RETRY, SUCCESS, FAILURE = "PENDING", "STARTED", "RETRY", "SUCCESS", "FAILURE"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    encoding TEXT NOT NULL,
+    payload BLOB,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    lease_until REAL,
+    finished_at REAL,
+    worker TEXT,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created_at);
+"""
+
+
+@dataclass
+class Job:
+    """Job claimed by a worker.
+
+    Attributes:
+        job_id: unique id of the job
+        audio: raw audio payload
+        encoding: encoding of the payload
+        attempts: number of attempts including the current one
+
+    """
+
+    job_id: str
+    audio: bytes
+    encoding: AudioEncoding
+    attempts: int
+
+
+class JobQueue:
+    """Persistent priority queue of transcription jobs and store of their results backed by SQLite.
+
+    The queue is shared by the web server and worker processes through the database file, so
+    submitted jobs survive restarts. Jobs with higher priority are claimed first, jobs with equal
+    priority are claimed in order of submission. Failed jobs are retried up to `max_attempts` times,
+    except jobs whose payload cannot be decoded, which would fail the same way again.
+    A claimed job is leased to its worker for `visibility_timeout` seconds, and the worker renews the
+    lease with `heartbeat` while the job runs, so long jobs are not run twice. Jobs whose lease expired
+    (the worker crashed or hung) are returned to the queue, or failed if their attempts are exhausted.
+    Finished jobs are deleted `result_ttl` seconds after completion.
+
+    The class is thread-safe, every thread uses its own connection.
+    """
+
+    def __init__(
+        self,
+        db_path: Path | str,
+        *,
+        result_ttl: float = 3600.0,
+        max_attempts: int = 3,
+        visibility_timeout: float = 600.0,
+    ) -> None:
+        if max_attempts <= 0:
+            raise ValueError(f"'max_attempts' must be positive, but got {max_attempts}")
+        self.db_path = Path(db_path)
+        self.result_ttl = result_ttl
+        self.max_attempts = max_attempts
+        self.visibility_timeout = visibility_timeout
+        self._local = threading.local()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        connection = self._connection()
+        connection.executescript(_SCHEMA)
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(jobs)")}
+        if "lease_until" not in columns:  # Database created before leases
+            connection.execute("ALTER TABLE jobs ADD COLUMN lease_until REAL")
+
+    def __getstate__(self) -> dict[str, Any]:
+        """Pickle settings only, connections are opened anew in every process."""
+        return {key: value for key, value in self.__dict__.items() if key != "_local"}
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        """Restore settings of the queue in another process."""
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Autocommit mode, transactions are opened explicitly where several statements must be atomic
+            connection = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def submit(
+        self,
+        audio: bytes,
+        *,
+        encoding: AudioEncoding = AudioEncoding.PCM_S16LE,
+        priority: int = 0,
+    ) -> str:
+        """Put a new job into the queue and return its id."""
+        job_id = uuid.uuid4().hex
+        self._connection().execute(
+            "INSERT INTO jobs (id, status, priority, encoding, payload, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, PENDING, priority, encoding.value, audio, time.time()),
+        )
+        return job_id
+
+    def claim(self, worker: str) -> Job | None:
+        """Take the next job from the queue, or return None if the queue is empty."""
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")  # Lock the database for writing, so a job is claimed only once
+        try:
+            row = connection.execute(
+                "SELECT id, encoding, payload, attempts FROM jobs WHERE status IN (?, ?) "
+                "ORDER BY priority DESC, created_at LIMIT 1",
+                (PENDING, RETRY),
+            ).fetchone()
+            if row is not None:
+                now = time.time()
+                connection.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, started_at = ?, lease_until = ?, worker = ? "
+                    "WHERE id = ?",
+                    (STARTED, now, now + self.visibility_timeout, worker, row[0]),
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        job_id, encoding, payload, attempts = row
+        return Job(job_id=job_id, audio=payload, encoding=AudioEncoding(encoding), attempts=attempts + 1)
+
+    def heartbeat(self, job_id: str, worker: str) -> bool:
+        """Extend the lease of a running job for another `visibility_timeout` seconds.
+
+        Returns:
+            bool: Whether the job is still leased to the worker (False if it was requeued after its lease expired).
+
+        """
+        return (
+            self._connection()
+            .execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = ? AND worker = ?",
+                (time.time() + self.visibility_timeout, job_id, STARTED, worker),
+            )
+            .rowcount
+            > 0
+        )
+
+    def complete(self, job_id: str, result: Any) -> None:
+        """Store JSON-serializable result of the job and release its payload."""
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, result = ?, payload = NULL, finished_at = ? WHERE id = ?",
+            (SUCCESS, json.dumps(result, ensure_ascii=False), time.time(), job_id),
+        )
+
+    def fail(self, job_id: str, error: str, *, retry: bool = True) -> None:
+        """Mark the attempt as failed: return the job to the queue or fail it if attempts are exhausted.
+
+        Args:
+            job_id (str): Id of the job.
+            error (str): Description of the error.
+            retry (bool): Whether another attempt may succeed, otherwise the job fails at once.
+
+        """
+        max_attempts = self.max_attempts if retry else 0
+        self._connection().execute(
+            "UPDATE jobs SET status = CASE WHEN attempts < ? THEN ? ELSE ? END, error = ?, "
+            "payload = CASE WHEN attempts < ? THEN payload END, "
+            "finished_at = CASE WHEN attempts < ? THEN NULL ELSE ? END WHERE id = ?",
+            (max_attempts, RETRY, FAILURE, error, max_attempts, max_attempts, time.time(), job_id),
+        )
+
+    def get(self, job_id: str) -> dict[str, Any] | None:
+        """Return status information and result of the job, or None if the job is unknown or expired."""
+        row = (
+            self._connection()
+            .execute(
+                "SELECT status, priority, attempts, created_at, started_at, finished_at, result, error "
+                "FROM jobs WHERE id = ?",
+                (job_id,),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        status, priority, attempts, created_at, started_at, finished_at, result, error = row
+        return {
+            "task_id": job_id,
+            "status": status,
+            "priority": priority,
+            "attempts": attempts,
+            "created_at": created_at,
+            "started_at": started_at,
+            "finished_at": finished_at,
+            "result": json.loads(result) if result is not None else None,
+            "error": error,
+        }
+
+    def maintain(self, now: float | None = None) -> tuple[int, int]:
+        """Return jobs with expired leases to the queue (or fail them after `max_attempts`) and delete expired results.
+
+        Returns:
+            tuple[int, int]: Numbers of requeued or failed jobs and deleted jobs.
+
+        """
+        now = time.time() if now is None else now
+        connection = self._connection()
+        # Jobs claimed before leases were added expire `visibility_timeout` seconds after the start
+        requeued = connection.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts < ? THEN ? ELSE ? END, "
+            "error = CASE WHEN attempts < ? THEN error ELSE ? END, "
+            "payload = CASE WHEN attempts < ? THEN payload END, "
+            "finished_at = CASE WHEN attempts < ? THEN NULL ELSE ? END "
+            "WHERE status = ? AND COALESCE(lease_until, started_at + ?) < ?",
+            (
+                self.max_attempts,
+                RETRY,
+                FAILURE,
+                self.max_attempts,
+                "Lease of the job expired, the worker stopped responding",
+                self.max_attempts,
+                self.max_attempts,
+                now,
+                STARTED,
+                self.visibility_timeout,
+                now,
+            ),
+        ).rowcount
+        deleted = connection.execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+            (SUCCESS, FAILURE, now - self.result_ttl),
+        ).rowcount
+        return requeued, deleted
+
+    def stats(self) -> dict[str, int]:
+        """Return number of jobs for every status."""
+        rows = self._connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict.fromkeys((PENDING, STARTED, RETRY, SUCCESS, FAILURE), 0) | dict(rows)
+
+
+@contextmanager
+def _renewed_lease(queue: JobQueue, job_id: str, worker: str) -> Iterator[None]:
+    """Renew the lease of the job from a background thread while the block runs."""
+    done = threading.Event()
+
+    def renew() -> None:
+        while not done.wait(queue.visibility_timeout / 3):
+            if not queue.heartbeat(job_id, worker):
+                logger.warning("Lease of job %s is lost, it may be run by another worker", job_id)
+                return
+
+    thread = threading.Thread(target=renew, name=f"lease-{job_id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        done.set()
+        thread.join()
+
+
+def _worker_loop(
+    *,
+    queue: JobQueue,
+    model_dir: Path,
+    decoder_type: DecoderType,
+    inference_config: InferenceConfig | None,
+    stop_event: Event,
+    poll_interval: float,
+    maintenance_interval: float,
+) -> None:
+    """Run jobs from the queue until `stop_event` is set (entry point of a worker process)."""
+    from tone.pipeline import StreamingCTCPipeline
+
+    logging.basicConfig(level=logging.INFO)
+    pipeline = StreamingCTCPipeline.from_local(model_dir, decoder_type=decoder_type, inference_config=inference_config)
+    worker = f"{os.getpid()}"
+    logger.info("Job worker %s is ready", worker)
+
+    last_maintenance = 0.0
+    while not stop_event.is_set():
+        if time.monotonic() - last_maintenance > maintenance_interval:
+            queue.maintain()
+            last_maintenance = time.monotonic()
+        job = queue.claim(worker)
+        if job is None:
+            # Not `stop_event.wait`: `set` waits for every waiter to wake up, and a killed worker never does
+            time.sleep(poll_interval)
+            continue
+        try:
+            audio = decode_audio(job.audio, job.encoding)
+        except ValueError as e:  # The payload is malformed (e.g. odd length of PCM), retries would fail the same way
+            logger.warning("Job %s has invalid audio: %s", job.job_id, e)
+            queue.fail(job.job_id, f"{type(e).__name__}: {e}", retry=False)
+            continue
+        try:
+            start_time = time.perf_counter()
+            with _renewed_lease(queue, job.job_id, worker):
+                phrases = pipeline.forward_offline(audio)
+            result = [
+                {"text": phrase.text, "start_time": phrase.start_time, "end_time": phrase.end_time}
+                for phrase in phrases
+            ]
+        except Exception as e:
+            logger.exception("Job %s failed (attempt %d)", job.job_id, job.attempts)
+            queue.fail(job.job_id, f"{type(e).__name__}: {e}")
+        else:
+            queue.complete(job.job_id, result)
+            logger.info("Job %s is done in %.2f sec", job.job_id, time.perf_counter() - start_time)
+
+
+class JobWorkerPool:
+    """Pool of worker processes, each holding its own `StreamingCTCPipeline` and running jobs from the queue.
+
+    Processes are started with "spawn" method, so they do not inherit threads or ONNX Runtime
+    sessions of the parent. Dead workers are restarted by `supervise`, which a background thread
+    of the pool calls every `supervise_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        model_dir: Path | str,
+        *,
+        num_workers: int = 2,
+        decoder_type: DecoderType = DecoderType.BEAM_SEARCH,
+        inference_config: InferenceConfig | None = None,
+        poll_interval: float = 0.1,
+        maintenance_interval: float = 30.0,
+        supervise_interval: float = 5.0,
+    ) -> None:
+        if num_workers <= 0:
+            raise ValueError(f"'num_workers' must be positive, but got {num_workers}")
+        self.queue = queue
+        self.model_dir = Path(model_dir)
+        self.num_workers = num_workers
+        self.decoder_type = decoder_type
+        self.inference_config = inference_config
+        self.poll_interval = poll_interval
+        self.maintenance_interval = maintenance_interval
+        self.supervise_interval = supervise_interval
+        self._context = mp.get_context("spawn")
+        self._stop_event = self._context.Event()
+        self._processes: list[BaseProcess] = []
+        self._lock = threading.Lock()  # Guards `_processes` between the supervisor thread and callers
+        self._supervisor: threading.Thread | None = None
+
+    def _spawn(self) -> BaseProcess:
+        process = self._context.Process(
+            target=_worker_loop,
+            kwargs={
+                "queue": self.queue,
+                "model_dir": self.model_dir,
+                "decoder_type": self.decoder_type,
+                "inference_config": self.inference_config,
+                "stop_event": self._stop_event,
+                "poll_interval": self.poll_interval,
+                "maintenance_interval": self.maintenance_interval,
+            },
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    def start(self) -> None:
+        """Start worker processes and the thread restarting them."""
+        if self._supervisor is not None:
+            raise RuntimeError("Job workers are already started")
+        self._stop_event.clear()
+        with self._lock:
+            self._processes = [self._spawn() for _ in range(self.num_workers)]
+        self._supervisor = threading.Thread(target=self._supervise_loop, name="job-worker-supervisor", daemon=True)
+        self._supervisor.start()
+
+    def _supervise_loop(self) -> None:
+        while not self._stop_event.wait(self.supervise_interval):
+            self.supervise()
+
+    def supervise(self) -> int:
+        """Restart dead worker processes.
+
+        Returns:
+            int: Number of restarted workers.
+
+        """
+        restarted = 0
+        with self._lock:
+            for i, process in enumerate(self._processes):
+                if not process.is_alive() and not self._stop_event.is_set():
+                    logger.warning("Job worker %s exited with code %s, restarting", process.pid, process.exitcode)
+                    self._processes[i] = self._spawn()
+                    restarted += 1
+        return restarted
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Stop worker processes after they finish current jobs."""
+        self._stop_event.set()
+        if self._supervisor is not None:
+            self._supervisor.join()
+            self._supervisor = None
+        with self._lock:
+            for process in self._processes:
+                process.join(timeout)
+                if process.is_alive():
+                    process.terminate()
+            self._processes = []
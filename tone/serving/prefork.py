@@ -0,0 +1,616 @@
+"""Module with a pre-fork launcher running several server workers that share one loaded model."""
+
+from __future__ import annotations
+
+import contextlib
+import dataclasses
+import gc
+import importlib
+import itertools
+import logging
+import os
+import select
+import signal
+import socket
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from typing_extensions import Self
+
+from tone.decoder import BeamSearchCTCDecoder, DecoderType, GreedyCTCDecoder
+from tone.inference_config import ExecutionProvider, InferenceConfig
+from tone.logprob_splitter import StreamingLogprobSplitter
+from tone.model_manifest import ModelManifest
+from tone.onnx_wrapper import SharedWeights, StreamingCTCModel, file_sha256
+from tone.pipeline import StreamingCTCPipeline
+from tone.serving.shm_transport import Channel, InferenceClient, InferenceWorker, check_platform
+from tone.serving.topology import CpuTopology, WorkerPlacement, allocate_on_node, pin_process
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable
+
+logger = logging.getLogger(__name__)
+
+
+def available_cpus() -> int:
+    """Return number of CPU cores the process is allowed to run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+@dataclass
+class _WorkerProcess:
+    slot: int
+    ready_fd: int  # Read end of the readiness pipe
+
+
+@dataclass
+class SharedModel:
+    """ONNX model loaded once and shared by forked workers copy-on-write.
+
+    With `InferenceConfig.share_weights`, weights of the model are kept as numpy arrays, which sessions
+    of the workers use without copying (see `SharedWeights`), otherwise every worker loads its own copy.
+    Workers pinned to different NUMA nodes use copies of the weights allocated on their nodes (see
+    `place_on_nodes`). The execution provider is selected once in the parent, so workers (and their
+    replacements on reload) do not benchmark the candidates again.
+
+    Attributes:
+        path: path to the ONNX model
+        fingerprint: fingerprint of the ONNX model
+        weights: weights of the ONNX model, or None if every worker loads its own copy
+        manifest: constants of the ONNX model (e.g. the chunk size known before the workers are forked)
+        execution_provider: execution provider of the sessions, or None to use the one of the config
+        provider_benchmark: results of `StreamingCTCModel.select_execution_provider` run in the parent
+        node_weights: copies of the weights allocated on NUMA nodes, by node
+
+    """
+
+    path: Path
+    fingerprint: str
+    weights: SharedWeights | None
+    manifest: ModelManifest = field(default_factory=ModelManifest)
+    execution_provider: ExecutionProvider | None = None
+    provider_benchmark: list[dict[str, Any]] = field(default_factory=list)
+    node_weights: dict[int, SharedWeights] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, model_path: Path, inference_config: InferenceConfig | None = None) -> Self:
+        """Load weights of the model (the quantized one if `inference_config` prefers it).
+
+        If the config has several candidate execution providers, they are benchmarked here (see
+        `StreamingCTCModel.select_execution_provider`) and the sessions are released before returning.
+        """
+        inference_config = inference_config if inference_config is not None else InferenceConfig()
+        model_path = StreamingCTCModel.resolve_model_path(model_path, inference_config)
+        weights = None
+        if inference_config.share_weights:
+            try:
+                weights = SharedWeights.load(model_path)
+            except ModuleNotFoundError:
+                logger.warning("Package 'onnx' not found, model weights are not shared between workers")
+        manifest = ModelManifest.load(model_path)
+        execution_provider = None
+        provider_benchmark: list[dict[str, Any]] = []
+        if len(inference_config.execution_providers) > 1:
+            execution_provider, provider_benchmark = StreamingCTCModel.select_execution_provider(
+                model_path,
+                inference_config,
+                manifest,
+                weights,
+            )
+        return cls(
+            path=model_path,
+            fingerprint=file_sha256(model_path)[:32],
+            weights=weights,
+            manifest=manifest or ModelManifest(),
+            execution_provider=execution_provider,
+            provider_benchmark=provider_benchmark,
+        )
+
+    def place_on_nodes(self, nodes: Iterable[int]) -> None:
+        """Allocate a copy of the weights on every NUMA node, the weights loaded before are released.
+
+        Pages of the weights stay on the node where they were allocated, so without a copy per node
+        workers of the other nodes read every weight across the interconnect.
+        """
+        if self.weights is None:
+            return
+        for node in sorted(set(nodes)):
+            with allocate_on_node(node) as placed:
+                self.node_weights[node] = self.weights.copy()
+            if placed:
+                logger.info("Weights of %s are allocated on NUMA node %d", self.path.name, node)
+            else:
+                logger.warning("Weights of %s for NUMA node %d are allocated without policy", self.path.name, node)
+        if self.node_weights:
+            self.weights = self.node_weights[min(self.node_weights)]
+
+    def build(self, inference_config: InferenceConfig | None = None, node: int | None = None) -> StreamingCTCModel:
+        """Create the model (a new ONNX Runtime session over the shared weights, the copy of the node if any)."""
+        model = StreamingCTCModel.from_local(
+            self.path,
+            config=inference_config,
+            shared_weights=self.node_weights.get(node, self.weights) if node is not None else self.weights,
+            fingerprint=self.fingerprint,
+            execution_provider=self.execution_provider,
+        )
+        if self.execution_provider is not None:
+            model.provider_benchmark = self.provider_benchmark
+        return model
+
+
+@dataclass
+class SharedArtifacts:
+    """Artifacts of `StreamingCTCPipeline` loaded once and shared by forked workers copy-on-write.
+
+    Weights of the acoustic models can be shared, see `SharedModel`. The decoder (with KenLM language
+    model) is a plain Python object and is inherited by the workers as is.
+
+    Attributes:
+        model: streaming acoustic model
+        logprob_splitter: logprob splitter of the pipeline
+        decoder: decoder of the pipeline
+        offline_model: model with a longer chunk used by `forward_offline`, or None
+
+    """
+
+    model: SharedModel
+    logprob_splitter: StreamingLogprobSplitter
+    decoder: GreedyCTCDecoder | BeamSearchCTCDecoder
+    offline_model: SharedModel | None = None
+
+    @classmethod
+    def from_local(
+        cls,
+        dir_path: str | Path,
+        *,
+        decoder_type: DecoderType = DecoderType.BEAM_SEARCH,
+        inference_config: InferenceConfig | None = None,
+    ) -> Self:
+        """Load artifacts from local folder (the same layout as for `StreamingCTCPipeline.from_local`).
+
+        The quantized model is used if `inference_config` prefers it, see `StreamingCTCModel.resolve_model_path`.
+        """
+        dir_path = Path(dir_path)
+        model = SharedModel.load(dir_path / "model.onnx", inference_config)
+        offline_model = None
+        if (dir_path / StreamingCTCPipeline.OFFLINE_MODEL_NAME).exists():
+            offline_model = SharedModel.load(dir_path / StreamingCTCPipeline.OFFLINE_MODEL_NAME, inference_config)
+        if decoder_type == DecoderType.GREEDY:
+            decoder: GreedyCTCDecoder | BeamSearchCTCDecoder = GreedyCTCDecoder()
+        elif decoder_type == DecoderType.BEAM_SEARCH:
+            decoder = BeamSearchCTCDecoder.from_local(dir_path / "kenlm.bin")
+        else:
+            raise ValueError("Unknown decoder type")
+        _ = decoder.fingerprint  # Compute once in the parent instead of every worker
+        return cls(
+            model=model,
+            logprob_splitter=StreamingLogprobSplitter(),
+            decoder=decoder,
+            offline_model=offline_model,
+        )
+
+    def place_on_nodes(self, nodes: Iterable[int]) -> None:
+        """Allocate a copy of the weights of the acoustic models on every NUMA node, see `SharedModel`."""
+        self.model.place_on_nodes(nodes)
+        if self.offline_model is not None:
+            self.offline_model.place_on_nodes(nodes)
+
+    def build_pipeline(
+        self,
+        inference_config: InferenceConfig | None = None,
+        node: int | None = None,
+    ) -> StreamingCTCPipeline:
+        """Create pipeline using the shared artifacts (new ONNX Runtime sessions over the shared weights).
+
+        Args:
+            inference_config (InferenceConfig | None): ONNX Runtime settings of the sessions.
+            node (int | None): NUMA node of the worker, its copy of the weights is used (see `place_on_nodes`).
+
+        Returns:
+            StreamingCTCPipeline: Pipeline over the shared artifacts.
+
+        """
+        offline_model = self.offline_model.build(inference_config, node) if self.offline_model is not None else None
+        return StreamingCTCPipeline(
+            self.model.build(inference_config, node),
+            self.logprob_splitter,
+            self.decoder,
+            offline_model=offline_model,
+        )
+
+
+class PreforkServer:
+    """Runs several uvicorn workers forked from a parent process which holds the loaded model.
+
+    The parent loads `SharedArtifacts` once, binds the listening socket and forks the workers.
+    Every worker creates its ONNX Runtime session over the shared weights, passes the pipeline
+    to the application with `set_pipeline` function of the application module and serves
+    requests from the shared socket. Thus memory for the weights and the language model is
+    paid once and the startup of a worker takes only session creation.
+
+    ONNX Runtime intra-op threads are split between the workers, so workers * threads matches
+    the number of available cores (unless `intra_op_num_threads` is set explicitly). With `pin_workers`
+    every worker is pinned to its own block of cores of one NUMA node (see `CpuTopology.plan`)
+    before its session is created, so its threads and memory do not migrate between nodes, and if the
+    workers span several nodes, the parent allocates a copy of the shared weights on every node.
+
+    Signals of the parent process:
+        - SIGHUP: rolling reload, workers are replaced one by one by fresh forks of the parent;
+          an old worker is stopped only after its replacement is ready to serve;
+        - SIGTERM, SIGINT: graceful shutdown.
+    Workers that exit unexpectedly are restarted.
+    """
+
+    def __init__(
+        self,
+        app: str,
+        artifacts: SharedArtifacts,
+        *,
+        host: str = "0.0.0.0",  # noqa: S104
+        port: int = 8000,
+        workers: int | None = None,
+        inference_config: InferenceConfig | None = None,
+        set_pipeline: str = "set_pipeline",
+        log_level: str = "info",
+        ready_timeout: float = 120.0,
+        graceful_timeout: float = 30.0,
+        pin_workers: bool = False,
+    ) -> None:
+        """Create launcher.
+
+        Args:
+            app (str): Application in "module:attribute" format, e.g. "simple_api:app".
+            artifacts (SharedArtifacts): Loaded pipeline artifacts.
+            host (str): Host to listen on.
+            port (int): Port to listen on.
+            workers (int | None): Number of workers, or None to use one worker per 2 available cores.
+            inference_config (InferenceConfig | None): ONNX Runtime settings of the workers.
+            set_pipeline (str): Name of the function in the application module that receives the pipeline.
+            log_level (str): Log level of uvicorn.
+            ready_timeout (float): Maximum time to wait for a new worker to become ready during reload.
+            graceful_timeout (float): Maximum time to wait for workers to finish on shutdown.
+            pin_workers (bool): Pin every worker to disjoint cores of one NUMA node (Linux only).
+
+        """
+        module_name, _, attribute = app.partition(":")
+        # Imported in the parent, so the code of the application is shared by the workers too
+        self.module = importlib.import_module(module_name)
+        self.app = getattr(self.module, attribute or "app")
+        self.set_pipeline = set_pipeline
+        self._app_function(set_pipeline)  # Fail early if the application does not support the launcher
+        self.artifacts = artifacts
+        self.host, self.port = host, port
+        self.workers = workers if workers is not None else max(1, available_cpus() // 2)
+        if self.workers <= 0:
+            raise ValueError(f"'workers' must be positive, but got {self.workers}")
+
+        inference_config = inference_config if inference_config is not None else InferenceConfig()
+        if inference_config.intra_op_num_threads == 0:
+            threads = max(1, available_cpus() // self.workers)
+            inference_config = dataclasses.replace(inference_config, intra_op_num_threads=threads)
+        self.inference_config = inference_config
+        self.log_level = log_level
+        self.ready_timeout = ready_timeout
+        self.graceful_timeout = graceful_timeout
+        self.pin_workers = pin_workers
+
+        self._placements: dict[int, WorkerPlacement] = {}  # Slot -> cores of the worker
+        self._socket: socket.socket | None = None
+        self._workers: dict[int, _WorkerProcess] = {}
+        self._retiring: set[int] = set()  # Workers stopped intentionally, they must not be restarted
+        self._should_exit = False
+        self._should_reload = False
+
+    def run(self) -> None:
+        """Bind the socket, start workers and supervise them until SIGTERM or SIGINT."""
+        self._socket = socket.create_server((self.host, self.port), reuse_port=False, backlog=2048)
+        self._socket.set_inheritable(True)
+        logger.info(
+            "Starting %d workers with %d intra-op threads each on %s:%d",
+            self.workers,
+            self.inference_config.intra_op_num_threads,
+            self.host,
+            self.port,
+        )
+        if self.pin_workers:
+            self._placements = self._plan_placements()
+            nodes = {placement.node for placement in self._placements.values()}
+            if len(nodes) > 1:
+                self.artifacts.place_on_nodes(nodes)
+        # Objects allocated so far are never freed, do not let GC touch (and thus copy) their memory pages
+        gc.collect()
+        gc.freeze()
+
+        signal.signal(signal.SIGHUP, self._handle_reload)
+        signal.signal(signal.SIGTERM, self._handle_exit)
+        signal.signal(signal.SIGINT, self._handle_exit)
+        for slot in range(self.num_slots):
+            self._spawn(slot)
+        try:
+            while not self._should_exit:
+                if self._should_reload:
+                    self._should_reload = False
+                    self._rolling_reload()
+                self._reap()
+                time.sleep(0.2)
+        finally:
+            self._shutdown()
+            self._socket.close()
+
+    @property
+    def num_slots(self) -> int:
+        """Number of worker processes, every worker is identified by its slot in range [0; num_slots)."""
+        return self.workers
+
+    @property
+    def pinned_slots(self) -> range:
+        """Slots of the workers pinned to cores with `pin_workers`."""
+        return range(self.num_slots)
+
+    def _plan_placements(self) -> dict[int, WorkerPlacement]:
+        try:
+            topology = CpuTopology.detect()
+        except (RuntimeError, OSError) as error:
+            logger.warning("Workers are not pinned: %s", error)
+            return {}
+        placements = dict(zip(self.pinned_slots, topology.plan(len(self.pinned_slots))))
+        for slot, placement in placements.items():
+            logger.info("Worker slot %d: cores %s of NUMA node %d", slot, placement.cpus, placement.node)
+        return placements
+
+    def _handle_reload(self, *_: object) -> None:
+        self._should_reload = True
+
+    def _handle_exit(self, *_: object) -> None:
+        self._should_exit = True
+
+    def _spawn(self, slot: int) -> int:
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:  # Worker process
+            os.close(read_fd)
+            exit_code = 1
+            try:
+                if slot in self._placements:
+                    pin_process(self._placements[slot])
+                self._run_worker(slot, write_fd)
+                exit_code = 0
+            except BaseException:
+                logger.exception("Worker %d failed", os.getpid())
+            finally:
+                os._exit(exit_code)
+        os.close(write_fd)
+        self._workers[pid] = _WorkerProcess(slot=slot, ready_fd=read_fd)
+        logger.info("Started worker %d", pid)
+        return pid
+
+    def _run_worker(self, slot: int, ready_fd: int) -> None:
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, signal.SIG_DFL)  # uvicorn installs its own handlers of SIGTERM and SIGINT
+        pipeline = self.artifacts.build_pipeline(self.inference_config, self._node(slot))
+        self._app_function(self.set_pipeline)(pipeline)
+        self._serve(ready_fd)
+
+    def _node(self, slot: int) -> int | None:
+        """NUMA node the worker of the slot is pinned to, or None."""
+        placement = self._placements.get(slot)
+        return placement.node if placement is not None else None
+
+    def _app_function(self, name: str) -> Callable[..., Any]:
+        function = getattr(self.module, name, None)
+        if not callable(function):
+            raise TypeError(f"Application module {self.module.__name__!r} must provide {name!r} function")
+        return function
+
+    def _serve(self, ready_fd: int) -> None:
+        """Run uvicorn server on the shared socket in the worker process."""
+        import uvicorn
+
+        class _WorkerServer(uvicorn.Server):
+            async def startup(self, sockets: list[socket.socket] | None = None) -> None:
+                await super().startup(sockets=sockets)
+                os.write(ready_fd, b"1")  # Notify the parent that the worker is ready to serve
+                os.close(ready_fd)
+
+        config = uvicorn.Config(self.app, log_level=self.log_level, lifespan="on")
+        assert self._socket is not None
+        _WorkerServer(config).run(sockets=[self._socket])
+
+    def _wait_ready(self, pid: int) -> bool:
+        worker = self._workers.get(pid)
+        if worker is None:
+            return False
+        readable, _, _ = select.select([worker.ready_fd], [], [], self.ready_timeout)
+        return bool(readable) and os.read(worker.ready_fd, 1) == b"1"
+
+    def _stop_worker(self, pid: int) -> None:
+        self._retiring.add(pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        deadline = time.monotonic() + self.graceful_timeout
+        while time.monotonic() < deadline:
+            done, _ = os.waitpid(pid, os.WNOHANG)
+            if done:
+                break
+            time.sleep(0.05)
+        else:
+            logger.warning("Worker %d did not stop in %.0f sec, killing it", pid, self.graceful_timeout)
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self._forget(pid)
+
+    def _forget(self, pid: int) -> None:
+        worker = self._workers.pop(pid, None)
+        if worker is not None:
+            os.close(worker.ready_fd)
+        self._retiring.discard(pid)
+
+    def _rolling_reload(self) -> None:
+        logger.info("Reloading workers")
+        for old_pid, old_worker in list(self._workers.items()):
+            new_pid = self._spawn(old_worker.slot)
+            if not self._wait_ready(new_pid):
+                logger.error("New worker %d is not ready, reload is aborted", new_pid)
+                return
+            self._stop_worker(old_pid)
+        logger.info("Workers reloaded")
+
+    def _reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            worker = self._workers.get(pid)
+            if worker is None:
+                continue
+            expected = pid in self._retiring
+            self._forget(pid)
+            if not expected and not self._should_exit:
+                logger.warning("Worker %d exited with code %d, restarting", pid, os.waitstatus_to_exitcode(status))
+                self._spawn(worker.slot)
+
+    def _shutdown(self) -> None:
+        logger.info("Stopping workers")
+        for pid in list(self._workers):
+            self._retiring.add(pid)
+            with contextlib.suppress(ProcessLookupError):
+                os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout
+        while self._workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.05)
+        for pid in list(self._workers):
+            logger.warning("Worker %d did not stop in %.0f sec, killing it", pid, self.graceful_timeout)
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self._forget(pid)
+
+
+class SplitServer(PreforkServer):
+    """Pre-fork launcher with separate front-end and inference worker processes.
+
+    Front-end workers run the web application: they terminate websockets and split the audio into
+    chunks, but do not run the model, so socket handling does not compete with inference for the GIL.
+    Inference workers own pipelines over the shared artifacts and process micro-batches of chunks of
+    all front-ends. Every front-end is connected with every inference worker by a `Channel` of shared
+    memory rings created before forking, so the numbers of front-ends (I/O) and inference workers
+    (compute) are chosen independently. A front-end receives its `InferenceClient` through
+    `set_inference_client` function of the application module.
+
+    ONNX Runtime intra-op threads are split between the inference workers (unless `intra_op_num_threads`
+    is set explicitly), and with `pin_workers` only the inference workers are pinned to cores. As every
+    ring has a single producer and a single consumer, SIGHUP restarts workers one by one without overlap;
+    sessions of a restarted inference worker fail.
+    """
+
+    def __init__(
+        self,
+        app: str,
+        artifacts: SharedArtifacts,
+        *,
+        workers: int | None = None,
+        inference_workers: int = 1,
+        max_batch_size: int = 16,
+        inference_config: InferenceConfig | None = None,
+        set_inference_client: str = "set_inference_client",
+        **kwargs: Any,
+    ) -> None:
+        """Create launcher.
+
+        Args:
+            app (str): Application in "module:attribute" format, e.g. "tone.demo.website:app".
+            artifacts (SharedArtifacts): Loaded pipeline artifacts.
+            workers (int | None): Number of front-end workers, or None to use one.
+            inference_workers (int): Number of inference workers.
+            max_batch_size (int): Maximum number of chunks processed by an inference worker at once.
+            inference_config (InferenceConfig | None): ONNX Runtime settings of the inference workers.
+            set_inference_client (str): Name of the function in the application module that receives the client.
+            **kwargs: Other arguments of `PreforkServer`.
+
+        """
+        if inference_workers <= 0:
+            raise ValueError(f"'inference_workers' must be positive, but got {inference_workers}")
+        check_platform()  # Before any worker is forked
+        inference_config = inference_config if inference_config is not None else InferenceConfig()
+        if inference_config.intra_op_num_threads == 0:
+            threads = max(1, available_cpus() // inference_workers)
+            inference_config = dataclasses.replace(inference_config, intra_op_num_threads=threads)
+        super().__init__(
+            app,
+            artifacts,
+            workers=workers if workers is not None else 1,
+            inference_config=inference_config,
+            set_pipeline=set_inference_client,
+            **kwargs,
+        )
+        self.inference_workers = inference_workers
+        self.max_batch_size = max_batch_size
+        self._channels: list[list[Channel]] = []  # Front-end -> inference worker -> channel
+
+    @property
+    def num_slots(self) -> int:
+        """Front-end workers take the first slots, inference workers take the rest."""
+        return self.workers + self.inference_workers
+
+    @property
+    def pinned_slots(self) -> range:
+        """Inference workers are pinned, front-ends only handle sockets and are not."""
+        return range(self.workers, self.num_slots)
+
+    def run(self) -> None:
+        """Create the channels, start workers and supervise them until SIGTERM or SIGINT."""
+        chunk_size = self.artifacts.model.manifest.audio_chunk_samples  # Records of the rings fit chunks of the model
+        self._channels = [
+            [Channel.create(chunk_size=chunk_size) for _ in range(self.inference_workers)] for _ in range(self.workers)
+        ]
+        try:
+            super().run()
+        finally:
+            for channel in itertools.chain.from_iterable(self._channels):
+                channel.close()
+
+    def _run_worker(self, slot: int, ready_fd: int) -> None:
+        if slot < self.workers:  # Front-end
+            for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, signal.SIG_DFL)
+            self._app_function(self.set_pipeline)(InferenceClient(self._channels[slot]))
+            self._serve(ready_fd)
+            return
+
+        stop = False
+
+        def handle_exit(*_: object) -> None:
+            nonlocal stop
+            stop = True
+
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, handle_exit)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # Stopped by the parent with SIGTERM
+        worker = InferenceWorker(
+            self.artifacts.build_pipeline(self.inference_config, self._node(slot)),
+            [channels[slot - self.workers] for channels in self._channels],
+            max_batch_size=self.max_batch_size,
+        )
+        os.write(ready_fd, b"1")
+        os.close(ready_fd)
+        logger.info("Inference worker %d is ready", os.getpid())
+        worker.run(lambda: stop)
+
+    def _rolling_reload(self) -> None:
+        logger.info("Reloading workers")
+        for old_pid, old_worker in list(self._workers.items()):
+            self._stop_worker(old_pid)
+            new_pid = self._spawn(old_worker.slot)
+            if not self._wait_ready(new_pid):
+                logger.error("New worker %d is not ready, reload is aborted", new_pid)
+                return
+        logger.info("Workers reloaded")
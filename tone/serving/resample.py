@@ -0,0 +1,114 @@
+"""Module with a streaming polyphase resampler for live audio input."""
+
+from __future__ import annotations
+
+from math import gcd
+
+import numpy as np
+import numpy.typing as npt
+from numpy.lib.stride_tricks import sliding_window_view
+
+from tone.onnx_wrapper import StreamingCTCModel
+
+MIN_SAMPLE_RATE = 8000
+MAX_SAMPLE_RATE = 192000
+
+
+class StreamingResampler:
+    """Stateful polyphase FIR resampler converting audio to the sample rate of the pipeline.
+
+    The signal is (virtually) upsampled by `up`, filtered with a Kaiser-windowed sinc low-pass
+    filter and downsampled by `down`, where `up / down` is the reduced ratio of output and input
+    sample rates. Only the filter phases needed for the output samples are evaluated, all output
+    samples of a chunk are computed at once with vectorized numpy operations.
+
+    The last input samples and the position of the next output sample are kept between calls,
+    so the output does not depend on how the input is split into chunks. Filter delay is
+    compensated: output sample `n` corresponds to input time `n / output_rate`.
+    """
+
+    def __init__(
+        self,
+        input_rate: int,
+        output_rate: int = StreamingCTCModel.SAMPLE_RATE,
+        *,
+        taps_per_phase: int = 32,
+        cutoff: float = 0.9,
+        kaiser_beta: float = 8.0,
+    ) -> None:
+        for name, rate in (("input_rate", input_rate), ("output_rate", output_rate)):
+            if not MIN_SAMPLE_RATE <= rate <= MAX_SAMPLE_RATE:
+                raise ValueError(f"'{name}' must be in range [{MIN_SAMPLE_RATE}; {MAX_SAMPLE_RATE}], but got {rate}")
+        if not 0 < cutoff <= 1:
+            raise ValueError(f"'cutoff' must be in range (0; 1], but got {cutoff}")
+
+        self.input_rate, self.output_rate = input_rate, output_rate
+        divisor = gcd(input_rate, output_rate)
+        self.up, self.down = output_rate // divisor, input_rate // divisor
+        self.taps = taps_per_phase
+
+        # Low-pass filter at the upsampled rate, cutoff is relative to the Nyquist frequency of the lower rate
+        # The filter is symmetric around a tap, so its delay is an integer number of upsampled samples
+        filter_len = taps_per_phase * self.up
+        self._delay = (filter_len - 1) // 2
+        normalized_cutoff = 0.5 * cutoff / max(self.up, self.down)  # in cycles per upsampled sample
+        time = np.arange(2 * self._delay + 1) - self._delay
+        kernel = 2 * normalized_cutoff * np.sinc(2 * normalized_cutoff * time) * np.kaiser(len(time), kaiser_beta)
+        kernel = np.pad(kernel * self.up / kernel.sum(), (0, filter_len - len(time)))  # Compensate upsampling gain
+        # phases[p, k] is applied to the input sample (i - k) for the output at upsampled position i * up + p.
+        # Taps are reversed, so the filter can be applied to the sliding windows of input directly.
+        self._phases = kernel.reshape(taps_per_phase, self.up).T[:, ::-1].astype(np.float32)
+        self.reset()
+
+    def reset(self) -> None:
+        """Reset the internal state to start a new stream."""
+        self._history = np.zeros((self.taps - 1,), dtype=np.float32)
+        # Upsampled position of the next output sample relative to the beginning of the history
+        self._next_pos = (self.taps - 1) * self.up + self._delay
+        self._num_inputs = self._num_outputs = 0
+
+    @property
+    def is_passthrough(self) -> bool:
+        """Whether input and output sample rates are equal."""
+        return self.up == self.down == 1
+
+    def process(self, samples: npt.ArrayLike) -> npt.NDArray[np.int32]:
+        """Resample the next chunk of the stream.
+
+        Args:
+            samples (npt.ArrayLike): Next input samples in range [-32768; 32767].
+
+        Returns:
+            npt.NDArray[np.int32]: Output samples available after this chunk.
+
+        """
+        samples = np.asarray(samples).reshape(-1)
+        if self.is_passthrough:
+            return samples.astype(np.int32)
+        self._num_inputs += len(samples)
+
+        signal = np.concatenate((self._history, samples.astype(np.float32)))
+        # Output samples whose input position is inside the buffer can be computed
+        num_outputs = max(0, -(-(len(signal) * self.up - self._next_pos) // self.down))
+        positions = self._next_pos + self.down * np.arange(num_outputs)
+        input_ids, phase_ids = np.divmod(positions, self.up)
+
+        windows = sliding_window_view(signal, self.taps)[input_ids - (self.taps - 1)]
+        output = np.einsum("nk,nk->n", windows, self._phases[phase_ids])
+
+        consumed = len(signal) - (self.taps - 1)
+        self._history = signal[consumed:]
+        self._next_pos += self.down * num_outputs - consumed * self.up
+        self._num_outputs += num_outputs
+        return np.clip(np.rint(output), -32768, 32767).astype(np.int32)
+
+    def flush(self) -> npt.NDArray[np.int32]:
+        """Return the remaining output samples at the end of the stream and reset the state."""
+        if self.is_passthrough:
+            return np.zeros((0,), dtype=np.int32)
+        # Outputs up to the end of the input are delayed by at most `taps` input samples
+        expected = -(-self._num_inputs * self.up // self.down)
+        remaining = expected - self._num_outputs
+        output = self.process(np.zeros((self.taps,), dtype=np.float32))[:remaining]
+        self.reset()
+        return output
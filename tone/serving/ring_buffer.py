@@ -0,0 +1,79 @@
+"""Module with a fixed-size ring buffer for streaming audio ingestion."""
+
+from __future__ import annotations
+
+import numpy as np
+import numpy.typing as npt
+
+
+class AudioRingBuffer:
+    """Fixed-size ring buffer of audio samples that returns chunks as zero-copy views.
+
+    The buffer is "mirrored": every sample is stored twice, at position `i` and `i + capacity`
+    of the underlying array. Thus any `capacity` consecutive samples are contiguous in memory
+    and can be returned as a view without copying, even if they wrap around the end of the ring.
+    Incoming samples are converted to the dtype of the buffer during the write, so no extra
+    conversion is required before passing chunks to the pipeline.
+
+    Views returned by `read` are valid until the next write. Not thread-safe.
+    """
+
+    def __init__(self, capacity: int, dtype: npt.DTypeLike = np.int32) -> None:
+        if capacity <= 0:
+            raise ValueError(f"'capacity' must be positive, but got {capacity}")
+        self.capacity = capacity
+        self._buffer = np.zeros((2 * capacity,), dtype=dtype)
+        self._read_pos = 0  # Both positions are always in range [0; capacity)
+        self._size = 0
+
+    def __len__(self) -> int:
+        """Number of samples available for reading."""
+        return self._size
+
+    @property
+    def free(self) -> int:
+        """Number of samples that can be written without overflowing the buffer."""
+        return self.capacity - self._size
+
+    def write(self, samples: npt.ArrayLike) -> None:
+        """Append samples to the buffer.
+
+        Raises:
+            OverflowError: If there is not enough free space in the buffer.
+
+        """
+        samples = np.asarray(samples).reshape(-1)
+        size = len(samples)
+        if size > self.free:
+            raise OverflowError(f"Ring buffer overflow: {size} samples written, but only {self.free} are free")
+
+        write_pos = (self._read_pos + self._size) % self.capacity
+        head = min(size, self.capacity - write_pos)
+        for start in (write_pos, write_pos + self.capacity):  # Write both copies of the samples
+            self._buffer[start : start + head] = samples[:head]
+        if size > head:
+            for start in (0, self.capacity):
+                self._buffer[start : start + size - head] = samples[head:]
+        self._size += size
+
+    def write_bytes(self, data: bytes, dtype: npt.DTypeLike = np.int16) -> None:
+        """Append raw samples of the given dtype (int16 PCM by default) to the buffer."""
+        self.write(np.frombuffer(data, dtype=dtype))
+
+    def write_zeros(self, size: int) -> None:
+        """Append `size` zero samples to the buffer."""
+        self.write(np.zeros((size,), dtype=self._buffer.dtype))
+
+    def read(self, size: int) -> npt.NDArray:
+        """Remove `size` samples from the buffer and return them as a contiguous view.
+
+        Raises:
+            ValueError: If there are less than `size` samples in the buffer.
+
+        """
+        if not 0 <= size <= self._size:
+            raise ValueError(f"Can not read {size} samples, only {self._size} are available")
+        chunk = self._buffer[self._read_pos : self._read_pos + size]
+        self._read_pos = (self._read_pos + size) % self.capacity
+        self._size -= size
+        return chunk
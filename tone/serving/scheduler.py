@@ -0,0 +1,311 @@
+"""Module with a deadline-aware scheduler sharing one acoustic model between live and bulk traffic.
+
+Live streams (websocket calls) and bulk jobs (`forward_offline` of uploaded files) submit their
+chunks to one `DeadlineScheduler`, which runs the acoustic model in a single thread on batches of
+chunks. Every live chunk gets a deadline (arrival time + budget), live chunks are taken into a batch
+earliest-deadline-first, and bulk chunks only fill the slots left free by live ones. A bulk job is
+a sequence of dependent chunks, so it is preempted between batches: as soon as live chunks arrive,
+its next chunk waits. This way idle capacity is used by bulk work without adding latency to live
+streams beyond one batch.
+
+    scheduler = DeadlineScheduler(pipeline.model)
+    scheduler.start()
+    live_pipeline = scheduler.wrap(pipeline, Priority.LIVE)
+    bulk_pipeline = scheduler.wrap(pipeline, Priority.BULK)
+    bulk_pipeline.forward_offline(audio)  # From another thread
+"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from tone.pipeline import StreamingCTCPipeline
+
+if TYPE_CHECKING:
+    from tone.acoustic_backend import AcousticBackend
+    from tone.onnx_wrapper import StreamingCTCModel
+    from tone.serving.admission import LoadMonitor
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(str, Enum):
+    """Class of traffic of a chunk."""
+
+    LIVE = "live"
+    BULK = "bulk"
+
+
+@dataclass(order=True)
+class _Request:
+    deadline: float
+    order: int  # Submission order breaks ties of deadlines
+    audio_chunk: StreamingCTCModel.InputType = field(compare=False)  # Shape (2400, 1)
+    state: StreamingCTCModel.StateType | None = field(compare=False)  # Shape (STATE_SIZE,)
+    future: Future[tuple[StreamingCTCModel.OutputType, StreamingCTCModel.StateType]] = field(compare=False)
+
+
+class DeadlineScheduler:
+    """Runs the acoustic model on batches of chunks of live and bulk traffic in a background thread.
+
+    Batch formation: live chunks in the order of their deadlines, then bulk chunks (in the order of
+    their deadlines too) up to `max_batch_size`. Bulk deadlines are only used for ordering, bulk work
+    waits while live chunks fill whole batches. A live chunk processed after its deadline is counted
+    in `stats()["missed_deadlines"]`.
+
+    Bulk chunks of the offline model (a model with a longer chunk, see `StreamingCTCPipeline.offline_model`)
+    can not share a batch with chunks of the main model, they are processed in batches of their own
+    when no chunk of the main model is queued.
+    """
+
+    def __init__(
+        self,
+        model: AcousticBackend,
+        *,
+        max_batch_size: int = 16,
+        live_budget: float = 0.1,
+        bulk_budget: float = 30.0,
+        monitor: LoadMonitor | None = None,
+        offline_model: AcousticBackend | None = None,
+    ) -> None:
+        """Create scheduler.
+
+        Args:
+            model (AcousticBackend): Acoustic model shared by all traffic, it must take the state as input.
+            max_batch_size (int): Maximum number of chunks processed at once.
+            live_budget (float): Time a live chunk may wait and be processed (in sec).
+            bulk_budget (float): Deadline of bulk chunks after their arrival (in sec), used for ordering.
+            monitor (LoadMonitor | None): Monitor the compute time of every batch is reported to.
+            offline_model (AcousticBackend | None): Model of bulk work of `forward_offline`, or None to use `model`.
+
+        """
+        if max_batch_size <= 0:
+            raise ValueError(f"'max_batch_size' must be positive, but got {max_batch_size}")
+        if any(getattr(item, "implicit_state", False) for item in (model, offline_model)):
+            # Streams are batched in any combination, the state of every stream must travel with its chunk
+            raise ValueError("Scheduler cannot batch a model with implicit state")
+        self.model = model
+        self.offline_model = offline_model
+        self.max_batch_size = max_batch_size
+        self.budgets = {Priority.LIVE: live_budget, Priority.BULK: bulk_budget}
+        self.monitor = monitor
+        self._queues: dict[Priority, list[_Request]] = {Priority.LIVE: [], Priority.BULK: []}  # Heaps
+        self._offline_queue: list[_Request] = []  # Heap of bulk chunks of the offline model
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._thread: threading.Thread | None = None
+        self._stopping = False
+        self._stats = {"batches": 0, "live_chunks": 0, "bulk_chunks": 0, "offline_chunks": 0, "missed_deadlines": 0}
+
+    def start(self) -> None:
+        """Start processing in a background thread."""
+        if self._thread is not None:
+            raise RuntimeError("Scheduler is already started")
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="deadline-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Process the queued chunks and stop the background thread."""
+        if self._thread is None:
+            return
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self._thread.join()
+        self._thread = None
+
+    def submit(
+        self,
+        audio_chunk: StreamingCTCModel.InputType,
+        state: StreamingCTCModel.StateType | None = None,
+        *,
+        priority: Priority = Priority.LIVE,
+        deadline: float | None = None,
+        offline: bool = False,
+    ) -> Future[tuple[StreamingCTCModel.OutputType, StreamingCTCModel.StateType]]:
+        """Queue a chunk of one stream for processing.
+
+        Args:
+            audio_chunk (StreamingCTCModel.InputType): Audio chunk, shape (AUDIO_CHUNK_SAMPLES, 1) of the model.
+            state (StreamingCTCModel.StateType | None): State of the stream, shape (STATE_SIZE,), or None.
+            priority (Priority): Class of traffic of the chunk.
+            deadline (float | None): Deadline in `time.monotonic()` clock, or None for arrival time + budget.
+            offline (bool): Run the chunk with the offline model (bulk priority only).
+
+        Returns:
+            Future: Log-probabilities (T, C) and the next state (STATE_SIZE,) of the stream.
+
+        """
+        if offline and (self.offline_model is None or priority != Priority.BULK):
+            raise ValueError("Only bulk chunks of a scheduler with an offline model can be offline")
+        model = self.offline_model if offline and self.offline_model is not None else self.model
+        if audio_chunk.shape != (model.AUDIO_CHUNK_SAMPLES, 1):
+            raise ValueError(
+                f"Shape of 'audio_chunk' must be ({model.AUDIO_CHUNK_SAMPLES}, 1), but got {audio_chunk.shape}",
+            )
+        if deadline is None:
+            deadline = time.monotonic() + self.budgets[priority]
+        future: Future[tuple[StreamingCTCModel.OutputType, StreamingCTCModel.StateType]] = Future()
+        with self._condition:
+            if self._thread is None or self._stopping:
+                raise RuntimeError("Scheduler is not running")
+            queue = self._offline_queue if offline else self._queues[priority]
+            heapq.heappush(queue, _Request(deadline, next(self._order), audio_chunk, state, future))
+            self._condition.notify()
+        return future
+
+    def wrap(self, pipeline: StreamingCTCPipeline, priority: Priority) -> StreamingCTCPipeline:
+        """Return a pipeline with the splitter and the decoder of `pipeline` running its models through the scheduler.
+
+        The offline model of `pipeline` must be the offline model of the scheduler, so bulk work of
+        `forward_offline` is scheduled too (and the fingerprint of the pipeline does not change).
+        """
+        if pipeline.offline_model is not self.offline_model:
+            raise ValueError("Offline model of the pipeline must be the offline model of the scheduler")
+        offline_model = ScheduledModel(self, Priority.BULK, offline=True) if self.offline_model is not None else None
+        return StreamingCTCPipeline(
+            ScheduledModel(self, priority),
+            pipeline.logprob_splitter,
+            pipeline.decoder,
+            offline_model=offline_model,
+        )
+
+    def stats(self) -> dict[str, int]:
+        """Return numbers of processed batches and chunks, missed live deadlines and queued chunks."""
+        with self._condition:
+            return {
+                **self._stats,
+                "live_queued": len(self._queues[Priority.LIVE]),
+                "bulk_queued": len(self._queues[Priority.BULK]),
+                "offline_queued": len(self._offline_queue),
+            }
+
+    def _next_batch(self) -> tuple[bool, list[tuple[Priority, _Request]]] | None:
+        """Return the next batch with a flag of the offline model, or None when stopped."""
+        with self._condition:
+            while not any(self._queues.values()) and not self._offline_queue:
+                if self._stopping:
+                    return None
+                self._condition.wait()
+            batch: list[tuple[Priority, _Request]] = []
+            for priority in (Priority.LIVE, Priority.BULK):
+                queue = self._queues[priority]
+                while queue and len(batch) < self.max_batch_size:
+                    batch.append((priority, heapq.heappop(queue)))
+            if batch:
+                return False, batch
+            while self._offline_queue and len(batch) < self.max_batch_size:
+                batch.append((Priority.BULK, heapq.heappop(self._offline_queue)))
+            return True, batch
+
+    def _run(self) -> None:
+        buffers = {False: self._buffers(self.model)}
+        if self.offline_model is not None:
+            buffers[True] = self._buffers(self.offline_model)
+        while (item := self._next_batch()) is not None:
+            offline, batch = item
+            model = self.offline_model if offline and self.offline_model is not None else self.model
+            try:
+                self._process(model, batch, *buffers[offline])
+            except Exception as error:
+                logger.exception("Batch of %d chunks failed", len(batch))
+                for _, request in batch:  # Failure of the batch is passed to every caller still waiting
+                    if not request.future.done():
+                        request.future.set_exception(error)
+
+    def _buffers(self, model: AcousticBackend) -> tuple[StreamingCTCModel.InputType, StreamingCTCModel.StateType]:
+        """Allocate inputs of a batch of the model: audio chunks and states."""
+        audio = np.zeros((self.max_batch_size, model.AUDIO_CHUNK_SAMPLES, 1), dtype=np.int32)
+        states = np.zeros((self.max_batch_size, model.STATE_SIZE), dtype=model.manifest.numpy_state_dtype)
+        return audio, states
+
+    def _process(
+        self,
+        model: AcousticBackend,
+        batch: list[tuple[Priority, _Request]],
+        audio: StreamingCTCModel.InputType,
+        states: StreamingCTCModel.StateType,
+    ) -> None:
+        batch_size = len(batch)
+        for i, (_, request) in enumerate(batch):
+            audio[i] = request.audio_chunk
+            if request.state is None:
+                states[i] = 0
+            else:
+                states[i] = request.state
+        start = time.perf_counter()
+        logprobs, next_states = model.forward(audio[:batch_size], states[:batch_size])
+        compute_seconds = time.perf_counter() - start
+        if self.monitor is not None:
+            audio_seconds = batch_size * model.manifest.chunk_duration
+            self.monitor.record(audio_seconds, compute_seconds)
+
+        now = time.monotonic()
+        with self._condition:
+            self._stats["batches"] += 1
+            for priority, request in batch:
+                self._stats["offline_chunks" if model is self.offline_model else f"{priority.value}_chunks"] += 1
+                if priority == Priority.LIVE and now > request.deadline:
+                    self._stats["missed_deadlines"] += 1
+        for i, (_, request) in enumerate(batch):
+            # Copy, so the state of a stream does not keep the outputs of the whole batch alive
+            request.future.set_result((logprobs[i].copy(), next_states[i].copy()))
+
+
+class ScheduledModel:
+    """Stand-in for `StreamingCTCModel` that runs every stream of the input through `DeadlineScheduler`.
+
+    Streams of a batched input are submitted separately and may be processed in different batches.
+    """
+
+    def __init__(self, scheduler: DeadlineScheduler, priority: Priority, *, offline: bool = False) -> None:
+        self.scheduler = scheduler
+        self.priority = priority
+        self.offline = offline
+        model = scheduler.offline_model if offline and scheduler.offline_model is not None else scheduler.model
+        self.model = model
+        self.SAMPLE_RATE = model.SAMPLE_RATE
+        self.MEAN_TIME_BIAS = model.MEAN_TIME_BIAS
+        self.AUDIO_CHUNK_SAMPLES = model.AUDIO_CHUNK_SAMPLES
+        self.FRAME_SIZE = model.FRAME_SIZE
+        self.STATE_SIZE = model.STATE_SIZE
+        self.manifest = model.manifest
+
+    @property
+    def fingerprint(self) -> str:
+        """Identity of the model weights."""
+        return self.model.fingerprint
+
+    def forward(
+        self,
+        audio_chunk: StreamingCTCModel.InputType,
+        state: StreamingCTCModel.StateType | None = None,
+    ) -> tuple[StreamingCTCModel.OutputType, StreamingCTCModel.StateType]:
+        """Run the acoustic model on a batch of audio chunks, shape (B, 2400, 1), waiting for the scheduler.
+
+        See `StreamingCTCModel.forward` for more info.
+        """
+        if audio_chunk.ndim != 3:
+            raise ValueError(f"Shape of 'audio_chunk' must be (B, 2400, 1), but got {audio_chunk.shape}")
+        futures = [
+            self.scheduler.submit(
+                audio_chunk[i],
+                state[i] if state is not None else None,
+                priority=self.priority,
+                offline=self.offline,
+            )
+            for i in range(audio_chunk.shape[0])
+        ]
+        results = [future.result() for future in futures]
+        return np.stack([logprobs for logprobs, _ in results]), np.stack([next_state for _, next_state in results])
@@ -0,0 +1,293 @@
+"""Module for keeping pipeline states of live sessions within a memory budget."""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Generic, TypeVar, cast
+
+import numpy as np
+
+from tone.logprob_splitter import StreamingLogprobSplitterState
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+    from tone.pipeline import StreamingCTCPipeline
+
+logger = logging.getLogger(__name__)
+
+_State = TypeVar("_State")
+
+# Serialized state layout (little-endian):
+#   header: magic, version, flags, model state dtype, model state shape (2 dims),
+#           splitter logprobs shape (2 dims), splitter offset
+#   payload (zlib-compressed if FLAG_COMPRESSED is set): model state bytes, then splitter logprobs bytes
+_STATE_MAGIC = b"TONS"
+_STATE_VERSION = 1
+_FLAG_COMPRESSED = 0x01
+_STATE_HEADER = struct.Struct("<4sBB8sIIIIq")
+
+
+def state_nbytes(state: StreamingCTCPipeline.StateType) -> int:
+    """Return number of bytes occupied by arrays of the pipeline state."""
+    model_state, splitter_state = state
+    return model_state.nbytes + splitter_state.past_logprobs.nbytes
+
+
+def serialize_state(state: StreamingCTCPipeline.StateType, *, compress_level: int = 1) -> bytes:
+    """Serialize pipeline state into a compact binary representation.
+
+    The format is self-describing and does not use pickle, so it is safe to use for moving
+    sessions between worker processes or for storing them on disk.
+
+    Args:
+        state (StreamingCTCPipeline.StateType): Pipeline state to serialize.
+        compress_level (int): zlib compression level (0 - no compression, 9 - best compression).
+
+    Returns:
+        bytes: Serialized state.
+
+    """
+    if not isinstance(state, tuple) or len(state) != 2:
+        raise TypeError(f"Incorrect 'state' type: expected tuple of 2 elements, but got {type(state)}")
+    model_state, splitter_state = state
+    if not isinstance(model_state, np.ndarray) or model_state.ndim != 2:
+        raise ValueError("Model state must be a 2-dimensional np.ndarray")
+    if not isinstance(splitter_state, StreamingLogprobSplitterState):
+        raise TypeError(
+            f"Incorrect splitter state type: expected StreamingLogprobSplitterState, but got {type(splitter_state)}",
+        )
+
+    past_logprobs = np.ascontiguousarray(splitter_state.past_logprobs, dtype=np.float32)
+    payload = np.ascontiguousarray(model_state).tobytes() + past_logprobs.tobytes()
+    flags = 0
+    if compress_level > 0:
+        payload = zlib.compress(payload, compress_level)
+        flags |= _FLAG_COMPRESSED
+
+    header = _STATE_HEADER.pack(
+        _STATE_MAGIC,
+        _STATE_VERSION,
+        flags,
+        model_state.dtype.str.encode("ascii"),
+        *model_state.shape,
+        *past_logprobs.shape,
+        splitter_state.offset,
+    )
+    return header + payload
+
+
+def deserialize_state(data: bytes) -> StreamingCTCPipeline.StateType:
+    """Restore pipeline state serialized with `serialize_state`.
+
+    Args:
+        data (bytes): Serialized state.
+
+    Returns:
+        StreamingCTCPipeline.StateType: Restored pipeline state.
+
+    """
+    if len(data) < _STATE_HEADER.size:
+        raise ValueError("Serialized state is too short")
+    magic, version, flags, dtype, *shapes, offset = _STATE_HEADER.unpack_from(data)
+    if magic != _STATE_MAGIC:
+        raise ValueError("Data is not a serialized pipeline state")
+    if version != _STATE_VERSION:
+        raise ValueError(f"Unsupported version of serialized state: {version}")
+
+    payload = data[_STATE_HEADER.size :]
+    if flags & _FLAG_COMPRESSED:
+        payload = zlib.decompress(payload)
+    buffer = bytearray(payload)  # Writable buffer, so restored arrays are not read-only
+
+    model_state_dtype = np.dtype(dtype.rstrip(b"\0").decode("ascii"))
+    state_batch, state_size, logprobs_len, logprobs_dim = shapes
+    model_state_nbytes = state_batch * state_size * model_state_dtype.itemsize
+    if len(buffer) != model_state_nbytes + logprobs_len * logprobs_dim * 4:
+        raise ValueError("Size of serialized state does not match its header")
+
+    model_state = np.frombuffer(buffer, dtype=model_state_dtype, count=state_batch * state_size)
+    past_logprobs = np.frombuffer(buffer, dtype=np.float32, offset=model_state_nbytes)
+    splitter_state = StreamingLogprobSplitterState(
+        past_logprobs=past_logprobs.reshape(logprobs_len, logprobs_dim),
+        offset=offset,
+    )
+    return model_state.reshape(state_batch, state_size), splitter_state
+
+
+@dataclass(frozen=True)
+class StateCodec(Generic[_State]):
+    """Functions `SessionManager` measures, spills and restores states of sessions with.
+
+    Attributes:
+        nbytes: number of bytes occupied by arrays of the state
+        serialize: serializes the state with the given zlib compression level
+        deserialize: restores the serialized state
+
+    """
+
+    nbytes: Callable[[_State], int]
+    serialize: Callable[[_State, int], bytes]
+    deserialize: Callable[[bytes], _State]
+
+
+PIPELINE_STATE_CODEC: StateCodec[StreamingCTCPipeline.StateType] = StateCodec(
+    nbytes=state_nbytes,
+    serialize=lambda state, compress_level: serialize_state(state, compress_level=compress_level),
+    deserialize=deserialize_state,
+)
+
+
+@dataclass
+class _Session(Generic[_State]):
+    state: _State | None
+    nbytes: int
+    last_access: float
+    spill_path: Path | None = None
+
+
+class SessionManager(Generic[_State]):
+    """Keeps states of live sessions within a global memory budget.
+
+    Every session is identified by a string id. States of sessions that have not been accessed for
+    `idle_timeout` seconds (e.g. calls on hold) are hibernated: serialized, compressed and spilled
+    to `spill_dir`. States of the least recently used sessions are also hibernated when the memory
+    budget is exceeded. Hibernated states are restored transparently by `get`.
+
+    States are pipeline states unless another `codec` is given (e.g. `ELASTIC_STATE_CODEC` of
+    `tone.serving.elastic`). The class is thread-safe.
+    """
+
+    def __init__(
+        self,
+        memory_budget: int,
+        *,
+        idle_timeout: float = 10.0,
+        spill_dir: Path | str | None = None,
+        compress_level: int = 1,
+        codec: StateCodec[_State] | None = None,
+    ) -> None:
+        if memory_budget <= 0:
+            raise ValueError(f"'memory_budget' must be positive, but got {memory_budget}")
+        self.memory_budget = memory_budget
+        self.idle_timeout = idle_timeout
+        self.compress_level = compress_level
+        self.codec = codec if codec is not None else cast("StateCodec[_State]", PIPELINE_STATE_CODEC)
+        self._spill_dir = Path(spill_dir) if spill_dir is not None else Path(tempfile.mkdtemp(prefix="tone-sessions-"))
+        self._spill_dir.mkdir(parents=True, exist_ok=True)
+        self._sessions: OrderedDict[str, _Session[_State]] = OrderedDict()  # From the least to the most recently used
+        self._memory_usage = 0
+        self._lock = threading.Lock()
+
+    @property
+    def memory_usage(self) -> int:
+        """Number of bytes occupied by in-memory states."""
+        return self._memory_usage
+
+    def stats(self) -> dict[str, int]:
+        """Return counters of sessions and memory usage."""
+        with self._lock:
+            hibernated = sum(session.spill_path is not None for session in self._sessions.values())
+            return {
+                "sessions": len(self._sessions),
+                "hibernated_sessions": hibernated,
+                "memory_usage": self._memory_usage,
+                "memory_budget": self.memory_budget,
+            }
+
+    def get(self, session_id: str) -> _State | None:
+        """Return state of the session (restoring it if hibernated), or None for a new session."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            session.last_access = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            if session.spill_path is not None:
+                self._restore(session)
+                self._enforce_budget(keep=session_id)
+            return session.state
+
+    def put(self, session_id: str, state: _State) -> None:
+        """Store new state of the session and hibernate other sessions if memory budget is exceeded."""
+        nbytes = self.codec.nbytes(state)
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._memory_usage -= session.nbytes if session.spill_path is None else 0
+                self._remove_spill(session)
+            self._sessions[session_id] = _Session(state=state, nbytes=nbytes, last_access=time.monotonic())
+            self._memory_usage += nbytes
+            self._enforce_budget(keep=session_id)
+
+    def close(self, session_id: str) -> None:
+        """Forget the session and release its memory and spilled state."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is None:
+                return
+            if session.spill_path is None:
+                self._memory_usage -= session.nbytes
+            self._remove_spill(session)
+
+    def hibernate(self, session_id: str) -> None:
+        """Spill state of the session to disk."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and session.spill_path is None:
+                self._spill(session_id, session)
+
+    def hibernate_idle(self, now: float | None = None) -> int:
+        """Spill states of sessions idle for more than `idle_timeout` seconds.
+
+        Returns:
+            int: Number of hibernated sessions.
+
+        """
+        now = time.monotonic() if now is None else now
+        hibernated = 0
+        with self._lock:
+            for session_id, session in self._sessions.items():
+                if now - session.last_access < self.idle_timeout:
+                    break  # Sessions are sorted by the access time
+                if session.spill_path is None:
+                    self._spill(session_id, session)
+                    hibernated += 1
+        return hibernated
+
+    def _enforce_budget(self, keep: str) -> None:
+        for session_id, session in self._sessions.items():
+            if self._memory_usage <= self.memory_budget:
+                return
+            if session_id != keep and session.spill_path is None:
+                self._spill(session_id, session)
+        if self._memory_usage > self.memory_budget:
+            logger.warning("Session memory budget exceeded: %d > %d bytes", self._memory_usage, self.memory_budget)
+
+    def _spill(self, session_id: str, session: _Session[_State]) -> None:
+        assert session.state is not None
+        spill_path = self._spill_dir / f"{hashlib.sha1(session_id.encode()).hexdigest()}.state"  # noqa: S324
+        spill_path.write_bytes(self.codec.serialize(session.state, self.compress_level))
+        session.state, session.spill_path = None, spill_path
+        self._memory_usage -= session.nbytes
+
+    def _restore(self, session: _Session[_State]) -> None:
+        assert session.spill_path is not None
+        session.state = self.codec.deserialize(session.spill_path.read_bytes())
+        self._remove_spill(session)
+        self._memory_usage += session.nbytes
+
+    @staticmethod
+    def _remove_spill(session: _Session[_State]) -> None:
+        if session.spill_path is not None:
+            session.spill_path.unlink(missing_ok=True)
+            session.spill_path = None
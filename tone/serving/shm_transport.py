@@ -0,0 +1,557 @@
+"""Module with a shared-memory transport between websocket front-ends and inference worker processes.
+
+Front-end processes terminate websockets and split the audio into chunks, inference workers own
+the pipeline and run the acoustic model on micro-batches of chunks of many sessions. Every pair of
+a front-end and an inference worker is connected with two single-producer single-consumer rings in
+shared memory: one with audio chunks and one with recognized phrases. Records are written into the
+rings in place, nothing is pickled. Readers are woken up through pipes ("doorbells").
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import os
+import platform
+import random
+import select
+from collections import deque
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import TYPE_CHECKING
+
+import numpy as np
+from typing_extensions import Self
+
+from tone.pipeline import StreamingCTCPipeline, TextPhrase
+from tone.serving.sessions import SessionManager
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Callable, Sequence
+
+    import numpy.typing as npt
+
+logger = logging.getLogger(__name__)
+
+# Flags of request records
+REQUEST_LAST = 0x01  # The last chunk of the session
+REQUEST_CLOSE = 0x02  # The session is aborted, the record has no audio
+REQUEST_RESET = 0x04  # The front-end (re)started, all its previous sessions are aborted
+
+# Flags of response records
+RESPONSE_PHRASE = 0x01  # The record contains (a part of) a phrase
+RESPONSE_MORE = 0x02  # Text of the phrase continues in the next record
+RESPONSE_END = 0x04  # The session is finished, no more records for it
+RESPONSE_ERROR = 0x08  # The session failed
+RESPONSE_RESET = 0x10  # The inference worker (re)started or dropped the front-end, all sessions sent before are lost
+
+RESPONSE_TEXT_SIZE = 1000  # Longer texts are split into several records
+
+# Rings rely on stores not being reordered (x86-64 memory model), there are no memory barriers in Python
+SUPPORTED_MACHINES = ("x86_64", "AMD64")
+
+
+def check_platform() -> None:
+    """Raise RuntimeError if shared-memory rings are not safe on this CPU architecture."""
+    if platform.machine() not in SUPPORTED_MACHINES:
+        raise RuntimeError(
+            f"Shared-memory transport requires x86-64 (stores are not reordered), but the machine is "
+            f"{platform.machine()!r}",
+        )
+
+
+def request_dtype(chunk_size: int) -> np.dtype:
+    """Return type of request records carrying audio chunks of `chunk_size` samples."""
+    return np.dtype([("session", "<u4"), ("flags", "u1"), ("samples", "<i4", (chunk_size,))], align=True)
+
+
+REQUEST_DTYPE = request_dtype(StreamingCTCPipeline.CHUNK_SIZE)  # Records for chunks of the published model
+RESPONSE_DTYPE = np.dtype(
+    [
+        ("session", "<u4"),
+        ("flags", "u1"),
+        ("text_size", "<u2"),
+        ("start_time", "<f8"),
+        ("end_time", "<f8"),
+        ("text", "u1", (RESPONSE_TEXT_SIZE,)),
+    ],
+    align=True,
+)
+
+
+class SharedRing:
+    """Single-producer single-consumer ring of fixed-size records in shared memory.
+
+    The ring is created before forking and is used by one producer and one consumer process. The name
+    of the shared memory is removed right after creation: the mapping is inherited by forked processes,
+    and the memory is freed when the last of them exits, so nothing is leaked even if the processes are killed.
+    The producer fills the record returned by `reserve` in place and publishes it with `commit`,
+    the consumer reads the record returned by `peek` in place and frees it with `release`.
+    Head and tail counters are stored in the shared memory too, each one is written only by one side.
+    Records are published in order on x86-64 (stores are not reordered), rings are refused on other
+    architectures (see `check_platform`).
+
+    `notify` wakes up the consumer waiting on `fileno` (e.g. with `select` or `loop.add_reader`).
+    """
+
+    _HEADER_SIZE = 128  # Head and tail counters on separate cache lines
+
+    def __init__(self, dtype: np.dtype, capacity: int) -> None:
+        check_platform()
+        if capacity <= 0:
+            raise ValueError(f"'capacity' must be positive, but got {capacity}")
+        self.dtype = dtype
+        self.capacity = capacity
+        self._shm = shared_memory.SharedMemory(create=True, size=self._HEADER_SIZE + dtype.itemsize * capacity)
+        self._shm.unlink()
+        self._counters: npt.NDArray[np.uint64] = np.ndarray(
+            (self._HEADER_SIZE // 8,),
+            dtype=np.uint64,
+            buffer=self._shm.buf,
+        )
+        self._counters[:] = 0
+        self._records: npt.NDArray[np.void] = np.ndarray(
+            (capacity,),
+            dtype=dtype,
+            buffer=self._shm.buf,
+            offset=self._HEADER_SIZE,
+        )
+        self._bell_read, self._bell_write = os.pipe()
+        os.set_blocking(self._bell_read, False)
+        os.set_blocking(self._bell_write, False)
+
+    @property
+    def _head(self) -> int:
+        return int(self._counters[0])
+
+    @property
+    def _tail(self) -> int:
+        return int(self._counters[8])
+
+    def __len__(self) -> int:
+        """Number of published records not released by the consumer yet."""
+        return self._head - self._tail
+
+    def reserve(self) -> np.void | None:
+        """Return the next free record to fill in place, or None if the ring is full (producer side)."""
+        head = self._head
+        if head - self._tail >= self.capacity:
+            return None
+        return self._records[head % self.capacity]
+
+    def commit(self) -> None:
+        """Publish the record returned by `reserve` (producer side)."""
+        self._counters[0] += 1
+
+    def peek(self) -> np.void | None:
+        """Return the oldest published record, or None if the ring is empty (consumer side)."""
+        tail = self._tail
+        if tail == self._head:
+            return None
+        return self._records[tail % self.capacity]
+
+    def release(self) -> None:
+        """Free the record returned by `peek` (consumer side)."""
+        self._counters[8] += 1
+
+    def discard(self) -> None:
+        """Free all published records (consumer side)."""
+        self._counters[8] = self._counters[0]
+
+    def notify(self) -> None:
+        """Wake up the consumer."""
+        with contextlib.suppress(BlockingIOError):  # The pipe is full, so the consumer will wake up anyway
+            os.write(self._bell_write, b"\0")
+
+    def fileno(self) -> int:
+        """File descriptor that becomes readable after `notify`."""
+        return self._bell_read
+
+    def clear_notifications(self) -> None:
+        """Consume pending notifications (consumer side)."""
+        with contextlib.suppress(BlockingIOError):
+            while os.read(self._bell_read, 4096):
+                pass
+
+    def close(self) -> None:
+        """Release the shared memory and the doorbell of the ring in this process."""
+        del self._counters, self._records  # Views must be released before the memory is closed
+        self._shm.close()
+        os.close(self._bell_read)
+        os.close(self._bell_write)
+
+
+@dataclass
+class Channel:
+    """Pair of rings connecting one front-end with one inference worker.
+
+    Attributes:
+        requests: audio chunks from the front-end to the inference worker
+        responses: phrases from the inference worker to the front-end
+
+    """
+
+    requests: SharedRing
+    responses: SharedRing
+
+    @classmethod
+    def create(
+        cls,
+        *,
+        chunk_size: int = StreamingCTCPipeline.CHUNK_SIZE,
+        request_capacity: int = 64,
+        response_capacity: int = 256,
+    ) -> Self:
+        """Create rings of the channel for audio chunks of `chunk_size` samples (`CHUNK_SIZE` of the pipeline)."""
+        return cls(
+            requests=SharedRing(request_dtype(chunk_size), request_capacity),
+            responses=SharedRing(RESPONSE_DTYPE, response_capacity),
+        )
+
+    @property
+    def chunk_size(self) -> int:
+        """Number of samples in audio chunks of the request records."""
+        return int(self.requests.dtype["samples"].shape[0])
+
+    def close(self) -> None:
+        """Release the rings of the channel."""
+        self.requests.close()
+        self.responses.close()
+
+
+class InferenceWorker:
+    """Runs the pipeline on audio chunks received from front-ends and sends recognized phrases back.
+
+    Chunks available in the rings are collected into a micro-batch (at most one chunk of every session,
+    as the next chunk depends on the state after the previous one) and processed with
+    `StreamingCTCPipeline.forward_batch`. Batches grow by themselves under load: chunks arriving while
+    a batch is processed are taken into the next one. States of the sessions are kept in `SessionManager`.
+
+    Responses that do not fit into the ring of a front-end are kept in its backlog and sent when the
+    front-end reads the ring, so a slow front-end does not stall the others. If the backlog exceeds
+    `max_backlog` records, the front-end is dropped: its sessions are aborted, it is sent `RESPONSE_RESET`,
+    and its requests are skipped until it acknowledges the reset with `REQUEST_RESET`.
+    """
+
+    def __init__(
+        self,
+        pipeline: StreamingCTCPipeline,
+        channels: Sequence[Channel],
+        *,
+        max_batch_size: int = 16,
+        sessions: SessionManager | None = None,
+        max_backlog: int = 1024,
+    ) -> None:
+        if max_batch_size <= 0:
+            raise ValueError(f"'max_batch_size' must be positive, but got {max_batch_size}")
+        if max_backlog <= 0:
+            raise ValueError(f"'max_backlog' must be positive, but got {max_backlog}")
+        if any(channel.chunk_size != pipeline.CHUNK_SIZE for channel in channels):
+            raise ValueError(f"Channels must carry chunks of {pipeline.CHUNK_SIZE} samples, as the pipeline takes")
+        self.pipeline = pipeline
+        self.channels = channels
+        self.max_batch_size = max_batch_size
+        self.sessions = sessions if sessions is not None else SessionManager(2048 * 1024 * 1024)
+        self.max_backlog = max_backlog
+        self._audio = np.zeros((max_batch_size, pipeline.CHUNK_SIZE), dtype=np.int32)
+        self._open_sessions: list[set[int]] = [set() for _ in channels]  # Sessions of every front-end
+        self._first_channel = 0  # Channels are polled round-robin, so every front-end gets its share
+        # Response records (session, flags, text, start and end time) not fitting into the ring of every front-end
+        self._backlogs: list[deque[tuple[int, int, bytes, float, float]]] = [deque() for _ in channels]
+        self._dropped: set[int] = set()  # Front-ends that have not acknowledged `RESPONSE_RESET` yet
+
+    def run(self, should_stop: Callable[[], bool], *, poll_interval: float = 0.1) -> None:
+        """Process chunks until `should_stop` returns True."""
+        for index, channel in enumerate(self.channels):  # Chunks of the previous worker can not be processed
+            channel.requests.discard()
+            self._send(index, 0, RESPONSE_RESET)
+        self._flush()
+        while not should_stop():
+            if not self.step():
+                # Backlogs are flushed when the front-ends read their rings, which wakes nobody up
+                timeout = min(poll_interval, 0.005) if any(self._backlogs) else poll_interval
+                select.select([channel.requests for channel in self.channels], [], [], timeout)
+                for channel in self.channels:
+                    channel.requests.clear_notifications()
+
+    def step(self) -> int:
+        """Send backlogged responses, process one micro-batch of available chunks and return its size."""
+        self._flush()
+        batch: list[tuple[int, int, bool]] = []  # Channel, session and flag of the last chunk
+        keys: set[tuple[int, int]] = set()
+        for offset in range(len(self.channels)):
+            index = (self._first_channel + offset) % len(self.channels)
+            requests = self.channels[index].requests
+            while len(batch) < self.max_batch_size and (record := requests.peek()) is not None:
+                session, flags = int(record["session"]), int(record["flags"])
+                if (index, session) in keys:
+                    break  # The next chunk of a session goes to the next batch
+                if flags & REQUEST_RESET:
+                    for open_session in self._open_sessions[index]:
+                        self._abort(f"{index}:{open_session}")
+                    self._open_sessions[index].clear()
+                    self._dropped.discard(index)
+                elif index in self._dropped:
+                    pass  # Chunks of the sessions aborted when the front-end was dropped
+                elif flags & REQUEST_CLOSE:
+                    self._abort(f"{index}:{session}")
+                    self._open_sessions[index].discard(session)
+                else:
+                    self._audio[len(batch)] = record["samples"]
+                    batch.append((index, session, bool(flags & REQUEST_LAST)))
+                    keys.add((index, session))
+                requests.release()
+        self._first_channel = (self._first_channel + 1) % len(self.channels)
+        if batch:
+            self._process(batch)
+        return len(batch)
+
+    def _abort(self, session_id: str) -> None:
+        """Forget a session closed before its last chunk."""
+        if (state := self.sessions.get(session_id)) is not None:
+            self.pipeline.release(state)
+        self.sessions.close(session_id)
+
+    def _process(self, batch: list[tuple[int, int, bool]]) -> None:
+        session_ids = [f"{index}:{session}" for index, session, _ in batch]
+        try:
+            results = self.pipeline.forward_batch(
+                self._audio[: len(batch)],
+                [self.sessions.get(session_id) for session_id in session_ids],
+                is_last=[is_last for _, _, is_last in batch],
+            )
+        except Exception:
+            logger.exception("Failed to process batch of %d chunks", len(batch))
+            for (index, session, _), session_id in zip(batch, session_ids):
+                self._abort(session_id)
+                self._open_sessions[index].discard(session)
+                self._send(index, session, RESPONSE_ERROR)
+        else:
+            for (index, session, is_last), session_id, (phrases, state) in zip(batch, session_ids, results):
+                for phrase in phrases:
+                    self._send(index, session, RESPONSE_PHRASE, phrase)
+                if is_last:
+                    self.sessions.close(session_id)
+                    self._open_sessions[index].discard(session)
+                    self._send(index, session, RESPONSE_END)
+                else:
+                    self.sessions.put(session_id, state)
+                    self._open_sessions[index].add(session)
+        self._flush()
+        for index in {index for index, _, _ in batch}:
+            if len(self._backlogs[index]) > self.max_backlog:
+                self._drop(index)
+
+    def _drop(self, index: int) -> None:
+        """Abort all sessions of a front-end that does not read its responses and send it `RESPONSE_RESET`."""
+        logger.warning(
+            "Front-end %d does not read responses, its %d sessions are aborted",
+            index,
+            len(self._open_sessions[index]),
+        )
+        for session in self._open_sessions[index]:
+            self._abort(f"{index}:{session}")
+        self._open_sessions[index].clear()
+        self._backlogs[index].clear()
+        self._dropped.add(index)
+        self._send(index, 0, RESPONSE_RESET)
+        self._flush()
+
+    def _send(self, index: int, session: int, flags: int, phrase: TextPhrase | None = None) -> None:
+        """Queue response to the front-end, long texts are split into several records."""
+        text = phrase.text.encode() if phrase is not None else b""
+        start_time, end_time = (phrase.start_time, phrase.end_time) if phrase is not None else (0.0, 0.0)
+        start = 0
+        while True:
+            piece = text[start : start + RESPONSE_TEXT_SIZE]
+            start += len(piece)
+            more = RESPONSE_MORE if start < len(text) else 0
+            self._backlogs[index].append((session, flags | more, piece, start_time, end_time))
+            if start >= len(text):
+                return
+
+    def _flush(self) -> None:
+        """Write queued responses into the rings as long as they fit."""
+        for channel, backlog in zip(self.channels, self._backlogs):
+            if not backlog:
+                continue
+            responses = channel.responses
+            while backlog and (record := responses.reserve()) is not None:
+                session, flags, piece, start_time, end_time = backlog.popleft()
+                record["session"] = session
+                record["flags"] = flags
+                record["text_size"] = len(piece)
+                record["text"][: len(piece)] = np.frombuffer(piece, dtype=np.uint8)
+                record["start_time"], record["end_time"] = start_time, end_time
+                responses.commit()
+            responses.notify()  # Also when the ring is full, so the front-end reads it
+
+
+class InferenceError(RuntimeError):
+    """Session failed in the inference worker."""
+
+
+class ClientSession:
+    """Streaming recognition session of `InferenceClient`."""
+
+    def __init__(self, client: InferenceClient, worker: int, session_id: int) -> None:
+        self.client = client
+        self.worker = worker
+        self.session_id = session_id
+        self.finished = False
+        self._results: asyncio.Queue[TextPhrase | Exception | None] = asyncio.Queue()
+        self._text = bytearray()  # Text of the phrase received in several records
+
+    async def send(self, audio_chunk: npt.NDArray[np.int32], *, is_last: bool = False) -> None:
+        """Send audio chunk of `InferenceClient.chunk_size` samples, waiting if the ring is full."""
+        if audio_chunk.shape != (self.client.chunk_size,):
+            raise ValueError(
+                f"Shape of 'audio_chunk' must be ({self.client.chunk_size},), but got {audio_chunk.shape}",
+            )
+        record = await self.client.reserve(self.worker)
+        record["session"] = self.session_id
+        record["flags"] = REQUEST_LAST if is_last else 0
+        record["samples"] = audio_chunk
+        self.client.commit(self.worker)
+
+    def __aiter__(self) -> AsyncIterator[TextPhrase]:
+        """Iterate over recognized phrases until the last chunk is processed.
+
+        Raises:
+            InferenceError: If the session failed in the inference worker.
+
+        """
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[TextPhrase]:
+        while (result := await self._results.get()) is not None:
+            if isinstance(result, Exception):
+                raise result
+            yield result
+
+    async def close(self) -> None:
+        """Abort the session if it is not finished yet and forget it."""
+        if not self.finished:
+            self.finished = True
+            record = await self.client.reserve(self.worker)
+            record["session"] = self.session_id
+            record["flags"] = REQUEST_CLOSE
+            self.client.commit(self.worker)
+        self.client.forget(self)
+
+    def dispatch(self, record: np.void) -> None:
+        """Handle response record of the session."""
+        flags = int(record["flags"])
+        if flags & RESPONSE_PHRASE:
+            self._text += record["text"][: int(record["text_size"])].tobytes()
+            if not flags & RESPONSE_MORE:
+                text, self._text = self._text.decode(), bytearray()
+                start_time, end_time = float(record["start_time"]), float(record["end_time"])
+                self._results.put_nowait(TextPhrase(text=text, start_time=start_time, end_time=end_time))
+        if flags & RESPONSE_END:
+            self.finished = True
+            self._results.put_nowait(None)
+        if flags & RESPONSE_ERROR:
+            self.fail()
+
+    def fail(self) -> None:
+        """Finish the session with `InferenceError` (unless it is already finished)."""
+        if self.finished:
+            return
+        self.finished = True
+        self._results.put_nowait(InferenceError("Session failed in the inference worker"))
+
+
+class InferenceClient:
+    """Front-end side of the transport: opens sessions on inference workers and dispatches their phrases.
+
+    Must be used from a single asyncio event loop. New sessions are assigned to the worker with the
+    fewest open sessions. Sending waits (without blocking the loop) while the ring of the worker is full.
+    `REQUEST_RESET` is sent to a worker at start and in reply to its `RESPONSE_RESET`, before any other request.
+    """
+
+    def __init__(self, channels: Sequence[Channel], *, full_ring_delay: float = 0.002) -> None:
+        if not channels:
+            raise ValueError("At least one channel is required")
+        if len({channel.chunk_size for channel in channels}) > 1:
+            raise ValueError("All channels must carry chunks of the same size")
+        self.channels = channels
+        self.chunk_size = channels[0].chunk_size  # `CHUNK_SIZE` of the pipeline of the inference workers
+        self.full_ring_delay = full_ring_delay
+        self._sessions: list[dict[int, ClientSession]] = [{} for _ in channels]  # Open sessions of every worker
+        self._next_session_id = random.getrandbits(32)  # Ids of a restarted front-end differ from the old ones
+        self._pending_resets: set[int] = set()  # Workers `REQUEST_RESET` is not sent to yet (their ring is full)
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def start(self) -> None:
+        """Start receiving phrases in the running event loop and abort sessions of the previous front-end."""
+        self._loop = asyncio.get_running_loop()
+        for worker, channel in enumerate(self.channels):
+            self._pending_resets.add(worker)
+            self._send_reset(worker)
+            self._loop.add_reader(channel.responses.fileno(), self._receive, worker)
+
+    def stop(self) -> None:
+        """Stop receiving phrases."""
+        if self._loop is not None:
+            for channel in self.channels:
+                self._loop.remove_reader(channel.responses.fileno())
+            self._loop = None
+
+    def open_session(self) -> ClientSession:
+        """Open a new session on the least loaded inference worker."""
+        worker = min(range(len(self.channels)), key=lambda i: len(self._sessions[i]))
+        session_id, self._next_session_id = self._next_session_id, (self._next_session_id + 1) % (1 << 32)
+        session = ClientSession(self, worker, session_id)
+        self._sessions[worker][session_id] = session
+        return session
+
+    def queue_depth(self) -> int:
+        """Return number of chunks sent to the inference workers and not taken for processing yet."""
+        return sum(len(channel.requests) for channel in self.channels)
+
+    def forget(self, session: ClientSession) -> None:
+        """Stop dispatching phrases of the session."""
+        self._sessions[session.worker].pop(session.session_id, None)
+
+    async def reserve(self, worker: int) -> np.void:
+        """Return free record of the request ring of the worker, waiting until there is one."""
+        # The ring is freed by another process, so there is no event to wait for
+        while not self._send_reset(worker) or (record := self.channels[worker].requests.reserve()) is None:  # noqa: ASYNC110
+            await asyncio.sleep(self.full_ring_delay)
+        return record
+
+    def commit(self, worker: int) -> None:
+        """Publish the reserved record to the worker."""
+        self.channels[worker].requests.commit()
+        self.channels[worker].requests.notify()
+
+    def _send_reset(self, worker: int) -> bool:
+        """Send pending `REQUEST_RESET` to the worker, return False if it is still pending (the ring is full)."""
+        if worker not in self._pending_resets:
+            return True
+        requests = self.channels[worker].requests
+        if (record := requests.reserve()) is None:
+            return False
+        record["session"], record["flags"] = 0, REQUEST_RESET
+        requests.commit()
+        requests.notify()
+        self._pending_resets.discard(worker)
+        return True
+
+    def _receive(self, worker: int) -> None:
+        responses = self.channels[worker].responses
+        responses.clear_notifications()
+        sessions = self._sessions[worker]
+        while (record := responses.peek()) is not None:
+            if int(record["flags"]) & RESPONSE_RESET:
+                logger.warning("Inference worker %d reset the front-end, %d sessions are lost", worker, len(sessions))
+                for lost in sessions.values():
+                    lost.fail()
+                sessions.clear()
+                self._pending_resets.add(worker)  # Chunks sent before are skipped by the worker up to the reply
+                self._send_reset(worker)
+            elif (session := sessions.get(int(record["session"]))) is not None:
+                session.dispatch(record)
+            responses.release()
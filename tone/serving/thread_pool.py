@@ -0,0 +1,129 @@
+"""Module with thread-parallel inference of several streams sharing one pipeline in one process.
+
+ONNX Runtime `InferenceSession.run` is thread-safe and releases the GIL, and the splitter and the
+decoders keep no per-call state, so one `StreamingCTCPipeline` can process chunks of several streams
+at once from a pool of threads. All cores are used without a copy of the model (and of the language
+model) per process. The cores are split between the pool and ONNX Runtime intra-op threads:
+`pool_size` concurrent runs with `intra_op_num_threads` threads each.
+
+    pipeline = ThreadedPipeline.from_local("/models", pool_size=4)  # 4 threads, cores / 4 intra-op threads each
+    output, state = pipeline.submit(pipeline.forward, audio_chunk, state).result()
+    results = pipeline.map_offline([audio_1, audio_2, audio_3])
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, TypeVar
+
+import numpy as np
+from typing_extensions import ParamSpec, Self
+
+from tone.decoder import DecoderType
+from tone.inference_config import InferenceConfig
+from tone.pipeline import StreamingCTCPipeline
+from tone.serving.prefork import available_cpus
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable
+    from concurrent.futures import Future
+    from pathlib import Path
+
+    import numpy.typing as npt
+
+_P = ParamSpec("_P")
+_T = TypeVar("_T")
+
+
+def split_threads(inference_config: InferenceConfig, pool_size: int) -> InferenceConfig:
+    """Return settings with available cores split between `pool_size` concurrent runs of the model.
+
+    Settings with explicitly set `intra_op_num_threads` are returned as is.
+    """
+    if pool_size <= 0:
+        raise ValueError(f"'pool_size' must be positive, but got {pool_size}")
+    if inference_config.intra_op_num_threads != 0:
+        return inference_config
+    threads = max(1, available_cpus() // pool_size)
+    return dataclasses.replace(inference_config, intra_op_num_threads=threads)
+
+
+class ThreadedPipeline:
+    """Pool of threads running one `StreamingCTCPipeline`: its session, splitter and decoder are shared.
+
+    Chunks of one stream must be processed one after another (the state of the next chunk is the result
+    of the previous one), chunks of different streams run in parallel. Every thread of the pool copies
+    audio chunks into its own scratch buffer, so the model always gets a contiguous input and the caller
+    may reuse its buffer (e.g. a view into the ring buffer of `AudioChunker`) as soon as the call returns.
+    """
+
+    def __init__(self, pipeline: StreamingCTCPipeline, *, pool_size: int | None = None) -> None:
+        """Create pool.
+
+        Args:
+            pipeline (StreamingCTCPipeline): Pipeline to share between the threads.
+            pool_size (int | None): Number of threads, or None for one thread per 2 available cores.
+
+        """
+        self.pipeline = pipeline
+        self.pool_size = pool_size if pool_size is not None else max(1, available_cpus() // 2)
+        if self.pool_size <= 0:
+            raise ValueError(f"'pool_size' must be positive, but got {self.pool_size}")
+        self.executor = ThreadPoolExecutor(self.pool_size, thread_name_prefix="tone-pipeline")
+        self._scratch = threading.local()
+
+    @classmethod
+    def from_local(
+        cls,
+        dir_path: str | Path,
+        *,
+        decoder_type: DecoderType = DecoderType.BEAM_SEARCH,
+        inference_config: InferenceConfig | None = None,
+        pool_size: int | None = None,
+    ) -> Self:
+        """Load pipeline from local folder (see `StreamingCTCPipeline.from_local`) and create pool for it.
+
+        Unless `intra_op_num_threads` is set explicitly, available cores are split between the threads.
+        """
+        pool_size = pool_size if pool_size is not None else max(1, available_cpus() // 2)
+        inference_config = split_threads(inference_config or InferenceConfig(), pool_size)
+        pipeline = StreamingCTCPipeline.from_local(
+            dir_path,
+            decoder_type=decoder_type,
+            inference_config=inference_config,
+        )
+        return cls(pipeline, pool_size=pool_size)
+
+    def submit(self, fn: Callable[_P, _T], /, *args: _P.args, **kwargs: _P.kwargs) -> Future[_T]:
+        """Run the function (e.g. `forward`) in a thread of the pool."""
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def forward(
+        self,
+        audio_chunk: StreamingCTCPipeline.InputType,
+        state: StreamingCTCPipeline.StateType | None = None,
+        *,
+        is_last: bool = False,
+    ) -> tuple[StreamingCTCPipeline.OutputType, StreamingCTCPipeline.StateType]:
+        """Process an audio chunk of a stream using the scratch buffer of the calling thread.
+
+        Intended to be run in the pool with `submit`, see `StreamingCTCPipeline.forward` for more info.
+        """
+        if not isinstance(audio_chunk, np.ndarray):
+            raise TypeError(f"Incorrect 'audio_chunk' type: expected np.ndarray, but got {type(audio_chunk)}")
+        scratch: npt.NDArray[np.int32] | None = getattr(self._scratch, "audio_chunk", None)
+        if scratch is None or scratch.shape != audio_chunk.shape:
+            scratch = np.empty(audio_chunk.shape, dtype=np.int32)
+            self._scratch.audio_chunk = scratch
+        np.copyto(scratch, audio_chunk, casting="same_kind")
+        return self.pipeline.forward(scratch, state, is_last=is_last)
+
+    def map_offline(self, audios: Iterable[StreamingCTCPipeline.InputType]) -> list[StreamingCTCPipeline.OutputType]:
+        """Transcribe several complete recordings in parallel, see `StreamingCTCPipeline.forward_offline`."""
+        return list(self.executor.map(self.pipeline.forward_offline, audios))
+
+    def close(self) -> None:
+        """Wait for the submitted work and stop the threads."""
+        self.executor.shutdown(wait=True)
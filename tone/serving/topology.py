@@ -0,0 +1,189 @@
+"""Module with CPU topology detection and placement of server workers on disjoint, NUMA-local core sets.
+
+On multi-socket hosts the threads of different workers migrate between NUMA nodes: caches are
+thrashed and the streaming states travel between sockets. `CpuTopology` reads NUMA nodes and
+physical cores from sysfs (Linux), `CpuTopology.plan` splits the cores available to the process
+between the workers (every worker gets a contiguous block of whole physical cores of one node,
+nodes get workers in proportion to their cores), and `pin_process` pins the calling process to its
+block. ONNX Runtime threads created after that inherit the affinity, and memory of the process is
+preferably allocated on its node, so the session, its arena and the states stay node-local. Memory
+shared copy-on-write with the parent stays where the parent allocated it, so the parent allocates a
+copy of the shared weights for every node with `allocate_on_node`.
+
+    placements = CpuTopology.detect().plan(4)
+    pin_process(placements[slot])  # In the worker, before the ONNX Runtime session is created
+"""
+
+from __future__ import annotations
+
+import contextlib
+import ctypes
+import logging
+import os
+import platform
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from typing_extensions import Self
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+logger = logging.getLogger(__name__)
+
+SYSFS_ROOT = Path("/sys/devices/system")
+MPOL_DEFAULT = 0
+MPOL_PREFERRED = 1
+SET_MEMPOLICY_SYSCALLS = {"x86_64": 238, "aarch64": 237}  # Syscall numbers of set_mempolicy
+
+
+def parse_cpulist(cpulist: str) -> list[int]:
+    """Parse CPU list in sysfs format, e.g. "0-3,8-11" -> [0, 1, 2, 3, 8, 9, 10, 11]."""
+    cpus: list[int] = []
+    for item in filter(None, (item.strip() for item in cpulist.split(","))):
+        first, _, last = item.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+@dataclass
+class WorkerPlacement:
+    """CPU cores and NUMA node of a worker.
+
+    Attributes:
+        node: NUMA node the cores belong to
+        cpus: cores the worker and its threads run on
+
+    """
+
+    node: int
+    cpus: tuple[int, ...]
+
+
+@dataclass
+class CpuTopology:
+    """NUMA nodes with the cores available to the process.
+
+    Attributes:
+        nodes: physical cores of every NUMA node, every core is a tuple of its logical CPUs (SMT siblings)
+
+    """
+
+    nodes: dict[int, list[tuple[int, ...]]]
+
+    @classmethod
+    def detect(cls, sysfs_root: Path = SYSFS_ROOT) -> Self:
+        """Read the topology of the cores the process is allowed to run on.
+
+        Raises:
+            RuntimeError: If CPU affinity is not supported (not Linux).
+
+        """
+        if not hasattr(os, "sched_getaffinity"):
+            raise RuntimeError(f"CPU affinity is not supported on {platform.system()}")
+        allowed = os.sched_getaffinity(0)
+        nodes: dict[int, list[int]] = {}
+        for node_dir in sorted((sysfs_root / "node").glob("node[0-9]*")):
+            cpus = [cpu for cpu in parse_cpulist((node_dir / "cpulist").read_text()) if cpu in allowed]
+            if cpus:
+                nodes[int(node_dir.name.removeprefix("node"))] = cpus
+        if not nodes:  # Kernel without NUMA support
+            nodes = {0: sorted(allowed)}
+
+        def core_key(cpu: int) -> tuple[int, int]:
+            topology = sysfs_root / "cpu" / f"cpu{cpu}" / "topology"
+            try:
+                return int((topology / "physical_package_id").read_text()), int((topology / "core_id").read_text())
+            except (OSError, ValueError):
+                return -1, cpu  # Unknown topology, every CPU is a core of its own
+
+        topology: dict[int, list[tuple[int, ...]]] = {}
+        for node, cpus in nodes.items():
+            cores: dict[tuple[int, int], list[int]] = {}
+            for cpu in cpus:
+                cores.setdefault(core_key(cpu), []).append(cpu)
+            topology[node] = [tuple(sorted(siblings)) for _, siblings in sorted(cores.items())]
+        return cls(topology)
+
+    @property
+    def num_cpus(self) -> int:
+        """Number of available logical CPUs."""
+        return sum(len(core) for cores in self.nodes.values() for core in cores)
+
+    def plan(self, workers: int) -> list[WorkerPlacement]:
+        """Split the cores between the workers.
+
+        Every node gets workers in proportion to its CPUs, and the physical cores of a node are split into
+        contiguous disjoint blocks. If there are more workers on a node than its cores, the logical CPUs
+        are split instead, and if there are more workers than CPUs, the workers share them.
+
+        Args:
+            workers (int): Number of workers.
+
+        Returns:
+            list[WorkerPlacement]: Placement of every worker.
+
+        """
+        if workers <= 0:
+            raise ValueError(f"'workers' must be positive, but got {workers}")
+        sizes = {node: sum(len(core) for core in cores) for node, cores in self.nodes.items()}
+        counts = dict.fromkeys(self.nodes, 0)
+        for _ in range(workers):
+            node = max(self.nodes, key=lambda node: (sizes[node] / (counts[node] + 1), -node))
+            counts[node] += 1
+        placements = []
+        for node, cores in self.nodes.items():
+            count = counts[node]
+            units = cores if count <= len(cores) else [(cpu,) for core in cores for cpu in core]
+            for i in range(count):
+                if count <= len(units):
+                    block = units[i * len(units) // count : (i + 1) * len(units) // count]
+                else:
+                    block = [units[i % len(units)]]
+                placements.append(WorkerPlacement(node=node, cpus=tuple(cpu for unit in block for cpu in unit)))
+        return placements
+
+
+def _set_mempolicy(mode: int, node: int | None = None) -> bool:
+    """Set memory policy of the calling thread (threads created later inherit it)."""
+    syscall_number = SET_MEMPOLICY_SYSCALLS.get(platform.machine())
+    if syscall_number is None:
+        return False
+    libc = ctypes.CDLL(None, use_errno=True)
+    if node is None:
+        return libc.syscall(syscall_number, mode, None, ctypes.c_ulong(0)) == 0
+    bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+    nodemask = (ctypes.c_ulong * (node // bits + 1))()
+    nodemask[node // bits] = 1 << (node % bits)
+    # The kernel reads `maxnode - 1` bits of the mask
+    return libc.syscall(syscall_number, mode, nodemask, ctypes.c_ulong(len(nodemask) * bits + 1)) == 0
+
+
+def _prefer_node(node: int) -> bool:
+    """Make the kernel allocate memory of the process on the node first (MPOL_PREFERRED)."""
+    return _set_mempolicy(MPOL_PREFERRED, node)
+
+
+@contextlib.contextmanager
+def allocate_on_node(node: int) -> Iterator[bool]:
+    """Allocate pages first touched by the calling thread within the block on the node.
+
+    Yields whether the memory policy is set. The default policy is restored on exit.
+    """
+    placed = _prefer_node(node)
+    if not placed:
+        logger.debug("Memory policy is not set, memory is allocated on the node of the first touch")
+    try:
+        yield placed
+    finally:
+        if placed:
+            _set_mempolicy(MPOL_DEFAULT)
+
+
+def pin_process(placement: WorkerPlacement) -> None:
+    """Pin the calling process (and threads it creates later) to the cores and the memory node of the placement."""
+    os.sched_setaffinity(0, placement.cpus)
+    if not _prefer_node(placement.node):
+        logger.debug("Memory policy is not set, memory is allocated on the node of the first touch")
+    logger.info("Process %d is pinned to cores %s of NUMA node %d", os.getpid(), placement.cpus, placement.node)
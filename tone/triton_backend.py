@@ -0,0 +1,581 @@
+"""Module with an acoustic model backend running the model on a remote Triton Inference Server.
+
+Requests follow KServe v2 inference protocol (used by Triton) with `signal`/`state` inputs and
+`logprobs`/`state_next` outputs of `configs/streaming_acoustic`. Over HTTP, tensors are sent in
+binary form (binary data extension) through a pool of keep-alive connections, nothing but the
+standard library is required. gRPC requires `tritonclient` package.
+
+    model = TritonAcousticModel("localhost:8000")
+    pipeline = StreamingCTCPipeline.from_hugging_face(acoustic_model=model)
+
+With a model served with implicit state (`configs/streaming_acoustic_implicit`, generated by
+`tone.scripts.triton_config --implicit-state`), the state stays on the server and only the audio
+chunk and the log-probabilities are sent over the network:
+
+    model = TritonAcousticModel("localhost:8000", model_name="streaming_acoustic_implicit", implicit_state=True)
+"""
+
+from __future__ import annotations
+
+import http.client
+import itertools
+import json
+import logging
+import random
+import select
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any
+from urllib.parse import urlsplit
+
+import numpy as np
+from typing_extensions import Self
+
+from tone.model_manifest import ModelManifest
+from tone.onnx_wrapper import StreamingCTCModel, file_sha256
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Mapping, Sequence
+    from pathlib import Path
+
+    import numpy.typing as npt
+
+    from tone.acoustic_backend import BackendState, SequenceIds
+
+logger = logging.getLogger(__name__)
+
+INPUT_NAMES = ("signal", "state")
+OUTPUT_NAMES = ("logprobs", "state_next")
+
+DATATYPES: dict[np.dtype[Any], str] = {
+    np.dtype(np.int32): "INT32",
+    np.dtype(np.float16): "FP16",
+    np.dtype(np.float32): "FP32",
+}
+_NUMPY_DTYPES = {datatype: dtype for dtype, datatype in DATATYPES.items()}
+
+
+class TritonError(RuntimeError):
+    """Inference request to the server failed."""
+
+
+def encode_message(
+    header: Mapping[str, Any],
+    section: str,
+    tensors: Mapping[str, npt.NDArray[Any]],
+) -> tuple[bytes, int]:
+    """Encode KServe v2 inference request or response with tensors in binary form.
+
+    Args:
+        header (Mapping[str, Any]): JSON part of the message without the tensors.
+        section (str): Key of the tensors in the JSON part: "inputs" or "outputs".
+        tensors (Mapping[str, npt.NDArray[Any]]): Tensors by their names.
+
+    Returns:
+        tuple[bytes, int]: Body of the message and length of its JSON part
+            (value of `Inference-Header-Content-Length` header).
+
+    """
+    arrays = [np.ascontiguousarray(array) for array in tensors.values()]
+    entries = [
+        {
+            "name": name,
+            "shape": list(array.shape),
+            "datatype": DATATYPES[array.dtype],
+            "parameters": {"binary_data_size": array.nbytes},
+        }
+        for name, array in zip(tensors, arrays)
+    ]
+    json_part = json.dumps({**header, section: entries}).encode()
+    return b"".join([json_part, *(array.tobytes() for array in arrays)]), len(json_part)
+
+
+def decode_message(
+    body: bytes,
+    header_length: int | None,
+    section: str,
+) -> tuple[dict[str, Any], dict[str, npt.NDArray[Any]]]:
+    """Decode KServe v2 inference request or response with tensors in binary or JSON form.
+
+    Args:
+        body (bytes): Body of the message.
+        header_length (int | None): Length of the JSON part, or None if the whole body is JSON.
+        section (str): Key of the tensors in the JSON part: "inputs" or "outputs".
+
+    Returns:
+        tuple[dict[str, Any], dict[str, npt.NDArray[Any]]]: JSON part of the message and the tensors by their names.
+
+    """
+    header = json.loads(body[:header_length] if header_length is not None else body)
+    offset = header_length if header_length is not None else len(body)
+    tensors: dict[str, npt.NDArray[Any]] = {}
+    for entry in header.get(section, []):
+        dtype = _NUMPY_DTYPES.get(entry["datatype"])
+        if dtype is None:
+            raise TritonError(f"Unsupported datatype of tensor '{entry['name']}': {entry['datatype']}")
+        size = entry.get("parameters", {}).get("binary_data_size")
+        if size is None:
+            tensors[entry["name"]] = np.asarray(entry["data"], dtype=dtype).reshape(entry["shape"])
+        else:
+            array = np.frombuffer(body, dtype=dtype, count=size // dtype.itemsize, offset=offset)
+            if not array.flags.aligned:  # Tensors follow the JSON part of arbitrary length
+                array = array.copy()
+            tensors[entry["name"]] = array.reshape(entry["shape"])
+            offset += size
+    return header, tensors
+
+
+def _is_dropped(connection: http.client.HTTPConnection) -> bool:
+    """Check whether the server closed the idle keep-alive connection (it is readable only at EOF)."""
+    if connection.sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([connection.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+class _ConnectionPool:
+    """Thread-safe pool of keep-alive HTTP connections to one server."""
+
+    def __init__(self, host: str, port: int, *, https: bool, max_connections: int, timeout: float) -> None:
+        self.host = host
+        self.port = port
+        self.https = https
+        self.timeout = timeout
+        self._idle: list[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_connections)
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        body: bytes | None = None,
+        headers: Mapping[str, str] | None = None,
+        *,
+        idempotent: bool = True,
+    ) -> tuple[int, http.client.HTTPMessage, bytes]:
+        """Send request and return status, headers and body of the response.
+
+        Idle connections closed by the server are skipped before sending. An idempotent request is
+        resent over a new connection if a reused one still fails, other requests (e.g. of a sequence,
+        which advance its state on the server) are never sent twice.
+        """
+        with self._slots:
+            connection = self._take_idle()
+            if connection is not None and idempotent:
+                try:
+                    return self._send(connection, method, path, body, headers)
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    pass  # The server closed the connection while it was checked, retry with a new one
+            elif connection is not None:
+                return self._send(connection, method, path, body, headers)
+            return self._send(self._connect(), method, path, body, headers)
+
+    def _take_idle(self) -> http.client.HTTPConnection | None:
+        """Take an idle connection that is still open, closing the dropped ones."""
+        while True:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+            if connection is None or not _is_dropped(connection):
+                return connection
+            connection.close()
+
+    def _send(
+        self,
+        connection: http.client.HTTPConnection,
+        method: str,
+        path: str,
+        body: bytes | None,
+        headers: Mapping[str, str] | None,
+    ) -> tuple[int, http.client.HTTPMessage, bytes]:
+        try:
+            connection.request(method, path, body=body, headers=dict(headers or {}))
+            response = connection.getresponse()
+            data = response.read()
+        except BaseException:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            with self._lock:
+                self._idle.append(connection)
+        return response.status, response.headers, data
+
+    def close(self) -> None:
+        """Close idle connections."""
+        with self._lock:
+            for connection in self._idle:
+                connection.close()
+            self._idle.clear()
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.https:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+
+class TritonAcousticModel:
+    """Acoustic model backend sending audio chunks to a remote Triton Inference Server.
+
+    Implements `AcousticBackend`, so it can be used by `StreamingCTCPipeline` instead of the local
+    `StreamingCTCModel`. Requests are sent through a pool of `max_connections` connections. `forward`
+    blocks until the response is received, so requests of one stream are sent in order, while requests
+    of different sessions (calling `forward` from several threads) and of the streams of one batch are
+    in flight at once and batched by the server. Every request may carry sequence parameters
+    (`sequence_id`, `sequence_start`, `sequence_end`) for models served with a sequence batcher.
+
+    With `implicit_state=True` the state of every stream is kept by the server, and the state passed
+    through the pipeline is a handle: id of the sequence of shape (B, 1). Every stream of a batch is
+    sent as a separate request of its sequence (the server batches them again), a new sequence is
+    started for a None state (or a zero state/id of a new stream in `StreamingCTCPipeline.forward_batch`).
+    Requests of one stream must be sent one after another. The last chunk of a stream is sent with
+    `sequence_end` (`StreamingCTCPipeline` does it for `is_last` chunks), and `end_sequences` releases
+    the state of streams abandoned before their last chunk. Otherwise the server releases the state
+    after `max_sequence_idle_microseconds` of the model config.
+    """
+
+    # Sizes of the served model (the default 300 ms model of `configs/streaming_acoustic`),
+    # a model with a manifest overrides them on the instance
+    SAMPLE_RATE = StreamingCTCModel.SAMPLE_RATE
+    MEAN_TIME_BIAS = StreamingCTCModel.MEAN_TIME_BIAS
+    AUDIO_CHUNK_SAMPLES = StreamingCTCModel.AUDIO_CHUNK_SAMPLES
+    FRAME_SIZE = StreamingCTCModel.FRAME_SIZE
+    STATE_SIZE = StreamingCTCModel.STATE_SIZE
+
+    def __init__(
+        self,
+        url: str,
+        *,
+        model_name: str = "streaming_acoustic",
+        model_version: str = "",
+        protocol: str = "http",
+        max_connections: int = 8,
+        timeout: float = 10.0,
+        fingerprint: str | None = None,
+        implicit_state: bool = False,
+        manifest: ModelManifest | None = None,
+    ) -> None:
+        """Create backend.
+
+        Args:
+            url (str): Address of the server, e.g. "localhost:8000" or "https://triton:8000" for HTTP,
+                "localhost:8001" for gRPC.
+            model_name (str): Name of the model in the model repository of the server.
+            model_version (str): Version of the model, or empty string for the server policy.
+            protocol (str): "http" or "grpc".
+            max_connections (int): Maximum number of requests in flight (connections of HTTP pool).
+            timeout (float): Timeout of a request (in sec).
+            fingerprint (str | None): Identity of the served model weights, e.g. hash of the model file
+                (see `StreamingCTCModel.fingerprint`), or None to identify the model by its address.
+            implicit_state (bool): Whether the model is served with implicit state (sequence batcher keeps the state).
+            manifest (ModelManifest | None): Manifest of the served model (see `ModelManifest.load`),
+                or None for the published model.
+
+        """
+        if protocol not in {"http", "grpc"}:
+            raise ValueError(f"'protocol' must be 'http' or 'grpc', but got {protocol!r}")
+        if max_connections <= 0:
+            raise ValueError(f"'max_connections' must be positive, but got {max_connections}")
+        self.url = url
+        self.model_name = model_name
+        self.model_version = model_version
+        self.protocol = protocol
+        self.timeout = timeout
+        self._fingerprint = fingerprint
+        self.implicit_state = implicit_state
+        self.manifest = manifest if manifest is not None else ModelManifest()
+        self.SAMPLE_RATE = self.manifest.sample_rate
+        self.MEAN_TIME_BIAS = self.manifest.mean_time_bias
+        self.AUDIO_CHUNK_SAMPLES = self.manifest.audio_chunk_samples
+        self.FRAME_SIZE = self.manifest.frame_size
+        self.STATE_SIZE = self.manifest.state_size
+        # Threads sending requests of the streams of one batch
+        self._row_executor = ThreadPoolExecutor(max_connections, thread_name_prefix="triton-row")
+        # Random start, so sequences of several clients (or restarted clients) do not collide on the server
+        self._sequence_ids = itertools.count(random.randrange(1, 2**62))  # noqa: S311
+        self._pool: _ConnectionPool | None = None
+        self._grpc_client: Any = None
+        if protocol == "http":
+            parts = urlsplit(url if "://" in url else f"http://{url}")
+            https = parts.scheme == "https"
+            self._pool = _ConnectionPool(
+                parts.hostname or "localhost",
+                parts.port or (443 if https else 80),
+                https=https,
+                max_connections=max_connections,
+                timeout=timeout,
+            )
+        else:
+            try:
+                from tritonclient import grpc as grpcclient
+            except ImportError as e:
+                raise ModuleNotFoundError(
+                    "Package 'tritonclient' not found.\n"
+                    "Install it with the following command:\n"
+                    "  poetry install -E triton   # using package extras\n",
+                ) from e
+            self._grpc_client = grpcclient.InferenceServerClient(url.rsplit("://", maxsplit=1)[-1])
+
+    @classmethod
+    def for_local_model(cls, url: str, model_path: Path, **kwargs: Any) -> Self:
+        """Create backend for a server serving a copy of the local model.
+
+        The manifest and the fingerprint (the same as `StreamingCTCModel.fingerprint` of the local model)
+        are taken from the local file, so cache keys change when the model changes, not only its address.
+        Without the local file, the model is identified by its address and the published manifest is used.
+
+        Args:
+            url (str): Address of the server, see `__init__`.
+            model_path (Path): Path to the local copy of the served ONNX model.
+            **kwargs: Other arguments of `__init__`.
+
+        Returns:
+            Self: Backend of the served model.
+
+        """
+        fingerprint = file_sha256(model_path)[:32] if model_path.exists() else None
+        return cls(url, fingerprint=fingerprint, manifest=ModelManifest.load(model_path), **kwargs)
+
+    @property
+    def fingerprint(self) -> str:
+        """Identity of the model weights, or of the model address if the weights are unknown."""
+        if self._fingerprint is not None:
+            return self._fingerprint
+        return f"triton-{self.url}/{self.model_name}/{self.model_version or 'default'}"
+
+    @property
+    def _model_path(self) -> str:
+        if self.model_version:
+            return f"/v2/models/{self.model_name}/versions/{self.model_version}"
+        return f"/v2/models/{self.model_name}"
+
+    def is_ready(self) -> bool:
+        """Check that the model is loaded on the server and ready for inference."""
+        try:
+            if self._grpc_client is not None:
+                return bool(self._grpc_client.is_model_ready(self.model_name, self.model_version))
+            assert self._pool is not None
+            status, _, _ = self._pool.request("GET", f"{self._model_path}/ready")
+        except OSError:
+            return False
+        return status == 200
+
+    def forward(
+        self,
+        audio_chunk: StreamingCTCModel.InputType,
+        state: BackendState | None = None,
+        *,
+        sequence_id: int = 0,
+        sequence_start: bool = False,
+        sequence_end: bool | Sequence[bool] = False,
+    ) -> tuple[StreamingCTCModel.OutputType, BackendState]:
+        """Run the acoustic model on the server, see `StreamingCTCModel.forward`.
+
+        Args:
+            audio_chunk (StreamingCTCModel.InputType): A batch of audio chunks, shape (B, 2400, 1).
+            state (BackendState | None): Previous state, shape (B, 219729), or None to initialize.
+                With implicit state, ids of the sequences returned by the previous call (`SequenceIds`).
+            sequence_id (int): Id of the sequence (stream) for a sequence batcher, 0 if not used.
+            sequence_start (bool): Whether this is the first request of the sequence.
+            sequence_end (bool | Sequence[bool]): Whether this is the last request of the sequence, the server
+                releases the state. With implicit state, it may be given for every stream of the batch.
+
+        Returns:
+            Tuple[OutputType, BackendState]: Log-probabilities and the next state
+                (ids of the sequences of shape (B, 1) with implicit state).
+
+        Raises:
+            TritonError: If the server failed to process the request.
+
+        """
+        if not isinstance(audio_chunk, np.ndarray):
+            raise TypeError(f"Incorrect 'audio_chunk' type: expected np.ndarray, but got {type(audio_chunk)}")
+        if audio_chunk.shape[1:] != (self.AUDIO_CHUNK_SAMPLES, 1):
+            raise ValueError(
+                f"Shape of 'audio_chunk' must be (B, {self.AUDIO_CHUNK_SAMPLES}, 1), but got {audio_chunk.shape}",
+            )
+        batch_size = audio_chunk.shape[0]
+        sequence_ends = np.broadcast_to(np.asarray(sequence_end, dtype=bool), (batch_size,))
+        if self.implicit_state:
+            if sequence_id or sequence_start:
+                raise ValueError("With implicit state, sequences are identified by 'state', not by 'sequence_id'")
+            return self._forward_implicit(audio_chunk.astype(np.int32, copy=False), state, sequence_ends=sequence_ends)
+        state_dtype = self.manifest.numpy_state_dtype
+        if state is None:
+            state = np.zeros((batch_size, self.STATE_SIZE), dtype=state_dtype)
+        if state.shape != (batch_size, self.STATE_SIZE):
+            raise ValueError(
+                f"Shape of 'state' must be ({batch_size}, {self.STATE_SIZE}), but got {state.shape}",
+            )
+        inputs = {"signal": audio_chunk.astype(np.int32, copy=False), "state": state.astype(state_dtype, copy=False)}
+        parameters: dict[str, Any] = {}
+        if sequence_id:  # All streams of the batch belong to one sequence
+            parameters = {
+                "sequence_id": sequence_id,
+                "sequence_start": sequence_start,
+                "sequence_end": bool(sequence_ends.all()),
+            }
+        outputs = self._infer(inputs, parameters)
+        return outputs["logprobs"], outputs["state_next"]
+
+    def _forward_implicit(
+        self,
+        audio_chunk: StreamingCTCModel.InputType,
+        state: BackendState | None,
+        *,
+        sequence_ends: npt.NDArray[np.bool_],
+    ) -> tuple[StreamingCTCModel.OutputType, SequenceIds]:
+        batch_size = audio_chunk.shape[0]
+        if state is not None and state.shape == (batch_size, 1):
+            sequence_ids = state.astype(np.int64)
+        elif state is None or (state.shape[0] == batch_size and not np.any(state)):
+            sequence_ids = np.zeros((batch_size, 1), dtype=np.int64)  # Initial state: all streams are new
+        else:
+            raise ValueError(
+                f"With implicit state, 'state' must be ids of the sequences of shape ({batch_size}, 1) "
+                f"returned by the previous call, but got {state.shape}",
+            )
+        is_new = sequence_ids[:, 0] == 0
+        for i in np.flatnonzero(is_new):
+            sequence_ids[i, 0] = next(self._sequence_ids)
+
+        def infer_row(i: int) -> StreamingCTCModel.OutputType:
+            parameters = {
+                "sequence_id": int(sequence_ids[i, 0]),
+                "sequence_start": bool(is_new[i]),
+                "sequence_end": bool(sequence_ends[i]),
+            }
+            return self._infer({"signal": audio_chunk[i : i + 1]}, parameters, ("logprobs",))["logprobs"]
+
+        if batch_size == 1:
+            return infer_row(0), sequence_ids
+        logprobs = list(self._row_executor.map(infer_row, range(batch_size)))
+        return np.concatenate(logprobs), sequence_ids
+
+    def end_sequences(self, state: BackendState | None) -> None:
+        """Release the state of streams abandoned before their last chunk (implicit state only).
+
+        A silent chunk is sent with `sequence_end` for every started stream. Failures are only logged,
+        the server releases the state after the idle timeout anyway.
+
+        Args:
+            state (BackendState | None): Ids of the sequences returned by the last call.
+
+        """
+        if not self.implicit_state or state is None:
+            return
+        sequence_ids = np.asarray(state, dtype=np.int64).reshape(-1)
+        silence = np.zeros((1, self.AUDIO_CHUNK_SAMPLES, 1), dtype=np.int32)
+        for sequence_id in sequence_ids[sequence_ids != 0]:
+            parameters = {"sequence_id": int(sequence_id), "sequence_start": False, "sequence_end": True}
+            try:
+                self._infer({"signal": silence}, parameters, ("logprobs",))
+            except (TritonError, OSError) as error:
+                logger.warning("Failed to end sequence %d: %s", sequence_id, error)
+
+    def warmup(self, batch_sizes: Iterable[int] = (1,), *, count: int = 3) -> None:
+        """Send short streams of silent chunks, so the server makes one-off allocations before the real requests.
+
+        Works like `StreamingCTCModel.warmup`. A model with implicit state can not be warmed up by the
+        `model_warmup` section of its config (warmup requests do not belong to a sequence), so the services
+        call this at startup: every stream starts a sequence and its last chunk ends it, releasing the state.
+        Failures are only logged, the server may still be loading the model.
+
+        Args:
+            batch_sizes (Iterable[int]): Batch sizes (numbers of streams) to warm up the model with.
+            count (int): Number of consecutive chunks of every stream.
+
+        """
+        for batch_size in batch_sizes:
+            audio_chunk = np.zeros((batch_size, self.AUDIO_CHUNK_SAMPLES, 1), dtype=np.int32)
+            state: BackendState | None = None
+            start = time.perf_counter()
+            try:
+                for i in range(count):
+                    _, state = self.forward(audio_chunk, state, sequence_end=i == count - 1)
+            except (TritonError, OSError) as error:
+                logger.warning("Warmup of model %s failed: %s", self.model_name, error)
+                self.end_sequences(state)
+                return
+            logger.info(
+                "Warmup with batch size %d: %d requests in %.3f sec",
+                batch_size,
+                count,
+                time.perf_counter() - start,
+            )
+
+    def close(self) -> None:
+        """Wait for requests in flight and close connections."""
+        self._row_executor.shutdown()
+        if self._pool is not None:
+            self._pool.close()
+        if self._grpc_client is not None:
+            self._grpc_client.close()
+
+    def _infer(
+        self,
+        inputs: Mapping[str, npt.NDArray[Any]],
+        parameters: Mapping[str, Any],
+        output_names: tuple[str, ...] = OUTPUT_NAMES,
+    ) -> dict[str, npt.NDArray[Any]]:
+        if self._grpc_client is not None:
+            return self._infer_grpc(inputs, parameters, output_names)
+        assert self._pool is not None
+        header: dict[str, Any] = {
+            "outputs": [{"name": name, "parameters": {"binary_data": True}} for name in output_names],
+        }
+        if parameters:
+            header["parameters"] = dict(parameters)
+        body, header_length = encode_message(header, "inputs", inputs)
+        status, headers, data = self._pool.request(
+            "POST",
+            f"{self._model_path}/infer",
+            body,
+            {"Content-Type": "application/octet-stream", "Inference-Header-Content-Length": str(header_length)},
+            idempotent=not parameters,  # A resent request of a sequence would advance its state twice
+        )
+        if status != 200:
+            try:
+                error = json.loads(data).get("error", "")
+            except ValueError:
+                error = data[:200].decode(errors="replace")
+            raise TritonError(f"Inference request failed with status {status}: {error}")
+        response_header_length = headers.get("Inference-Header-Content-Length")
+        _, outputs = decode_message(
+            data,
+            int(response_header_length) if response_header_length is not None else None,
+            "outputs",
+        )
+        return outputs
+
+    def _infer_grpc(
+        self,
+        inputs: Mapping[str, npt.NDArray[Any]],
+        parameters: Mapping[str, Any],
+        output_names: tuple[str, ...],
+    ) -> dict[str, npt.NDArray[Any]]:
+        from tritonclient import grpc as grpcclient
+        from tritonclient.utils import InferenceServerException
+
+        infer_inputs = []
+        for name, array in inputs.items():
+            infer_input = grpcclient.InferInput(name, list(array.shape), DATATYPES[array.dtype])
+            infer_input.set_data_from_numpy(array)
+            infer_inputs.append(infer_input)
+        try:
+            result = self._grpc_client.infer(
+                self.model_name,
+                infer_inputs,
+                model_version=self.model_version,
+                outputs=[grpcclient.InferRequestedOutput(name) for name in output_names],
+                client_timeout=self.timeout,
+                **parameters,
+            )
+        except InferenceServerException as e:
+            raise TritonError(f"Inference request failed: {e}") from e
+        return {name: result.as_numpy(name) for name in output_names}